@@ -10,6 +10,7 @@ version = voseq.__version__
 
 requirements = [
     'biopython',
+    'numpy',
     'Django',
     'pyprind',
     'elasticsearch',
@@ -0,0 +1 @@
+default_app_config = 'blast_local.apps.BlastLocalConfig'
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class BlastLocalConfig(AppConfig):
+    name = 'blast_local'
+
+    def ready(self):
+        # Keeps the k-mer indexes up to date when sequences are saved.
+        from . import signals  # noqa
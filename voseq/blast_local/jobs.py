@@ -0,0 +1,159 @@
+"""
+Queue of BLAST searches, a ``core.jobs.JobQueue``.
+
+Views submit a search as a ``BlastJob`` and worker processes started with
+``python manage.py run_blast_jobs`` run ``blastn`` or query NCBI, so long
+searches do not tie up web server workers. If
+``settings.BLAST_JOBS_ALWAYS_EAGER`` is True, jobs are run as soon as they
+are submitted, inside the request.
+
+The number of workers caps how many searches run at the same time, and each
+``blastn`` run uses ``settings.BLAST_NUM_THREADS`` threads. At most
+``settings.BLAST_JOBS_MAX_HEAVY`` searches against all our sequences, batches
+or NCBI run at once, so they cannot keep the workers from quick searches.
+
+Jobs running for longer than ``settings.BLAST_JOBS_RUNNING_TIMEOUT`` seconds
+are taken as abandoned by a worker that was stopped or crashed, and marked as
+failed, so they are neither shared with new searches nor counted as running.
+"""
+import hashlib
+import json
+import logging
+import traceback
+
+from django.conf import settings
+from django.utils import timezone
+
+from blast_local_full.utils import BLASTFull
+from blast_ncbi.utils import BLASTNcbi
+from blast_new.utils import BLASTBatch
+from blast_new.utils import BLASTNew
+from core.jobs import JobQueue
+from public_interface.models import Genes
+from .models import BlastJob
+from .utils import BLAST
+
+
+log = logging.getLogger(__name__)
+
+HEAVY_BLAST_TYPES = ['full', 'batch', 'ncbi']
+
+
+def get_job_key(blast_type, params):
+    """Hash of the BLAST type and search parameters."""
+    dumped = json.dumps([blast_type, params], sort_keys=True)
+    return hashlib.sha1(dumped.encode('utf-8')).hexdigest()
+
+
+def submit_job(blast_type, params):
+    """Queues a BLAST search, unless an identical one is waiting or running.
+
+    :param blast_type: local, full, new, batch or ncbi.
+    :param params: dict with the arguments taken by ``get_blast``.
+    :return: BlastJob.
+    """
+    key = get_job_key(blast_type, params)
+    queue.fail_abandoned_jobs()
+    queued = BlastJob.objects.filter(
+        key=key,
+        status__in=[BlastJob.PENDING, BlastJob.RUNNING],
+    ).order_by('-time_created')
+    for job in queued:
+        return job
+
+    return queue.create_job(
+        key=key,
+        blast_type=blast_type,
+        params=json.dumps(params),
+    )
+
+
+def count_running_heavy():
+    return BlastJob.objects.filter(status=BlastJob.RUNNING,
+                                   blast_type__in=HEAVY_BLAST_TYPES).count()
+
+
+def is_over_heavy_limit(job):
+    """Whether a claimed heavy job is not among the first
+    ``settings.BLAST_JOBS_MAX_HEAVY`` running ones. Workers claiming heavy
+    jobs at the same time agree on the jobs kept, as they are ordered by the
+    time they were started.
+    """
+    first_running = BlastJob.objects.filter(
+        status=BlastJob.RUNNING,
+        blast_type__in=HEAVY_BLAST_TYPES,
+    ).order_by('time_started', 'pk').values_list('pk', flat=True)
+    return job.pk not in list(first_running[:settings.BLAST_JOBS_MAX_HEAVY])
+
+
+def get_blast(blast_type, params):
+    """
+    :return: BLAST object that runs the search of a job.
+    """
+    if blast_type == 'local':
+        return BLAST('local', params['voucher_code'], params['gene_code'])
+    if blast_type == 'full':
+        return BLASTFull('full', params['voucher_code'], params['gene_code'])
+    if blast_type == 'ncbi':
+        return BLASTNcbi(params['voucher_code'], params['gene_code'])
+
+    genes = Genes.objects.filter(gene_code__in=params['gene_codes'])
+    if blast_type == 'new':
+        return BLASTNew('new', params['name'], params['sequence'], genes)
+    if blast_type == 'batch':
+        queries = [tuple(i) for i in params['queries']]
+        return BLASTBatch('new', queries, genes)
+    raise ValueError('Unknown BLAST type: %s' % blast_type)
+
+
+class BlastJobQueue(JobQueue):
+    """Heavy searches are left waiting while ``settings.BLAST_JOBS_MAX_HEAVY``
+    of them are running. Heavy jobs claimed by several workers at once beyond
+    the limit are put back in the queue.
+    """
+    model = BlastJob
+    name = 'BLAST'
+    settings_prefix = 'BLAST_JOBS'
+    error_message = 'Could not run BLAST: %s'
+
+    def get_pending_jobs(self):
+        pending = super(BlastJobQueue, self).get_pending_jobs()
+        if count_running_heavy() >= settings.BLAST_JOBS_MAX_HEAVY:
+            pending = pending.exclude(blast_type__in=HEAVY_BLAST_TYPES)
+        return pending.only('pk', 'blast_type')
+
+    def must_wait(self, job):
+        return job.blast_type in HEAVY_BLAST_TYPES and is_over_heavy_limit(job)
+
+    def run_job(self, job):
+        """Runs the BLAST search of a claimed job and saves the hits."""
+        blast = None
+        try:
+            blast = get_blast(job.blast_type, job.get_params())
+            blast.update_blast_db()
+            hits = blast.search()
+        except Exception as e:
+            log.error("BLAST job %s failed:\n%s", job.job_id, traceback.format_exc())
+            if blast is not None:
+                blast.delete_query_output_files()
+            job.status = BlastJob.FAILED
+            job.errors = json.dumps([self.error_message % e])
+        else:
+            job.status = BlastJob.FINISHED
+            job.hits = json.dumps(hits)
+
+        job.time_finished = timezone.now()
+        job.save()
+        return job
+
+    def get_job_status(self, job):
+        status = super(BlastJobQueue, self).get_job_status(job)
+        status['blast_type'] = job.blast_type
+        if job.status == BlastJob.FINISHED:
+            status['hits'] = job.get_hits()
+        elif job.status == BlastJob.FAILED:
+            status['errors'] = job.get_errors()
+        return status
+
+
+queue = BlastJobQueue()
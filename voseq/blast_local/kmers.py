@@ -0,0 +1,352 @@
+"""
+Index of the minimizers of our sequences, to find the vouchers closest to a
+sequence in milliseconds, without running ``blastn``.
+
+A minimizer is the k-mer with the lowest hash among ``WINDOW_SIZE``
+consecutive k-mers of a sequence. Close sequences share most of their
+minimizers, and the fraction of the minimizers of a query found in a sequence
+gives an estimate of their identity.
+
+There is an index for the sequences of each gene and one for all sequences,
+kept in ``settings.KMER_INDEX_DIR``. Each build of an index is saved as the
+``core.builds.Postings`` of the minimizers of its sequences, which web
+workers read memory-mapped.
+
+Sequences saved or deleted after a build are kept in a small delta file,
+which is merged with the build when searching, until there are
+``MAX_DELTA_SIZE`` of them and the index is built again. Web workers keep the
+delta in memory with the same arrays, and read it again only when the file
+changes.
+
+Sequences changed without updating the index, as imports do, are found by
+comparing the index with the database, at most every
+``MANIFEST_CHECK_INTERVAL`` seconds while the index does not change.
+"""
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+
+from core.builds import BuildStore
+from core.builds import Postings
+from core.builds import make_arrays
+from core.utils import write_file_atomically
+from public_interface.models import Sequences
+from .utils import get_gene_manifests
+from .utils import get_sequences_manifest
+from .utils import iter_sequences
+from .utils import strip_question_marks
+
+
+KMER_SIZE = 12
+WINDOW_SIZE = 10
+
+# Sequences saved since the last build above which the index is built again.
+MAX_DELTA_SIZE = 1000
+
+# Seconds a web worker trusts an index found up to date with the database.
+MANIFEST_CHECK_INTERVAL = 10
+
+# Bases as 2 bit numbers. Other characters break k-mers.
+BASE_CODES = np.full(256, 4, dtype=np.uint32)
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+# Version of the delta of each index when it was last found up to date with
+# the database, and when.
+_checked_indexes = {}
+
+
+def get_minimizers(seq):
+    """
+    :return: sorted numpy array with the distinct minimizers of a sequence.
+    """
+    codes = BASE_CODES[np.frombuffer(seq.encode('ascii', 'replace'), dtype=np.uint8)]
+    kmer_count = len(codes) - KMER_SIZE + 1
+    if kmer_count < 1:
+        return np.zeros(0, dtype=np.uint32)
+
+    kmers = np.zeros(kmer_count, dtype=np.uint32)
+    invalid = np.zeros(kmer_count, dtype=bool)
+    for i in range(KMER_SIZE):
+        bases = codes[i:i + kmer_count]
+        kmers = (kmers << np.uint32(2)) | (bases & np.uint32(3))
+        invalid |= bases > 3
+
+    # Scrambled, as k-mers full of As would otherwise be the minimizers of
+    # most windows.
+    hashes = (kmers.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xffffffff)
+    hashes[invalid] = np.uint64(1 << 32)
+
+    window_size = min(WINDOW_SIZE, kmer_count)
+    window_count = kmer_count - window_size + 1
+    windows = np.lib.stride_tricks.as_strided(
+        hashes, shape=(window_count, window_size), strides=(hashes.strides[0], hashes.strides[0]))
+    positions = np.arange(window_count) + windows.argmin(axis=1)
+    positions = positions[~invalid[positions]]
+    return np.unique(kmers[positions])
+
+
+def estimate_identity(shared, query_count):
+    """Each shared minimizer is a k-mer without differences, which is found
+    in both sequences with probability identity ** KMER_SIZE.
+
+    :return: percentage of identity.
+    """
+    if query_count == 0:
+        return 0.0
+    return round(100 * (shared / query_count) ** (1 / KMER_SIZE), 1)
+
+
+class KmerIndex(BuildStore):
+    """
+    Minimizer index of the sequences of one gene or of all genes in our
+    database. Sequences saved since the last build are kept in a delta file.
+    """
+    def __init__(self, name, gene_codes=None):
+        """
+        :param name: name of the index files.
+        :param gene_codes: list of gene codes of the sequences. None to use
+                           all sequences.
+        """
+        self.name = name
+        if gene_codes is not None:
+            gene_codes = sorted(set(gene_codes))
+        self.gene_codes = gene_codes
+        super(KmerIndex, self).__init__(os.path.join(settings.KMER_INDEX_DIR, name + '.'))
+        self.delta_file = self.prefix + 'delta.json'
+
+    def __str__(self):
+        return 'k-mer index ' + self.name
+
+    def get_queryset(self):
+        if self.gene_codes is None:
+            return Sequences.objects.all()
+        return Sequences.objects.filter(gene_code__in=self.gene_codes)
+
+    def get_manifest(self):
+        return get_sequences_manifest(self.get_queryset())
+
+    def read_delta(self, build):
+        """
+        :return: dict with the sequences saved since the build, by primary
+                 key, and the manifest of the sequences once they were saved.
+                 Deleted sequences are None.
+        """
+        try:
+            with open(self.delta_file) as handle:
+                delta = json.load(handle)
+        except (IOError, ValueError):
+            delta = {}
+        if delta.get('build') != build:
+            delta = {'build': build, 'manifest': None, 'sequences': {}}
+        return delta
+
+    def get_delta_version(self, build):
+        return (build,) + self.get_file_version(self.delta_file)
+
+    def load_delta(self, build):
+        """
+        :return: dict with the delta of the build as ``read_delta`` returns
+                 it, the primary keys of the sequences in it as ``changed``,
+                 its saved sequences (code, gene code) as ``saved`` and the
+                 Postings of their minimizers as ``postings``.
+        """
+        def load():
+            delta = self.read_delta(build)
+            saved = [i for i in delta['sequences'].values() if i is not None]
+            delta['postings'] = Postings(**make_arrays(
+                [np.array(i[2], dtype=np.uint32) for i in saved], np.uint32))
+            delta['changed'] = set(delta['sequences'])
+            delta['saved'] = [i[:2] for i in saved]
+            return delta
+
+        return self.get_loaded('delta', self.get_delta_version(build), load)
+
+    def is_up_to_date(self, manifest=None):
+        """
+        :param manifest: manifest of the sequences in our database. It is
+                         taken from the database if not given, unless the
+                         index was found up to date in the last
+                         ``MANIFEST_CHECK_INTERVAL`` seconds.
+        """
+        built = self.read_manifest()
+        if built is None or [built['kmer_size'], built['window_size']] != [KMER_SIZE, WINDOW_SIZE]:
+            return False
+        delta = self.load_delta(built['build'])
+        if len(delta['changed']) > MAX_DELTA_SIZE:
+            return False
+
+        version = self.get_delta_version(built['build'])
+        if manifest is None:
+            checked = _checked_indexes.get(self.prefix)
+            if checked is not None and checked[0] == version and \
+                    time.time() - checked[1] < MANIFEST_CHECK_INTERVAL:
+                return True
+            manifest = self.get_manifest()
+
+        up_to_date = (delta['manifest'] or built['sequences']) == manifest
+        if up_to_date:
+            _checked_indexes[self.prefix] = (version, time.time())
+        return up_to_date
+
+    def update(self):
+        """Builds the index again if sequences were changed without updating
+        it, as imports do, or if its delta is too big.
+
+        :return: True if the index was built.
+        """
+        if self.is_up_to_date():
+            return False
+
+        with self.lock():
+            manifest = self.get_manifest()
+            if self.is_up_to_date(manifest):
+                return False
+            self.build(manifest)
+        return True
+
+    def build(self, manifest):
+        """Indexes our sequences and makes it the current build. Should be
+        called holding the lock, so sequences saved meanwhile wait for the new
+        build to add themselves to its delta.
+
+        :param manifest: manifest of the sequences, taken before reading them.
+        """
+        build = self.new_build()
+
+        sequences = []
+        minimizers = []
+        fields = ('id', 'code_id', 'gene_code', 'sequences')
+        for pk, code_id, gene_code, seq in iter_sequences(self.get_queryset(), fields=fields):
+            sequence_minimizers = get_minimizers(strip_question_marks(seq))
+            if len(sequence_minimizers) > 0:
+                sequences.append([pk, code_id, gene_code])
+                minimizers.append(sequence_minimizers)
+
+        self.save_postings(build, Postings(**make_arrays(minimizers, np.uint32)))
+        with open(self.get_build_file(build, 'sequences.json'), 'w') as handle:
+            json.dump(sequences, handle)
+
+        self.publish_build(build, {
+            'kmer_size': KMER_SIZE,
+            'window_size': WINDOW_SIZE,
+            'sequences': manifest,
+        })
+
+    def load_build(self, build):
+        """
+        :return: tuple with the Postings of a build, memory-mapped, and its
+                 list of sequences (primary key, code, gene code).
+        """
+        def load():
+            with open(self.get_build_file(build, 'sequences.json')) as handle:
+                sequences = json.load(handle)
+            return Postings(*self.load_postings(build)), sequences
+
+        return self.get_loaded('build', build, load)
+
+    def save_sequence(self, pk, code_id, gene_code, seq, manifest=None):
+        """Adds a saved sequence to the delta of the current build. Nothing is
+        done if the index has not been built yet.
+
+        :param seq: the sequence, or None if it was deleted.
+        :param manifest: manifest of the sequences of the index once the
+                         sequence was saved. It is taken from the database if
+                         not given.
+        """
+        if self.read_manifest() is None:
+            return
+        if manifest is None:
+            manifest = self.get_manifest()
+
+        with self.lock():
+            # The index may have been built again while waiting for the lock.
+            build = self.read_manifest()['build']
+            delta = self.read_delta(build)
+            if seq is None:
+                delta['sequences'][str(pk)] = None
+            else:
+                minimizers = get_minimizers(strip_question_marks(seq))
+                delta['sequences'][str(pk)] = [code_id, gene_code, minimizers.tolist()]
+            delta['manifest'] = manifest
+            write_file_atomically(self.delta_file, json.dumps(delta))
+
+    def search(self, seq):
+        """Counts the minimizers of the query found in each sequence. The
+        index should be up to date.
+
+        :return: list of dictionaries with the sequences sharing minimizers
+                 with the query, unsorted.
+        """
+        query = get_minimizers(strip_question_marks(seq))
+        build = self.read_manifest()['build']
+        postings, sequences = self.load_build(build)
+        delta = self.load_delta(build)
+
+        hits = []
+        shared = postings.count_shared(query, len(sequences))
+        for position in np.nonzero(shared)[0]:
+            pk, code_id, gene_code = sequences[position]
+            if str(pk) not in delta['changed']:
+                hits.append(self.make_hit(code_id, gene_code, int(shared[position]), len(query)))
+
+        shared = delta['postings'].count_shared(query, len(delta['saved']))
+        for position in np.nonzero(shared)[0]:
+            code_id, gene_code = delta['saved'][position]
+            hits.append(self.make_hit(code_id, gene_code, int(shared[position]), len(query)))
+        return hits
+
+    def make_hit(self, code_id, gene_code, shared, query_count):
+        return {
+            'voucher_code': code_id,
+            'gene_code': gene_code,
+            'shared_kmers': shared,
+            'query_kmers': query_count,
+            'ident': estimate_identity(shared, query_count),
+        }
+
+
+def get_gene_index(gene_code):
+    return KmerIndex('gene_' + gene_code, [gene_code])
+
+
+def get_full_index():
+    return KmerIndex('all_genes')
+
+
+def get_manifests(gene_code):
+    """Manifests of the indexes a sequence of a gene goes into, taken with
+    one query.
+
+    :return: dict with the manifests of the index of all genes and of the
+             index of the gene, by index name.
+    """
+    full_manifest, gene_manifest = get_gene_manifests(Sequences.objects.all(), gene_code)
+    return {
+        get_full_index().name: full_manifest,
+        get_gene_index(gene_code).name: gene_manifest,
+    }
+
+
+def find_similar_sequences(seq, gene_codes=None, max_hits=20):
+    """Finds the sequences closest to a query with the k-mer indexes, which
+    are built first if needed.
+
+    :param gene_codes: list of gene codes to search. All genes if empty.
+    :return: list of hits sorted by estimated identity.
+    """
+    if gene_codes:
+        indexes = [get_gene_index(gene_code) for gene_code in sorted(set(gene_codes))]
+    else:
+        indexes = [get_full_index()]
+
+    hits = []
+    for index in indexes:
+        index.update()
+        hits += index.search(seq)
+    hits.sort(key=lambda i: (-i['shared_kmers'], i['voucher_code'], i['gene_code']))
+    return hits[:max_hits]
@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from blast_local.kmers import get_full_index
+from blast_local.kmers import get_gene_index
+from blast_local.utils import get_gene_database
+from blast_local_full.utils import get_full_database
+from public_interface.models import Genes
+
+
+def update_database(database):
+    """Runs in the worker processes of the pool.
+
+    :return: tuple with the name of the database, whether it was built, the
+             seconds it took and the error message if it could not be built.
+    """
+    start = time.time()
+    try:
+        built = database.update()
+    except Exception as e:
+        return str(database), False, time.time() - start, str(e)
+    return str(database), built, time.time() - start, None
+
+
+class Command(BaseCommand):
+    help = 'Builds the BLAST databases and k-mer indexes of each gene and ' \
+           'of all sequences, skipping those whose sequences have not ' \
+           'changed. Can be run while VoSeq is serving BLAST searches.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=multiprocessing.cpu_count(),
+                    help='Number of databases built at the same time. Defaults '
+                         'to the number of CPUs.',
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        gene_codes = Genes.objects.order_by('gene_code').values_list('gene_code', flat=True)
+        databases = [get_gene_database(gene_code) for gene_code in gene_codes]
+        databases.append(get_full_database())
+        databases += [get_gene_index(gene_code) for gene_code in gene_codes]
+        databases.append(get_full_index())
+
+        start = time.time()
+        if options['processes'] == 1:
+            self.report(map(update_database, databases))
+        else:
+            # Each worker process needs to open its own database connection.
+            for connection in connections.all():
+                connection.close()
+
+            pool = multiprocessing.Pool(options['processes'])
+            try:
+                self.report(pool.imap_unordered(update_database, databases))
+            finally:
+                pool.close()
+                pool.join()
+        self.stdout.write('Checked %i BLAST databases and k-mer indexes in %.2f s' % (len(databases), time.time() - start))
+
+    def report(self, results):
+        for name, built, seconds, error in results:
+            if error is not None:
+                self.stderr.write('Could not build %s: %s' % (name, error))
+            elif built:
+                self.stdout.write('Built %s in %.2f s' % (name, seconds))
+            else:
+                self.stdout.write('%s is up to date (%.2f s)' % (name, seconds))
@@ -0,0 +1,7 @@
+from blast_local.jobs import queue
+from core.jobs import WorkerCommand
+
+
+class Command(WorkerCommand):
+    help = 'Starts worker processes that run the BLAST searches queued by users.'
+    queue = queue
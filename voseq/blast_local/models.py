@@ -0,0 +1,57 @@
+import json
+
+from django.db import models
+
+from core.models import Job
+
+
+class BlastResult(models.Model):
+    """Hits of a BLAST search, kept to answer the same search again without
+    running ``blastn``.
+
+    Results belong to one build of a BLAST database, so they are not used
+    once the database is built again.
+    """
+    key = models.CharField(
+        max_length=40,
+        unique=True,
+        help_text='SHA1 hash of the query sequence, database, build and search options.',
+    )
+    database = models.CharField(max_length=255, help_text='Path of the BLAST database.')
+    build = models.CharField(max_length=32, help_text='Build of the BLAST database.')
+    hits = models.TextField(help_text='List of hits as JSON.')
+    time_created = models.DateTimeField(auto_now_add=True)
+    time_used = models.DateTimeField(db_index=True)
+
+    def get_hits(self):
+        return json.loads(self.hits)
+
+    def __str__(self):
+        return self.key
+
+
+class BlastJob(Job):
+    """BLAST search run by the worker processes of ``run_blast_jobs`` instead
+    of inside the request.
+
+    Identical submissions have the same ``key``, a hash of the BLAST type and
+    search parameters, so they share one job while it is waiting or running.
+    """
+    blast_type = models.CharField(
+        max_length=10, choices=(
+            ('local', 'local'),
+            ('full', 'full'),
+            ('new', 'new'),
+            ('batch', 'batch'),
+            ('ncbi', 'ncbi'),
+        ),
+    )
+    params = models.TextField(help_text='Search parameters as JSON.')
+    hits = models.TextField(blank=True, help_text='List of hits as JSON.')
+
+    def get_params(self):
+        return json.loads(self.params)
+
+    def get_hits(self):
+        return json.loads(self.hits or '[]')
+
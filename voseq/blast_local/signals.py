@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from public_interface.models import Sequences
+from .kmers import get_full_index
+from .kmers import get_gene_index
+from .kmers import get_manifests
+
+
+def index_sequence(instance, seq):
+    indexes = [i for i in [get_full_index(), get_gene_index(instance.gene_code)]
+               if i.read_manifest() is not None]
+    if not indexes:
+        return
+    # Taken once for both indexes, before waiting for their locks.
+    manifests = get_manifests(instance.gene_code)
+    for index in indexes:
+        index.save_sequence(instance.pk, instance.code_id, instance.gene_code, seq,
+                            manifests[index.name])
+
+
+@receiver(post_save, sender=Sequences)
+def index_saved_sequence(sender, instance, **kwargs):
+    index_sequence(instance, instance.sequences)
+
+
+@receiver(post_delete, sender=Sequences)
+def index_deleted_sequence(sender, instance, **kwargs):
+    index_sequence(instance, None)
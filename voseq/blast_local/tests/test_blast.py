@@ -1,12 +1,24 @@
 import datetime
 import glob
 import os
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
 from django.core.management import call_command
 from django.test import TestCase
+from django.test import override_settings
 from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
 
+from blast_local.models import BlastResult
 from blast_local.utils import BLAST
+from blast_local.utils import cache_hits
+from blast_local.utils import get_cached_hits
+from blast_local.utils import iter_sequences
+from blast_local.utils import strip_question_marks
 from public_interface.models import Vouchers
 from public_interface.models import Sequences
 
@@ -60,6 +72,22 @@ class BlastLocalTest(TestCase):
         self.assertTrue(result)
         self.remove_blast_data_files()
 
+    def test_save_seqs_to_file_in_chunks(self):
+        sequences = Sequences.objects.filter(gene_code='COI')
+        rows = list(iter_sequences(sequences, chunk_size=1))
+        self.assertEqual(sorted(i.code_id for i in sequences), sorted(i[0] for i in rows))
+
+        seq_file = self.blast.database.db + '.test'
+        self.blast.database.save_seqs_to_file(seq_file)
+        with open(seq_file) as handle:
+            lines = handle.read().splitlines()
+        os.remove(seq_file)
+        expected = []
+        for code_id, gene_code, seq in rows:
+            if strip_question_marks(seq) != '':
+                expected += ['>' + code_id + '|' + gene_code, strip_question_marks(seq)]
+        self.assertEqual(expected, lines)
+
     def test_create_blast_db(self):
         blast_type = 'local'
         voucher_code = 'CP100-10'
@@ -115,12 +143,95 @@ class BlastLocalTest(TestCase):
         self.assertFalse(result)
         self.remove_blast_data_files()
 
+    def test_is_blast_db_up_to_date_other_gene_edited(self):
+        self.blast.save_seqs_to_file()
+        self.blast.create_blast_db()
+
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        Sequences.objects.filter(gene_code='EF1a').update(time_edited=tomorrow)
+        result = self.blast.is_blast_db_up_to_date()
+        self.assertTrue(result)
+        self.remove_blast_data_files()
+
     def test_is_blast_db_up_to_date_false2(self):
         self.blast.save_seqs_to_file()
         result = self.blast.is_blast_db_up_to_date()
         self.assertFalse(result)
         self.remove_blast_data_files()
 
+    def test_get_manifest(self):
+        manifest = self.blast.database.get_manifest()
+        self.assertEqual(Sequences.objects.filter(gene_code='COI').count(), manifest['count'])
+
+        sequence = Sequences.objects.filter(gene_code='EF1a')[0]
+        sequence.save()
+        self.assertEqual(manifest, self.blast.database.get_manifest())
+
+        sequence = Sequences.objects.filter(gene_code='COI')[0]
+        sequence.save()
+        self.assertNotEqual(manifest, self.blast.database.get_manifest())
+
+    def test_update_blast_db(self):
+        self.remove_blast_data_files()
+        self.assertTrue(self.blast.update_blast_db())
+        self.assertFalse(self.blast.update_blast_db())
+
+        sequence = Sequences.objects.filter(gene_code='COI')[0]
+        sequence.save()
+        self.assertTrue(self.blast.update_blast_db())
+        self.remove_blast_data_files()
+
+    def test_update_blast_db_keeps_previous_build(self):
+        self.remove_blast_data_files()
+        builds = []
+        for i in range(3):
+            Sequences.objects.filter(gene_code='COI')[0].save()
+            self.blast.update_blast_db()
+            builds.append(self.blast.database.read_manifest()['build'])
+
+        with open(self.blast.database.alias_file) as handle:
+            self.assertTrue('DBLIST COI_seqs.fas.' + builds[2] in handle.read())
+        files = ' '.join(glob.glob(self.blast.db + '.*'))
+        self.assertFalse(builds[0] in files)
+        self.assertTrue(builds[1] in files)
+        self.remove_blast_data_files()
+
+    def test_update_blast_db_in_temp_dir(self):
+        self.remove_blast_data_files()
+        self.blast.update_blast_db()
+        self.assertFalse(os.path.isfile(self.blast.db))
+        self.assertEqual([], glob.glob(os.path.join(os.path.dirname(self.blast.db), '.build_*')))
+        self.assertTrue(self.blast.is_blast_db_up_to_date())
+        self.remove_blast_data_files()
+
+    def test_lock(self):
+        waited = []
+
+        def wait_for_lock():
+            start = time.time()
+            with self.blast.database.lock():
+                waited.append(time.time() - start)
+
+        with self.blast.database.lock():
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            time.sleep(0.2)
+        thread.join()
+        self.assertTrue(waited[0] >= 0.2)
+        self.remove_blast_data_files()
+
+    def test_build_blast_dbs(self):
+        self.remove_blast_data_files()
+        out = StringIO()
+        call_command('build_blast_dbs', processes=1, stdout=out)
+        self.assertTrue('Built COI_seqs.fas' in out.getvalue())
+        self.assertTrue(self.blast.is_blast_db_up_to_date())
+
+        out = StringIO()
+        call_command('build_blast_dbs', processes=1, stdout=out)
+        self.assertTrue('COI_seqs.fas is up to date' in out.getvalue())
+        self.remove_blast_data_files()
+
     def test_do_blast(self):
         self.blast.save_seqs_to_file()
         self.blast.create_blast_db()
@@ -138,6 +249,58 @@ class BlastLocalTest(TestCase):
         self.assertTrue(611 in [i['query_length'] for i in result])
         self.remove_blast_data_files()
 
+    def test_parse_tabular_output(self):
+        with open(self.blast.output_file, 'w') as handle:
+            handle.write('# BLASTN 2.2.28+\n'
+                         'CP100-10|COI\t611\t600\t590\t1082\t1000\t0.0\tCP100-10|COI\n'
+                         'CP100-10|COI\t611\t100\t97\t90\t170\t1e-40\tCP100-11|COI\n'
+                         'CP100-10|COI\t611\t20\t20\t20\t30\t0.01\tCP100-13|COI\n')
+        result = self.blast.parse_tabular_output()
+        self.assertEqual(['CP100-10', 'CP100-11'], [i['voucher_code'] for i in result])
+        self.assertEqual(98.2, result[0]['query_cover'])
+        self.assertEqual(97.0, result[1]['ident'])
+        self.assertEqual(1e-40, result[1]['e_value'])
+
+        result = self.blast.parse_tabular_output(max_hits=1)
+        self.assertEqual(['CP100-10'], [i['voucher_code'] for i in result])
+        self.blast.delete_query_output_files()
+
+    def test_search_is_cached(self):
+        searches = []
+
+        def run_search():
+            searches.append(1)
+            return [{'voucher_code': 'CP100-10', 'e_value': 0.0}]
+
+        self.blast.run_search = run_search
+        self.blast.database.publish('a' * 32, 'title', self.blast.database.get_manifest())
+        self.assertEqual(self.blast.search(), self.blast.search())
+        self.assertEqual(1, len(searches))
+
+        # Results of the previous build are not used.
+        self.blast.database.publish('b' * 32, 'title', self.blast.database.get_manifest())
+        self.blast.search()
+        self.assertEqual(2, len(searches))
+        self.assertEqual(['b' * 32], [i.build for i in BlastResult.objects.all()])
+        self.remove_blast_data_files()
+
+    @override_settings(BLAST_CACHE_MAX_RESULTS=1)
+    def test_search_cache_evicts_least_recently_used(self):
+        self.blast.run_search = lambda: []
+        self.blast.database.publish('a' * 32, 'title', self.blast.database.get_manifest())
+        self.blast.search()
+        self.blast.e_value = 0.1
+        self.blast.search()
+        self.assertEqual(1, BlastResult.objects.count())
+        self.remove_blast_data_files()
+
+    def test_search_cache_of_another_process_is_used(self):
+        BlastResult.objects.create(key='a' * 40, database=self.blast.database.db,
+                                   build='a' * 32, hits='[]', time_used=timezone.now())
+        with mock.patch.object(BlastResult.objects, 'update_or_create', side_effect=IntegrityError):
+            cache_hits('a' * 40, self.blast.database.db, 'a' * 32, [])
+        self.assertEqual([], get_cached_hits('a' * 40))
+
     def test_strip_question_marks(self):
         seq = '?G?A??????TTTTATTTTTGG???????????????????????????????????????????CGAA??GAATTAGGTAACCCAGGATCTTTAATTGGAGATGATCAAATTTATAATACTATTGTAACTGCTCATGCATTTATTATAATTTTTTTTATAGTTATACCTATTATAATTGGAGGATTTGGTAATTGATTAATTCCTTTAATACTTGGAGCTCCTGATATAGCTTTCCCTCGAATAAATAATATAAGATTTTGACTTCTCCCCCCCTCTTTAATTTTATTAATTTCTAGAAGAATTGTAGAAACTGGGGCCGGAACAGGCTGAACAGTATACCCTCCTTTATCTTCAAATATTGCTCATGGGGGAGCTTCTGTAGATTTAGCTATTTTTTCTTTACATTTAGCAGGTATTTCCTCTATTTTAGGAGCAATTAATTTTATTACAACTATTATTAATATACGAATTAGTAATATATCATTTGATCAAATACCTTTATTTGTTTGATCAGTAGGAATTACAGCTTTATTATTACTTTTATCTTTACCTGTATTAGCTGGAGCTATTACCATATTATTAACGGATCGAAATTTAAATACTTCATTTTTTGACCCTGCTGGAGGAGGAGATCCCATTCTTTATCAACATCTATTTTGATTTTTTGG'
         expected = 'GNANNNNNNTTTTATTTTTGGNNNNNNNNN'
@@ -0,0 +1,96 @@
+import datetime
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.test import override_settings
+from django.test.client import Client
+from django.core.management import call_command
+from django.utils import timezone
+
+from blast_local.jobs import queue
+from blast_local.jobs import submit_job
+from blast_local.models import BlastJob
+
+
+@override_settings(BLAST_JOBS_ALWAYS_EAGER=False)
+class BlastJobsTest(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        self.params = {'voucher_code': 'CP100-10', 'gene_code': 'COI'}
+        self.c = Client()
+
+    def test_identical_submissions_share_job(self):
+        job = submit_job('local', self.params)
+        self.assertEqual(BlastJob.PENDING, job.status)
+        self.assertEqual(job.job_id, submit_job('local', dict(self.params)).job_id)
+        self.assertNotEqual(job.job_id, submit_job('full', self.params).job_id)
+
+    @override_settings(BLAST_JOBS_MAX_HEAVY=1)
+    def test_heavy_jobs_wait_for_running_ones(self):
+        running = submit_job('ncbi', self.params)
+        self.assertEqual(running.pk, queue.claim_next_job().pk)
+
+        full_job = submit_job('full', self.params)
+        local_job = submit_job('local', self.params)
+        self.assertEqual(local_job.pk, queue.claim_next_job().pk)
+        self.assertIsNone(queue.claim_next_job())
+
+        BlastJob.objects.filter(pk=running.pk).update(status=BlastJob.FINISHED)
+        self.assertEqual(full_job.pk, queue.claim_next_job().pk)
+
+    @override_settings(BLAST_JOBS_MAX_HEAVY=1)
+    def test_heavy_jobs_claimed_at_the_same_time(self):
+        running = submit_job('ncbi', self.params)
+        self.assertEqual(running.pk, queue.claim_next_job().pk)
+
+        # Another worker counted the running jobs before this one was claimed.
+        full_job = submit_job('full', self.params)
+        with mock.patch('blast_local.jobs.count_running_heavy', return_value=0):
+            self.assertIsNone(queue.claim_next_job())
+        full_job = BlastJob.objects.get(pk=full_job.pk)
+        self.assertEqual(BlastJob.PENDING, full_job.status)
+        self.assertIsNone(full_job.time_started)
+
+    @override_settings(BLAST_JOBS_MAX_HEAVY=1)
+    def test_abandoned_running_job(self):
+        abandoned = submit_job('full', self.params)
+        self.assertEqual(abandoned.pk, queue.claim_next_job().pk)
+        BlastJob.objects.filter(pk=abandoned.pk).update(
+            time_started=timezone.now() - datetime.timedelta(days=1))
+
+        job = submit_job('full', self.params)
+        self.assertNotEqual(abandoned.job_id, job.job_id)
+        self.assertEqual(BlastJob.FAILED, BlastJob.objects.get(pk=abandoned.pk).status)
+        self.assertEqual(job.pk, queue.claim_next_job().pk)
+
+    def test_failed_job(self):
+        job = submit_job('local', {'voucher_code': 'CP100-10', 'gene_code': 'no_such_gene'})
+        queue.run_worker(exit_when_idle=True)
+        job = BlastJob.objects.get(pk=job.pk)
+        self.assertEqual(BlastJob.FAILED, job.status)
+        self.assertTrue(job.get_errors()[0].startswith('Could not run BLAST'))
+
+        res = self.c.get('/blast_local/jobs/' + job.job_id + '/')
+        self.assertTrue('Could not run BLAST' in res.content.decode('utf-8'))
+
+    def test_views(self):
+        res = self.c.get('/blast_local/CP100-10/COI/')
+        job = BlastJob.objects.get()
+        self.assertEqual(302, res.status_code)
+        self.assertTrue(res['Location'].endswith('/blast_local/jobs/' + job.job_id + '/'))
+
+        res = self.c.get('/blast_local/jobs/' + job.job_id + '/')
+        self.assertTrue('/blast_local/jobs/' + job.job_id + '/status/' in res.content.decode('utf-8'))
+
+        res = self.c.get('/blast_local/jobs/' + job.job_id + '/status/')
+        status = json.loads(res.content.decode('utf-8'))
+        self.assertEqual('PENDING', status['status'])
+
+        res = self.c.get('/blast_local_full/CP100-10/COI/')
+        self.assertEqual(302, res.status_code)
+        self.assertEqual(2, BlastJob.objects.count())
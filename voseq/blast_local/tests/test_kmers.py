@@ -0,0 +1,121 @@
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from blast_local.kmers import find_similar_sequences
+from blast_local.kmers import get_full_index
+from blast_local.kmers import get_gene_index
+from blast_local.kmers import get_manifests
+from blast_local.kmers import get_minimizers
+from public_interface.models import Sequences
+
+
+class KmerIndexTest(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        kmer_index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, kmer_index_dir)
+        settings_override = override_settings(KMER_INDEX_DIR=kmer_index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.sequence = Sequences.objects.get(code_id='CP100-10', gene_code='COI')
+        self.c = Client()
+
+    def test_get_minimizers(self):
+        seq = 'ACGTTGCATGCATGCCATGGCATCGATCGTAGCTAGCTAGCTGACTG'
+        minimizers = get_minimizers(seq)
+        self.assertTrue(len(minimizers) > 0)
+        self.assertEqual(minimizers.tolist(), get_minimizers(seq.lower()).tolist())
+        self.assertEqual([], get_minimizers('ACGTNACGTNACGTNACGTN').tolist())
+        self.assertEqual([], get_minimizers('ACGT').tolist())
+
+    def test_find_similar_sequences(self):
+        result = find_similar_sequences(self.sequence.sequences, ['COI'])
+        self.assertEqual(('CP100-10', 'COI', 100.0),
+                         (result[0]['voucher_code'], result[0]['gene_code'], result[0]['ident']))
+        self.assertTrue(all(i['gene_code'] == 'COI' for i in result))
+
+        result = find_similar_sequences(self.sequence.sequences)
+        self.assertEqual('CP100-10', result[0]['voucher_code'])
+
+    def test_saved_sequences_are_indexed(self):
+        index = get_gene_index('COI')
+        self.assertTrue(index.update())
+
+        other = Sequences.objects.get(code_id='CP100-11', gene_code='COI')
+        other.sequences = self.sequence.sequences
+        other.save()
+        self.assertTrue(index.is_up_to_date())
+        result = find_similar_sequences(self.sequence.sequences, ['COI'])
+        self.assertEqual([100.0, 100.0], [i['ident'] for i in result[:2]])
+        self.assertEqual({'CP100-10', 'CP100-11'}, {i['voucher_code'] for i in result[:2]})
+
+        self.sequence.delete()
+        result = find_similar_sequences(other.sequences, ['COI'])
+        self.assertNotIn('CP100-10', [i['voucher_code'] for i in result])
+        self.assertFalse(index.update())
+
+    def test_get_manifests(self):
+        manifests = get_manifests('COI')
+        self.assertEqual(get_full_index().get_manifest(), manifests['all_genes'])
+        self.assertEqual(get_gene_index('COI').get_manifest(), manifests['gene_COI'])
+        self.assertEqual(3, manifests['gene_COI']['count'])
+        self.assertEqual({'count': 0, 'time_created': None, 'time_edited': None},
+                         get_manifests('18S')['gene_18S'])
+
+    def test_saved_sequences_keep_both_indexes_up_to_date(self):
+        full_index = get_full_index()
+        gene_index = get_gene_index('COI')
+        self.assertTrue(full_index.update())
+        self.assertTrue(gene_index.update())
+
+        self.sequence.sequences = 'ACGT' + self.sequence.sequences
+        self.sequence.save()
+        Sequences.objects.get(code_id='CP100-10', gene_code='EF1a').delete()
+        self.assertTrue(full_index.is_up_to_date(full_index.get_manifest()))
+        self.assertTrue(gene_index.is_up_to_date(gene_index.get_manifest()))
+
+    def test_up_to_date_index_is_not_compared_with_database_again(self):
+        index = get_gene_index('COI')
+        index.update()
+        self.assertTrue(index.is_up_to_date())
+        with self.assertNumQueries(0):
+            result = find_similar_sequences(self.sequence.sequences, ['COI'])
+        self.assertEqual('CP100-10', result[0]['voucher_code'])
+
+        # Saved sequences change the delta, so it is compared again.
+        self.sequence.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(index.is_up_to_date())
+
+    def test_index_is_built_again_after_changes_not_saved_one_by_one(self):
+        index = get_full_index()
+        index.update()
+        build = index.read_manifest()['build']
+
+        Sequences.objects.filter(pk=self.sequence.pk).update(sequences='ACGT',
+                                                             time_edited=timezone.now())
+        self.assertFalse(index.is_up_to_date())
+        self.assertTrue(index.update())
+        self.assertNotEqual(build, index.read_manifest()['build'])
+
+    def test_similar_view(self):
+        res = self.c.get('/blast_new/similar/')
+        self.assertEqual(200, res.status_code)
+
+        res = self.c.post('/blast_new/similar/', {
+            'name': 'query',
+            'sequence': self.sequence.sequences,
+            'gene_codes': ['COI'],
+        })
+        self.assertEqual('CP100-10', res.context['result'][0]['voucher_code'])
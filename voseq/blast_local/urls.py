@@ -6,5 +6,7 @@ from . import views
 
 urlpatterns = patterns(
     '',
+    url(r'^/jobs/(?P<job_id>[a-z0-9]+)/$', views.job, name='job'),
+    url(r'^/jobs/(?P<job_id>[a-z0-9]+)/status/$', views.job_status, name='job_status'),
     url(r'^/(?P<voucher_code>.+)/(?P<gene_code>.+)/$', views.index, name='index'),
 )
@@ -1,8 +1,11 @@
-import datetime
 import glob
+import hashlib
+import json
 import os
 import re
+import shutil
 import subprocess
+import tempfile
 import uuid
 
 from Bio import SeqIO
@@ -10,9 +13,316 @@ from Bio.Blast.Applications import NcbiblastnCommandline
 from Bio.Blast import NCBIXML
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-import pytz
-
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.utils import timezone
+
+from core.builds import BuildStore
+from core.utils import write_file_atomically
 from public_interface.models import Sequences
+from .models import BlastResult
+
+
+# Gaps and missing bases are given to BLAST as unknown bases.
+UNKNOWN_BASES = str.maketrans('-?', 'NN')
+
+# Sequences read from the database at a time when exporting them.
+EXPORT_CHUNK_SIZE = 2000
+
+
+def strip_question_marks(seq):
+    return seq.strip('?').strip('N').translate(UNKNOWN_BASES)
+
+
+def iter_sequences(queryset, fields=('code_id', 'gene_code', 'sequences'),
+                   chunk_size=EXPORT_CHUNK_SIZE):
+    """Reads the code, gene code and sequence of each sequence without
+    creating model instances. Rows are read in chunks ordered by primary key,
+    so memory use does not grow with the number of sequences.
+
+    :param fields: fields to read.
+    :return: iterator of tuples with the fields, by default
+             (code_id, gene_code, sequences).
+    """
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+MANIFEST_AGGREGATES = {
+    'count': Count('id'),
+    'time_created': Max('time_created'),
+    'time_edited': Max('time_edited'),
+}
+
+
+def format_manifest(stats):
+    for field in ['time_created', 'time_edited']:
+        if stats[field] is not None:
+            stats[field] = stats[field].isoformat()
+    return stats
+
+
+def get_sequences_manifest(queryset):
+    """
+    :return: dict with the number of sequences and the last time they were
+             created and edited, which changes when any of them is added,
+             edited or deleted.
+    """
+    return format_manifest(queryset.aggregate(**MANIFEST_AGGREGATES))
+
+
+def get_gene_manifests(queryset, gene_code):
+    """Manifests of the sequences and of those of one gene, as
+    ``get_sequences_manifest`` returns them, taken with one query.
+
+    :return: tuple with both manifests.
+    """
+    rows = queryset.order_by().values('gene_code').annotate(**MANIFEST_AGGREGATES)
+    manifests = []
+    for gene_rows in [list(rows), [i for i in rows if i['gene_code'] == gene_code]]:
+        stats = {'count': sum(i['count'] for i in gene_rows)}
+        for field in ['time_created', 'time_edited']:
+            stats[field] = max((i[field] for i in gene_rows if i[field] is not None), default=None)
+        manifests.append(format_manifest(stats))
+    return tuple(manifests)
+
+
+class BlastDatabase(BuildStore):
+    """
+    BLAST database made from the sequences of one gene, of several genes or
+    of all genes in our database.
+
+    A manifest with the number of sequences and the last time they were
+    created and edited is saved next to the database files when it is built,
+    so sequences are only exported and ``makeblastdb`` is only run again when
+    the sequences of this database change.
+
+    Every build gets its own files, named after ``db`` and a build id.
+    ``blastn`` reaches the current build through the alias file ``db.nal``,
+    which is replaced in one step once a build is complete, so searches never
+    read a database that is half written.
+
+    Builds are made in a temporary directory while holding a lock on the
+    database, so requests that need the same database at the same time wait
+    for one build and use it.
+    """
+    def __init__(self, db, gene_codes=None, mask=True):
+        """
+        :param db: path of the FASTA file, also used as name of the database.
+        :param gene_codes: list of gene codes of the sequences. None to use
+                           all sequences.
+        :param mask: eliminate low-complexity regions from the sequences.
+        """
+        self.db = db
+        if gene_codes is not None:
+            gene_codes = sorted(set(gene_codes))
+        self.gene_codes = gene_codes
+        self.mask = mask
+        self.alias_file = self.db + '.nal'
+        super(BlastDatabase, self).__init__(self.db + '.')
+
+    def __str__(self):
+        return os.path.basename(self.db)
+
+    def get_queryset(self):
+        if self.gene_codes is None:
+            return Sequences.objects.all()
+        return Sequences.objects.filter(gene_code__in=self.gene_codes)
+
+    def get_manifest(self):
+        """
+        :return: dict describing the sequences that go into the database,
+                 taken with one query limited to them.
+        """
+        return get_sequences_manifest(self.get_queryset())
+
+    def have_blast_db(self):
+        return len(glob.glob(self.db + '.n*')) > 0
+
+    def is_up_to_date(self, manifest=None):
+        """
+        :param manifest: manifest of the sequences in our database. It is
+                         taken from the database if not given.
+        """
+        if self.have_blast_db() is False:
+            return False
+        built = self.read_manifest()
+        if built is None:
+            return False
+        built.pop('build', None)
+        if manifest is None:
+            manifest = self.get_manifest()
+        return built == manifest
+
+    def save_seqs_to_file(self, seq_file=None):
+        """Exports the sequences in FASTA format.
+
+        :param seq_file: path of the FASTA file. Defaults to ``self.db``.
+        """
+        if seq_file is None:
+            seq_file = self.db
+        with open(seq_file, 'w', buffering=1024 * 1024) as handle:
+            write = handle.write
+            for code_id, gene_code, sequences in iter_sequences(self.get_queryset()):
+                seq = strip_question_marks(sequences)
+                if seq != '':
+                    write('>' + code_id + '|' + gene_code + '\n' + seq + '\n')
+
+    def create_blast_db(self, manifest=None, seq_file=None):
+        """
+        Creates a BLAST database from our sequences file in FASTA format.
+        Optionally eliminates low-complexity regions from the sequences.
+
+        :param manifest: manifest of the exported sequences. It is taken
+                         from the database if not given.
+        :param seq_file: path of the FASTA file. Defaults to ``self.db``.
+                         The database is built next to it and its files are
+                         then moved next to ``self.db``.
+        """
+        if manifest is None:
+            manifest = self.get_manifest()
+        if seq_file is None:
+            seq_file = self.db
+        build_id = self.new_build()
+        build = seq_file + '.' + build_id
+
+        print("Creating blast db")
+        if self.mask is True:
+            title = "Whole Genome without low-complexity regions"
+            command = 'dustmasker -in ' + seq_file + ' -infmt fasta '
+            command += '-outfmt maskinfo_asn1_bin -out ' + build + '_dust.asnb'
+            subprocess.check_output(command, shell=True)  # identifying low-complexity regions.
+
+            command = 'makeblastdb -in ' + seq_file + ' -input_type fasta -dbtype nucl '
+            command += '-mask_data ' + build + '_dust.asnb '
+            command += '-out ' + build + ' -title "' + title + '"'
+            subprocess.check_output(command, shell=True)
+        else:
+            title = "Whole Genome unmasked"
+            command = 'makeblastdb -in ' + seq_file + ' -input_type fasta -dbtype nucl '
+            command += '-out ' + build + ' -title "' + title + '"'
+            subprocess.check_output(command, shell=True)
+
+        build_dir = os.path.dirname(build)
+        if build_dir != os.path.dirname(self.db):
+            for filename in glob.glob(build + '[._]*'):
+                os.replace(filename, os.path.join(os.path.dirname(self.db),
+                                                  os.path.basename(filename)))
+
+        self.publish(build_id, title, manifest)
+
+    def publish(self, build_id, title, manifest):
+        """Points the alias file of the database to a complete build and
+        removes builds older than the one it replaces.
+        """
+        # Databases in the DBLIST are looked for next to the alias file.
+        write_file_atomically(self.alias_file,
+                              'TITLE ' + title + '\n' +
+                              'DBLIST ' + os.path.basename(self.db) + '.' + build_id + '\n')
+        self.publish_build(build_id, manifest)
+
+    def remove_builds(self, keep):
+        """Removes the files of builds not in ``keep``, and of databases made
+        before builds had their own files.
+        """
+        super(BlastDatabase, self).remove_builds(keep)
+        unversioned_file = re.compile(re.escape(os.path.basename(self.db)) +
+                                      r'(\.n(?!al)[a-z]{2}|_dust\.asnb)$')
+        for filename in glob.glob(self.db + '[._]*'):
+            if unversioned_file.match(os.path.basename(filename)):
+                os.remove(filename)
+
+    def update(self):
+        """Builds the database again if its sequences have changed.
+
+        :return: True if the database was built.
+        """
+        if self.is_up_to_date():
+            return False
+
+        with self.lock():
+            # Taken before exporting, so changes made during the export are
+            # picked up next time. Another process may have built the
+            # database while we were waiting for the lock.
+            manifest = self.get_manifest()
+            if self.is_up_to_date(manifest):
+                return False
+
+            # In the same directory as the database, so files can be moved
+            # in place by renaming them.
+            temp_dir = tempfile.mkdtemp(prefix='.build_', dir=os.path.dirname(self.db))
+            try:
+                seq_file = os.path.join(temp_dir, os.path.basename(self.db))
+                self.save_seqs_to_file(seq_file)
+                self.create_blast_db(manifest, seq_file)
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        return True
+
+
+def get_gene_database(gene_code, mask=True):
+    """
+    :return: BlastDatabase of the sequences of one gene, used by local blasts.
+    """
+    db = os.path.join(os.path.dirname(__file__), 'db', gene_code + '_seqs.fas')
+    return BlastDatabase(db, [gene_code], mask)
+
+
+def get_cached_hits(key):
+    """
+    :return: list of hits of a cached BLAST search, or None.
+    """
+    try:
+        result = BlastResult.objects.get(key=key)
+    except BlastResult.DoesNotExist:
+        return None
+    result.time_used = timezone.now()
+    BlastResult.objects.filter(pk=result.pk).update(time_used=result.time_used)
+    return result.get_hits()
+
+
+def cache_hits(key, database, build, hits):
+    """Keeps the hits of a BLAST search. Results of older builds of the
+    database are removed, and so are the least recently used results when
+    there are more than ``settings.BLAST_CACHE_MAX_RESULTS``.
+    """
+    BlastResult.objects.filter(database=database).exclude(build=build).delete()
+    try:
+        with transaction.atomic():
+            BlastResult.objects.update_or_create(
+                key=key,
+                defaults={
+                    'database': database,
+                    'build': build,
+                    'hits': json.dumps(hits),
+                    'time_used': timezone.now(),
+                },
+            )
+    except IntegrityError:
+        # Another process cached the same search meanwhile, so it is used
+        # like a cache hit.
+        BlastResult.objects.filter(key=key).update(time_used=timezone.now())
+
+    old_results = BlastResult.objects.order_by('-time_used').values_list(
+        'pk', flat=True)[settings.BLAST_CACHE_MAX_RESULTS:]
+    if old_results:
+        BlastResult.objects.filter(pk__in=list(old_results)).delete()
+
+
+# Columns of the tabular output of blastn, in the order we parse them.
+TABULAR_COLUMNS = 'qseqid qlen length nident score bitscore evalue stitle'
 
 
 class BLAST(object):
@@ -61,6 +371,7 @@ class BLAST(object):
                                         'db',
                                         'output_' + uuid.uuid4().hex + '.xml',
                                         )
+        self.database = get_gene_database(self.gene_code, self.mask)
 
     def have_blast_db(self):
         """
@@ -68,43 +379,18 @@ class BLAST(object):
 
         :return: True or False
         """
-        files = glob.glob(self.db + '.*')
-        if len(files) > 0:
-            return True
-        else:
-            return False
+        return self.database.have_blast_db()
 
     def is_blast_db_up_to_date(self):
         """
         Finds out whether our blast db contains all our sequences. In other
-        words, it finds out whether there are sequences in our postgres db with
-        time_created or time_edited more recent than our blast db files.
+        words, it finds out whether the sequences that go into this blast db
+        have been added, edited or deleted since it was created. Sequences of
+        other genes are not taken into account.
 
         :return: True or False
         """
-        if self.have_blast_db() is False:
-            return False
-
-        # get time creation blast database files
-        modification_times = []
-        files = glob.glob(self.path)
-        for i in files:
-            mod_time_in_secs = os.stat(i).st_ctime
-            modification_times.append(datetime.datetime.fromtimestamp(mod_time_in_secs))
-        modification_times.sort(reverse=True)
-        time_creation_blast = modification_times[0].replace(tzinfo=pytz.utc)
-
-        # get time creation time edited sequences in our database
-        time_created_queryset = Sequences.objects.all().order_by('-time_created')[:1]
-        time_created = time_created_queryset[0].time_created
-
-        time_edited_queryset = Sequences.objects.all().order_by('-time_edited')[:1]
-        time_edited = time_edited_queryset[0].time_edited
-
-        if time_created > time_creation_blast or time_edited > time_creation_blast:
-            return False
-        else:
-            return True
+        return self.database.is_up_to_date()
 
     def save_seqs_to_file(self):
         """
@@ -114,21 +400,8 @@ class BLAST(object):
         Sets attribute `self.seq_file` containing necessary sequences from our
         database.
         """
-        if self.blast_type == 'local':
-            self.seq_file = os.path.join(self.cwd,
-                                         'db',
-                                         self.gene_code + "_seqs.fas",
-                                         )
-            queryset = Sequences.objects.all().filter(gene_code=self.gene_code)
-
-            my_records = []
-            for i in queryset:
-                item_id = i.code_id + '|' + i.gene_code
-                seq = self.strip_question_marks(i.sequences)
-                if seq != '':
-                    seq_record = SeqRecord(Seq(seq), id=item_id)
-                    my_records.append(seq_record)
-            SeqIO.write(my_records, self.seq_file, "fasta")
+        self.seq_file = self.database.db
+        self.database.save_seqs_to_file()
 
     def create_blast_db(self):
         """
@@ -137,20 +410,57 @@ class BLAST(object):
 
         :return:
         """
-        print("Creating blast db")
-        if self.mask is True:
-            command = 'dustmasker -in ' + self.seq_file + ' -infmt fasta '
-            command += '-outfmt maskinfo_asn1_bin -out ' + self.seq_file + '_dust.asnb'
-            subprocess.check_output(command, shell=True)  # identifying low-complexity regions.
+        self.database.create_blast_db()
 
-            command = 'makeblastdb -in ' + self.seq_file + ' -input_type fasta -dbtype nucl '
-            command += '-mask_data ' + self.seq_file + '_dust.asnb '
-            command += '-out ' + self.seq_file + ' -title "Whole Genome without low-complexity regions"'
-            subprocess.check_output(command, shell=True)  # Overwriting the genome file.
-        else:
-            command = 'makeblastdb -in ' + self.seq_file + ' -input_type fasta -dbtype nucl '
-            command += '-out ' + self.seq_file + ' -title "Whole Genome unmasked"'
-            subprocess.check_output(command, shell=True)
+    def update_blast_db(self):
+        """
+        Exports our sequences and creates the BLAST database only if they
+        have changed since the database was created.
+
+        :return: True if the database was created.
+        """
+        self.seq_file = self.database.db
+        return self.database.update()
+
+    def get_search_options(self):
+        """
+        :return: dict with the options that change the hits of a search.
+        """
+        return {'e_value': self.e_value}
+
+    def search(self):
+        """
+        Blasts our query against the BLAST database, which should be up to
+        date. The hits are cached for the current build of the database.
+
+        :return: list of hits.
+        """
+        manifest = self.database.read_manifest() or {}
+        build = manifest.get('build')
+        if build is None:
+            return self.run_search()
+
+        query = self.get_query_sequence()
+        key = json.dumps([hashlib.sha1(query.encode('utf-8')).hexdigest(), self.database.db,
+                          build, self.get_search_options()], sort_keys=True)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        hits = get_cached_hits(key)
+        if hits is None:
+            hits = self.run_search()
+            cache_hits(key, self.database.db, build, hits)
+        return hits
+
+    def run_search(self):
+        self.save_query_to_file()
+        self.do_blast()
+        result = self.parse_blast_output()
+        self.delete_query_output_files()
+        return result
+
+    def get_query_sequence(self):
+        b = Sequences.objects.get(code_id=self.voucher_code, gene_code=self.gene_code)
+        return self.strip_question_marks(b.sequences)
 
     def save_query_to_file(self):
         b = Sequences.objects.get(code_id=self.voucher_code, gene_code=self.gene_code)
@@ -164,7 +474,24 @@ class BLAST(object):
 
     def do_blast(self):
         blastn_cline = NcbiblastnCommandline(query=self.query_file, db=self.db,
-                                             evalue=self.e_value, outfmt=5, out=self.output_file)
+                                             evalue=self.e_value, outfmt=5, out=self.output_file,
+                                             num_threads=settings.BLAST_NUM_THREADS)
+        blastn_cline()
+        return self.output_file
+
+    def do_blast_tabular(self, max_target_seqs=None):
+        """
+        Blasts with tabular output, which is smaller and faster to parse
+        than XML for big databases.
+
+        :param max_target_seqs: number of subject sequences kept by blastn.
+        """
+        blastn_cline = NcbiblastnCommandline(query=self.query_file, db=self.db,
+                                             evalue=self.e_value, outfmt='"6 ' + TABULAR_COLUMNS + '"',
+                                             out=self.output_file,
+                                             num_threads=settings.BLAST_NUM_THREADS)
+        if max_target_seqs is not None:
+            blastn_cline.max_target_seqs = max_target_seqs
         blastn_cline()
         return self.output_file
 
@@ -174,43 +501,83 @@ class BLAST(object):
 
         match_description, max_score, total_score, query_cover, e_value, % ident, accession number
         """
-        handle = open(self.output_file, 'r')
-        blast_record = NCBIXML.read(handle)
+        with open(self.output_file, 'r') as handle:
+            blast_record = NCBIXML.read(handle)
+        return self.get_hits(blast_record)
+
+    def get_hits(self, blast_record):
+        """
+        :param blast_record: BLAST record of one query, as parsed by NCBIXML.
+        :return: list of dictionaries with the hits of the query.
+        """
         hits = []
         append = hits.append
 
         for alignment in blast_record.alignments:
             for hsp in alignment.hsps:
                 if hsp.expect < self.e_value:
-                    obj = {}
-
-                    # This is for our local blasts
-                    obj['description'] = alignment.title.split(' ')[1]
-                    if '|' in obj['description']:
-                        obj['voucher_code'] = obj['description'].split('|')[0]
-                        obj['gene_code'] = obj['description'].split('|')[1]
-                    # This is for the NCBI blasts that need parsing of alignment.title
-                    else:
-                        description = alignment.title
-                        res = re.search('gi\|.+\|.+\|([A-Z]+[0-9]+)\.[0-9]+\|\s*(.+)', description)
-                        if res:
-                            obj['accession'], obj['description'] = res.groups()
-                        else:
-                            obj['description'] = alignment.title
-
-                    obj['score'] = hsp.score
-                    obj['bits'] = hsp.bits
-                    obj['e_value'] = hsp.expect
-
-                    obj['query_length'] = blast_record.query_length
-                    obj['align_length'] = hsp.align_length
-                    obj['identities'] = hsp.identities
-
-                    obj['query_cover'] = round((obj['align_length'] * 100) / obj['query_length'], 1)
-                    obj['ident'] = round((obj['identities'] * 100) / obj['align_length'], 1)
-                    append(obj)
+                    append(self.make_hit(alignment.hit_def, alignment.title, hsp.score, hsp.bits,
+                                         hsp.expect, blast_record.query_length,
+                                         hsp.align_length, hsp.identities))
+        return hits
+
+    def parse_tabular_output(self, max_hits=None):
+        """
+        Reads the output of ``do_blast_tabular`` line by line.
+
+        :param max_hits: stop reading once we have this number of hits.
+        :return: list of dictionaries with the same data as ``parse_blast_output``.
+        """
+        hits = []
+        with open(self.output_file, 'r') as handle:
+            for line in handle:
+                if line.startswith('#') or line.strip() == '':
+                    continue
+                (qseqid, qlen, length, nident, score, bitscore,
+                 evalue, stitle) = line.rstrip('\n').split('\t', 7)
+                if float(evalue) >= self.e_value:
+                    continue
+
+                hits.append(self.make_hit(stitle, stitle, float(score), float(bitscore),
+                                          float(evalue), int(qlen), int(length), int(nident)))
+                if max_hits is not None and len(hits) >= max_hits:
+                    break
         return hits
 
+    def make_hit(self, hit_def, title, score, bits, e_value, query_length, align_length,
+                 identities):
+        """
+        :param hit_def: definition line of the subject sequence.
+        :param title: id and definition line of the subject sequence.
+        :return: dictionary with the data of one hit.
+        """
+        obj = {}
+
+        # This is for our local blasts
+        obj['description'] = hit_def.split(' ')[0]
+        if '|' in obj['description']:
+            obj['voucher_code'] = obj['description'].split('|')[0]
+            obj['gene_code'] = obj['description'].split('|')[1]
+        # This is for the NCBI blasts that need parsing of alignment.title
+        else:
+            res = re.search('gi\|.+\|.+\|([A-Z]+[0-9]+)\.[0-9]+\|\s*(.+)', title)
+            if res:
+                obj['accession'], obj['description'] = res.groups()
+            else:
+                obj['description'] = title
+
+        obj['score'] = score
+        obj['bits'] = bits
+        obj['e_value'] = e_value
+
+        obj['query_length'] = query_length
+        obj['align_length'] = align_length
+        obj['identities'] = identities
+
+        obj['query_cover'] = round((obj['align_length'] * 100) / obj['query_length'], 1)
+        obj['ident'] = round((obj['identities'] * 100) / obj['align_length'], 1)
+        return obj
+
     def delete_query_output_files(self):
         if os.path.isfile(self.query_file):
             os.remove(self.query_file)
@@ -219,11 +586,4 @@ class BLAST(object):
             os.remove(self.output_file)
 
     def strip_question_marks(self, seq):
-        seq = re.sub('^\?+', '', seq)
-        seq = re.sub('\?+$', '', seq)
-
-        seq = re.sub('^N+', '', seq)
-        seq = re.sub('N+$', '', seq)
-        seq = seq.replace('-', 'N')
-        seq = seq.replace('?', 'N')
-        return seq
+        return strip_question_marks(seq)
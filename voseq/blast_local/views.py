@@ -1,22 +1,77 @@
+import json
+
+from django.http import HttpResponse
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 
 from core.utils import get_version_stats
-from .utils import BLAST
+from .jobs import queue
+from .jobs import submit_job
+from .models import BlastJob
 
 
 def index(request, voucher_code, gene_code):
-    version, stats = get_version_stats()
+    job = submit_job('local', {'voucher_code': voucher_code, 'gene_code': gene_code})
+    return show_job(request, job)
+
+
+def job(request, job_id):
+    job = get_object_or_404(BlastJob, job_id=job_id)
+    return render_job(request, job)
+
 
-    blast = BLAST('local', voucher_code, gene_code)
-    blast.save_seqs_to_file()
+def job_status(request, job_id):
+    job = get_object_or_404(BlastJob, job_id=job_id)
+    status = queue.get_job_status(job)
+    return HttpResponse(json.dumps(status), content_type='application/json')
+
+
+def show_job(request, job):
+    """Shows the hits of jobs that are already done, or sends the user to the
+    page of the job while it waits for a worker or runs.
+    """
+    if job.status in (BlastJob.PENDING, BlastJob.RUNNING):
+        return HttpResponseRedirect('/blast_local/jobs/' + job.job_id + '/')
+    return render_job(request, job)
+
+
+def render_job(request, job):
+    """Shows the hits of finished jobs, the errors of failed jobs, or the
+    progress of the job if it is still waiting for a worker or running.
+    """
+    version, stats = get_version_stats()
 
-    if blast.is_blast_db_up_to_date() is False:
-        blast.create_blast_db()
+    if job.status != BlastJob.FINISHED:
+        return render(request, 'blast_local/job.html',
+                      {
+                          'job': job,
+                          'errors': job.get_errors(),
+                          'status_url': '/blast_local/jobs/' + job.job_id + '/status/',
+                          'version': version,
+                          'stats': stats,
+                      },
+                      )
 
-    blast.save_query_to_file()
-    blast.do_blast()
-    result = blast.parse_blast_output()
-    blast.delete_query_output_files()
+    result = job.get_hits()
+    if job.blast_type == 'batch':
+        return render(request, 'blast_new/batch_results.html',
+                      {
+                          'results': result,
+                          'version': version,
+                          'stats': stats,
+                      },
+                      )
+    if job.blast_type == 'new':
+        if len(result) < 1:
+            result = None
+        return render(request, 'blast_new/results.html',
+                      {
+                          'result': result,
+                          'version': version,
+                          'stats': stats,
+                      },
+                      )
     return render(request, 'blast_local/index.html',
                   {
                       'result': result,
@@ -1,12 +1,10 @@
 import os
 import uuid
 
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
+from django.conf import settings
 
 from blast_local.utils import BLAST
-from public_interface.models import Sequences
+from blast_local.utils import BlastDatabase
 
 
 class BLASTFull(BLAST):
@@ -47,27 +45,23 @@ class BLASTFull(BLAST):
                                         'db',
                                         'output_' + uuid.uuid4().hex + '.xml',
                                         )
+        self.database = get_full_database(self.mask)
 
-    def save_seqs_to_file(self):
-        """
-        Query all sequences from our database and save them to local
-        disk.
+    def get_search_options(self):
+        return {'e_value': self.e_value, 'max_hits': settings.BLAST_FULL_MAX_HITS}
 
-        Sets attribute `self.seq_file` containing necessary sequences from our
-        database.
-        """
-        if self.blast_type == 'full':
-            self.seq_file = os.path.join(self.cwd,
-                                         'db',
-                                         'full_db_seqs.fas',
-                                         )
-            queryset = Sequences.objects.all()
+    def run_search(self):
+        """Uses tabular output, as there can be many hits in the full database."""
+        self.save_query_to_file()
+        self.do_blast_tabular(max_target_seqs=settings.BLAST_FULL_MAX_HITS)
+        result = self.parse_tabular_output(max_hits=settings.BLAST_FULL_MAX_HITS)
+        self.delete_query_output_files()
+        return result
 
-            my_records = []
-            for i in queryset:
-                item_id = i.code_id + '|' + i.gene_code
-                seq = self.strip_question_marks(i.sequences)
-                if seq != '':
-                    seq_record = SeqRecord(Seq(seq), id=item_id)
-                    my_records.append(seq_record)
-            SeqIO.write(my_records, self.seq_file, "fasta")
+
+def get_full_database(mask=True):
+    """
+    :return: BlastDatabase of all sequences in our database, used by full blasts.
+    """
+    db = os.path.join(os.path.dirname(__file__), 'db', 'full_db_seqs.fas')
+    return BlastDatabase(db, None, mask)
@@ -36,3 +36,11 @@ class BLASTNcbi(BLAST):
         with open(self.output_file, 'w') as writer:
             writer.write(result_handle.read())
         result_handle.close()
+
+    def update_blast_db(self):
+        """We blast against Genbank, so there is no local database to update."""
+        return False
+
+    def search(self):
+        """Hits are not cached, as Genbank changes all the time."""
+        return self.run_search()
@@ -1,22 +1,7 @@
-from django.shortcuts import render
-
-from core.utils import get_version_stats
-from .utils import BLASTNcbi
+from blast_local.jobs import submit_job
+from blast_local.views import show_job
 
 
 def index(request, voucher_code, gene_code):
-    version, stats = get_version_stats()
-
-    blast = BLASTNcbi(voucher_code, gene_code)
-    blast.save_query_to_file()
-
-    blast.do_blast()
-    result = blast.parse_blast_output()
-    blast.delete_query_output_files()
-    return render(request, 'blast_local/index.html',
-                  {
-                      'result': result,
-                      'version': version,
-                      'stats': stats,
-                  },
-                  )
+    job = submit_job('ncbi', {'voucher_code': voucher_code, 'gene_code': gene_code})
+    return show_job(request, job)
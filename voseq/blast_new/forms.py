@@ -1,3 +1,6 @@
+from io import StringIO
+
+from Bio import SeqIO
 from django import forms
 
 from public_interface.models import Genes
@@ -34,3 +37,41 @@ class BLASTNewForm(forms.Form):
             raise forms.ValidationError('Sequence is empty')
 
         return data
+
+
+class BLASTBatchForm(forms.Form):
+    sequences = forms.CharField(
+        label='Sequences',
+        required=True,
+        widget=forms.Textarea,
+        help_text='Sequences in FASTA format',
+    )
+
+    gene_codes = forms.ModelMultipleChoiceField(
+        Genes.objects.all(),
+        label='Genes',
+        widget=forms.CheckboxSelectMultiple(),
+        required=False,
+        to_field_name='gene_code',
+    )
+
+    def clean_sequences(self):
+        """
+        :return: list of tuples (name, sequence).
+        """
+        data = self.cleaned_data['sequences']
+        if not data.strip().startswith('>'):
+            raise forms.ValidationError('Sequences should be in FASTA format')
+
+        queries = []
+        for seq_record in SeqIO.parse(StringIO(data.strip()), 'fasta'):
+            sequence = str(seq_record.seq)
+            for i in sequence:
+                if i.isdigit():
+                    raise forms.ValidationError('Sequence %s contains invalid characters: %s' %
+                                                (seq_record.id, i))
+            queries.append((seq_record.id, sequence))
+
+        if not any(sequence for name, sequence in queries):
+            raise forms.ValidationError('Sequences are empty')
+        return queries
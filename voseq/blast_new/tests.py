@@ -2,6 +2,8 @@ from django.test import TestCase
 from django.test import Client
 from django.core.management import call_command
 
+from blast_new.forms import BLASTBatchForm
+
 
 class TestBlastNew(TestCase):
     def setUp(self):
@@ -51,3 +53,37 @@ class TestBlastNew(TestCase):
     def test_redirect(self):
         response = self.client.get('/blast_new/results/')
         self.assertEqual(302, response.status_code)
+
+    def test_batch_index(self):
+        response = self.client.get('/blast_new/batch/')
+        self.assertEqual(200, response.status_code)
+
+    def test_batch_form(self):
+        form = BLASTBatchForm({
+            'sequences': '>seq1 plate 1\nATCGATCG\nGCTA\n>seq2\nATCGATCGGCTA\n',
+            'gene_codes': ['COI'],
+        })
+        self.assertTrue(form.is_valid())
+        self.assertEqual([('seq1', 'ATCGATCGGCTA'), ('seq2', 'ATCGATCGGCTA')],
+                         form.cleaned_data['sequences'])
+
+    def test_batch_invalid_form(self):
+        response = self.client.post('/blast_new/batch/', {
+            'sequences': 'ATCGATCGGCTA',
+            'gene_codes': ['COI'],
+        })
+        self.assertTrue('FASTA format' in response.content.decode('utf-8'))
+
+        response = self.client.post('/blast_new/batch/', {
+            'sequences': '>seq1\nATCG1TCGGCTA',
+            'gene_codes': ['COI'],
+        })
+        self.assertTrue('invalid characters' in response.content.decode('utf-8'))
+
+    def test_batch_result(self):
+        response = self.client.post('/blast_new/batch/', {
+            'sequences': '>seq1\nATCGATCGGCTA\n>seq2\n????\n>seq3\nGGATTTGGTAATTGATTAATTCC',
+            'gene_codes': ['COI'],
+        })
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['seq1', 'seq3'], [name for name, result in response.context['results']])
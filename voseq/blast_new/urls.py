@@ -8,4 +8,6 @@ urlpatterns = patterns(
     '',
     url(r'^/$', views.index, name='index'),
     url(r'^/results/$', views.results, name='results'),
+    url(r'^/batch/$', views.batch, name='batch'),
+    url(r'^/similar/$', views.similar, name='similar'),
 )
@@ -2,12 +2,12 @@ import os
 import uuid
 
 from Bio import SeqIO
+from Bio.Blast import NCBIXML
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from django.db.models import Q
 
 from blast_local.utils import BLAST
-from public_interface.models import Sequences
+from blast_local.utils import BlastDatabase
 
 
 class BLASTNew(BLAST):
@@ -54,41 +54,11 @@ class BLASTNew(BLAST):
                                         'db',
                                         'output_' + uuid.uuid4().hex + '.xml',
                                         )
+        # All sequences if no gene codes were given.
+        self.database = BlastDatabase(self.db, self.gene_codes or None, self.mask)
 
-    def save_seqs_to_file(self):
-        """
-        Query sequences for each gene from our database and save them to local
-        disk.
-
-        Sets attribute `self.seq_file` containing necessary sequences from our
-        database.
-        """
-        if self.blast_type == 'new':
-            self.seq_file = os.path.join(self.cwd,
-                                         'db',
-                                         '_'.join(self.gene_codes) + "_seqs.fas",
-                                         )
-            if len(self.gene_codes) > 0:
-                # Taken from http://stackoverflow.com/a/1239602
-                Qr = None
-                for gene_code in self.gene_codes:
-                    q = Q(gene_code=gene_code)
-                    if Qr:
-                        Qr = Qr | q
-                    else:
-                        Qr = q
-                queryset = Sequences.objects.filter(Qr)
-            else:
-                queryset = Sequences.objects.all()
-
-            my_records = []
-            for i in queryset:
-                item_id = i.code_id + '|' + i.gene_code
-                seq = self.strip_question_marks(i.sequences)
-                if seq != '':
-                    seq_record = SeqRecord(Seq(seq), id=item_id)
-                    my_records.append(seq_record)
-            SeqIO.write(my_records, self.seq_file, "fasta")
+    def get_query_sequence(self):
+        return self.strip_question_marks(self.sequence)
 
     def save_query_to_file(self):
         this_id = self.name
@@ -98,3 +68,51 @@ class BLASTNew(BLAST):
             seq_record = SeqRecord(Seq(seq),
                                    id=this_id)
             SeqIO.write(seq_record, self.query_file, "fasta")
+
+
+class BLASTBatch(BLASTNew):
+    """
+    Blasts many query sequences against our sequences with one ``blastn`` run,
+    so the BLAST database is only loaded once.
+    """
+    def __init__(self, blast_type, queries, gene_codes, mask=None):
+        """
+        :param blast_type: new
+        :param queries: list of tuples (name, sequence) given by user.
+        :param gene_codes: list of gene_codes to blast against
+        :param mask:
+        """
+        super(BLASTBatch, self).__init__(blast_type, None, None, gene_codes, mask)
+        self.queries = queries
+        self.query_names = []
+
+    def save_query_to_file(self):
+        """Writes all query sequences to one FASTA file. Sequences that are
+        empty once question marks are stripped are left out.
+        """
+        my_records = []
+        self.query_names = []
+        for name, sequence in self.queries:
+            seq = self.strip_question_marks(sequence)
+            if seq != '':
+                my_records.append(SeqRecord(Seq(seq), id=name, description=''))
+                self.query_names.append(name)
+        SeqIO.write(my_records, self.query_file, "fasta")
+
+    def search(self):
+        """Hits are not cached for batches.
+
+        :return: list of tuples (query name, list of hits).
+        """
+        return self.run_search()
+
+    def parse_blast_output(self):
+        """
+        :return: list of tuples (query name, list of hits), in the order of
+                 the queries.
+        """
+        with open(self.output_file, 'r') as handle:
+            # blastn writes one record for each query, also for those
+            # without hits.
+            return [(name, self.get_hits(blast_record))
+                    for name, blast_record in zip(self.query_names, NCBIXML.parse(handle))]
@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponseRedirect
 
+from blast_local.jobs import submit_job
+from blast_local.kmers import find_similar_sequences
+from blast_local.views import show_job
 from core.utils import get_version_stats
-from .utils import BLASTNew
+from .forms import BLASTBatchForm
 from .forms import BLASTNewForm
 
 
@@ -28,33 +32,77 @@ def results(request):
         if form.is_valid():
             cleaned_data = form.cleaned_data
 
-            blast = BLASTNew('new', cleaned_data['name'], cleaned_data['sequence'],
-                             cleaned_data['gene_codes'])
-            blast.save_seqs_to_file()
-
-            if blast.is_blast_db_up_to_date() is False:
-                blast.create_blast_db()
-
-            blast.save_query_to_file()
-            blast.do_blast()
-            result = blast.parse_blast_output()
-            if len(result) < 1:
-                result = None
-            blast.delete_query_output_files()
-            return render(request, 'blast_new/results.html',
+            job = submit_job('new', {
+                'name': cleaned_data['name'],
+                'sequence': cleaned_data['sequence'],
+                'gene_codes': sorted(i.gene_code for i in cleaned_data['gene_codes']),
+            })
+            return show_job(request, job)
+        else:
+            return render(request, 'blast_new/index.html',
                           {
-                              'result': result,
+                              'form': form,
                               'version': version,
                               'stats': stats,
                           },
                           )
-        else:
-            return render(request, 'blast_new/index.html',
+
+    return HttpResponseRedirect('/blast_new/')
+
+
+def batch(request):
+    version, stats = get_version_stats()
+
+    if request.method == 'POST':
+        form = BLASTBatchForm(request.POST)
+
+        if form.is_valid():
+            cleaned_data = form.cleaned_data
+
+            job = submit_job('batch', {
+                'queries': cleaned_data['sequences'],
+                'gene_codes': sorted(i.gene_code for i in cleaned_data['gene_codes']),
+            })
+            return show_job(request, job)
+    else:
+        form = BLASTBatchForm()
+
+    return render(request, 'blast_new/batch.html',
+                  {
+                      'form': form,
+                      'version': version,
+                      'stats': stats,
+                  },
+                  )
+
+
+def similar(request):
+    version, stats = get_version_stats()
+
+    if request.method == 'POST':
+        form = BLASTNewForm(request.POST)
+
+        if form.is_valid():
+            cleaned_data = form.cleaned_data
+
+            result = find_similar_sequences(cleaned_data['sequence'],
+                                            [i.gene_code for i in cleaned_data['gene_codes']],
+                                            settings.SIMILAR_SEQUENCES_MAX_HITS)
+            return render(request, 'blast_new/similar_results.html',
                           {
                               'form': form,
+                              'result': result,
                               'version': version,
                               'stats': stats,
                           },
                           )
+    else:
+        form = BLASTNewForm()
 
-    return HttpResponseRedirect('/blast_new/')
+    return render(request, 'blast_new/similar.html',
+                  {
+                      'form': form,
+                      'version': version,
+                      'stats': stats,
+                  },
+                  )
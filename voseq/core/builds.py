@@ -0,0 +1,186 @@
+"""
+Files built again as a whole while other processes read them, as BLAST
+databases and the k-mer and search indexes are.
+
+Every build of a ``BuildStore`` has its own files, named after its ``prefix``
+and a build id, and the manifest pointing to the current build is replaced in
+one step, so readers never find a build that is half written. Files of the
+previous build are kept, as readers that found it before the swap may still
+be reading them.
+
+Indexes keep their builds as ``Postings``: the keys found in a list of items
+and the positions of the items with each key, saved as numpy arrays that web
+workers read memory-mapped:
+
+* ``keys``: sorted keys found in the items.
+* ``offsets``: where the items of each key start in ``postings``.
+* ``postings``: positions of the items in the list of the build.
+"""
+import glob
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+
+from .utils import lock_file
+from .utils import write_file_atomically
+
+
+POSTINGS_ARRAYS = ['keys', 'offsets', 'postings']
+
+# What the stores loaded in this process, by prefix and name, with the
+# version it was loaded from.
+_loaded = {}
+
+
+def make_arrays(item_keys, dtype):
+    """
+    :param item_keys: list with a numpy array of the distinct keys of each
+                      item.
+    :param dtype: numpy type of the keys.
+    :return: dict with the ``keys``, ``offsets`` and ``postings`` arrays.
+    """
+    if item_keys:
+        all_keys = np.concatenate(item_keys).astype(dtype, copy=False)
+    else:
+        all_keys = np.zeros(0, dtype=dtype)
+    positions = np.repeat(np.arange(len(item_keys), dtype=np.uint32),
+                          [len(i) for i in item_keys])
+
+    # A stable sort keeps the postings of each key sorted.
+    order = np.argsort(all_keys, kind='mergesort')
+    keys, counts = np.unique(all_keys, return_counts=True)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    return {'keys': keys, 'offsets': offsets, 'postings': positions[order]}
+
+
+class Postings(object):
+    """
+    Positions of the items with each key, from the arrays of ``make_arrays``.
+    """
+    def __init__(self, keys, offsets, postings):
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+
+    def get_arrays(self):
+        return {'keys': self.keys, 'offsets': self.offsets, 'postings': self.postings}
+
+    def get_postings(self, key):
+        """
+        :return: sorted positions of the items with a key.
+        """
+        key = self.keys.dtype.type(key)
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return np.asarray(self.postings[self.offsets[i]:self.offsets[i + 1]])
+        return np.zeros(0, dtype=np.uint32)
+
+    def count_shared(self, query, item_count):
+        """
+        :param query: numpy array with distinct keys.
+        :return: numpy array with the number of keys of the query found in
+                 each item.
+        """
+        shared = np.zeros(item_count, dtype=np.int64)
+        if len(self.keys) > 0 and len(query) > 0:
+            found = np.searchsorted(self.keys, query)
+            in_keys = found < len(self.keys)
+            found = found[in_keys]
+            found = found[self.keys[found] == query[in_keys]]
+            if len(found) > 0:
+                matches = np.concatenate([self.postings[self.offsets[i]:self.offsets[i + 1]]
+                                          for i in found])
+                shared = np.bincount(matches, minlength=item_count)
+        return shared
+
+
+class BuildStore(object):
+    """
+    Builds kept in the manifest ``<prefix>manifest.json``, the lock
+    ``<prefix>lock`` and the files of each build, ``<prefix><build id>.<name>``.
+    """
+    def __init__(self, prefix):
+        """
+        :param prefix: directory ending with a path separator, or path of the
+                       files up to their build id.
+        """
+        self.prefix = prefix
+        self.manifest_file = prefix + 'manifest.json'
+        self.lock_file = prefix + 'lock'
+
+    def get_build_file(self, build, name):
+        return self.prefix + build + '.' + name
+
+    def new_build(self):
+        return uuid.uuid4().hex
+
+    def lock(self):
+        """Holds an exclusive lock on the store, waiting for other processes
+        holding it.
+        """
+        os.makedirs(os.path.dirname(self.prefix), exist_ok=True)
+        return lock_file(self.lock_file)
+
+    def read_manifest(self):
+        """
+        :return: manifest saved with the current build, with its id as
+                 ``build``, or None.
+        """
+        try:
+            with open(self.manifest_file) as handle:
+                return json.load(handle)
+        except (IOError, ValueError):
+            return None
+
+    def publish_build(self, build, manifest):
+        """Makes a complete build the current one, and removes builds older
+        than the one it replaces. Should be called holding the lock.
+        """
+        previous = self.read_manifest() or {}
+        write_file_atomically(self.manifest_file, json.dumps(dict(manifest, build=build)))
+        self.remove_builds(keep=[build, previous.get('build')])
+
+    def remove_builds(self, keep):
+        """Removes the files of builds not in ``keep``."""
+        build_file = re.compile(re.escape(os.path.basename(self.prefix)) + r'([0-9a-f]{32})[._]')
+        for filename in glob.glob(self.prefix + '*'):
+            match = build_file.match(os.path.basename(filename))
+            if match and match.group(1) not in keep:
+                os.remove(filename)
+
+    def save_postings(self, build, postings):
+        for name, array in postings.get_arrays().items():
+            np.save(self.get_build_file(build, name + '.npy'), array)
+
+    def load_postings(self, build):
+        """
+        :return: tuple with the ``Postings`` arrays of a build, memory-mapped.
+        """
+        return tuple(np.load(self.get_build_file(build, name + '.npy'), mmap_mode='r')
+                     for name in POSTINGS_ARRAYS)
+
+    def get_file_version(self, filename):
+        """
+        :return: tuple that changes when the file is replaced or written to.
+        """
+        try:
+            stat = os.stat(filename)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None, None
+
+    def get_loaded(self, name, version, load):
+        """Keeps what ``load`` returns in this process while ``version`` does
+        not change, so web workers read builds and deltas once.
+
+        :param name: name of what is loaded, as ``build`` or ``delta``.
+        """
+        loaded = _loaded.get((self.prefix, name))
+        if loaded is None or loaded[0] != version:
+            loaded = (version, load())
+            _loaded[(self.prefix, name)] = loaded
+        return loaded[1]
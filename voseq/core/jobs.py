@@ -0,0 +1,216 @@
+"""
+Queues of jobs kept in the database.
+
+Views submit jobs, saved as models inheriting ``core.models.Job``, and worker
+processes started with a management command based on ``WorkerCommand`` run
+them, so long jobs do not tie up web server workers. Each queue is a
+``JobQueue`` with the model of its jobs and a ``run_job`` method doing their
+work, and reads the settings starting with its ``settings_prefix``:
+
+* ``<prefix>_ALWAYS_EAGER``: if True, jobs are run as soon as they are
+  submitted, inside the request.
+* ``<prefix>_EXPIRY``: seconds finished and failed jobs are kept.
+* ``<prefix>_RUNNING_TIMEOUT``: jobs running for longer are taken as
+  abandoned by a worker that was stopped or crashed, and marked as failed.
+"""
+import datetime
+import json
+import logging
+import multiprocessing
+import time
+import uuid
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from .models import Job
+
+
+log = logging.getLogger(__name__)
+
+
+def get_date_before(seconds):
+    return timezone.now() - datetime.timedelta(seconds=seconds)
+
+
+class JobQueue(object):
+    # Model of the jobs, inheriting ``core.models.Job``.
+    model = None
+    # Name of the jobs in messages.
+    name = ''
+    settings_prefix = ''
+    # Message of the errors of failed jobs.
+    error_message = 'Could not run job: %s'
+
+    def get_setting(self, name):
+        return getattr(settings, self.settings_prefix + '_' + name)
+
+    def get_expiry_date(self):
+        return get_date_before(self.get_setting('EXPIRY'))
+
+    def get_running_timeout_date(self):
+        return get_date_before(self.get_setting('RUNNING_TIMEOUT'))
+
+    def get_failed_fields(self, error):
+        """
+        :return: dict with the fields updated in jobs that failed.
+        """
+        return {
+            'status': Job.FAILED,
+            'errors': json.dumps([self.error_message % error]),
+            'time_finished': timezone.now(),
+        }
+
+    def fail_abandoned_jobs(self):
+        """Marks as failed the jobs running for longer than
+        ``<prefix>_RUNNING_TIMEOUT`` seconds.
+
+        :return: number of jobs marked as failed.
+        """
+        return self.model.objects.filter(
+            status=Job.RUNNING,
+            time_started__lt=self.get_running_timeout_date(),
+        ).update(**self.get_failed_fields('the job was abandoned by its worker.'))
+
+    def create_job(self, **fields):
+        """Queues a new job, or runs it if ``<prefix>_ALWAYS_EAGER`` is True.
+
+        :return: instance of ``model``.
+        """
+        job = self.model.objects.create(job_id=uuid.uuid4().hex, **fields)
+        if self.get_setting('ALWAYS_EAGER') is True:
+            job.status = Job.RUNNING
+            job.time_started = timezone.now()
+            job.save()
+            self.run_job(job)
+        return job
+
+    def get_pending_jobs(self):
+        """
+        :return: queryset of the jobs that can be claimed, oldest first.
+        """
+        return self.model.objects.filter(status=Job.PENDING).order_by('time_created')
+
+    def must_wait(self, job):
+        """Whether a claimed job has to be put back in the queue."""
+        return False
+
+    def claim_next_job(self):
+        """Marks the oldest pending job as running. Several workers can call
+        this at the same time, as only one of them will manage to update the
+        job.
+
+        :return: instance of ``model`` or None if there are no jobs that can
+                 be run.
+        """
+        self.fail_abandoned_jobs()
+        for job in self.get_pending_jobs()[:10]:
+            claimed = self.model.objects.filter(pk=job.pk, status=Job.PENDING).update(
+                status=Job.RUNNING,
+                time_started=timezone.now(),
+            )
+            if claimed != 1:
+                continue
+            if self.must_wait(job):
+                self.model.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                    status=Job.PENDING,
+                    time_started=None,
+                )
+                continue
+            return self.model.objects.get(pk=job.pk)
+        return None
+
+    def run_job(self, job):
+        """Does the work of a claimed job and saves it as finished or
+        failed.
+        """
+        raise NotImplementedError
+
+    def remove_old_jobs(self):
+        """Deletes finished and failed jobs older than ``<prefix>_EXPIRY``
+        seconds.
+        """
+        self.model.objects.filter(
+            status__in=[Job.FINISHED, Job.FAILED],
+            time_finished__lt=self.get_expiry_date(),
+        ).delete()
+
+    def run_worker(self, poll_interval=1.0, exit_when_idle=False):
+        """Runs pending jobs one after the other.
+
+        :param poll_interval: seconds to wait for new jobs when the queue is
+                              empty.
+        :param exit_when_idle: return when no job can be run instead of
+                               waiting.
+        """
+        while True:
+            job = self.claim_next_job()
+            if job is not None:
+                log.info("Running %s job %s", self.name, job.job_id)
+                self.run_job(job)
+                continue
+
+            self.remove_old_jobs()
+            if exit_when_idle:
+                return
+            time.sleep(poll_interval)
+
+    def get_job_status(self, job):
+        """
+        :return: dict to be returned as JSON by status views.
+        """
+        return {
+            'job_id': job.job_id,
+            'status': job.status,
+        }
+
+
+class WorkerCommand(BaseCommand):
+    """Starts worker processes running the jobs of ``queue``."""
+    queue = None
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                    dest='workers',
+                    type='int',
+                    default=2,
+                    help='Number of worker processes, which is the number of jobs run at the same time.',
+                    ),
+        make_option('--poll-interval',
+                    dest='poll_interval',
+                    type='float',
+                    default=1.0,
+                    help='Seconds to wait before looking for new jobs when the queue is empty.',
+                    ),
+        make_option('--exit-when-idle',
+                    action='store_true',
+                    dest='exit_when_idle',
+                    default=False,
+                    help='Stop workers once there are no pending jobs.',
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        # Each worker process needs to open its own database connection.
+        for connection in connections.all():
+            connection.close()
+
+        workers = []
+        for i in range(options['workers']):
+            worker = multiprocessing.Process(
+                target=self.queue.run_worker,
+                args=(options['poll_interval'], options['exit_when_idle']),
+            )
+            worker.start()
+            workers.append(worker)
+        self.stdout.write('Started %i %s workers' % (len(workers), self.queue.name))
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,45 @@
+import json
+
+from django.db import models
+
+
+class Job(models.Model):
+    """Work submitted by views and run by the worker processes of a
+    ``core.jobs.JobQueue`` instead of inside the request.
+
+    Identical submissions have the same ``key``, so they can share one job.
+    """
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    FINISHED = 'FINISHED'
+    FAILED = 'FAILED'
+
+    job_id = models.CharField(max_length=32, unique=True)
+    key = models.CharField(
+        max_length=40,
+        db_index=True,
+        help_text='SHA1 hash of the job options.',
+    )
+    status = models.CharField(
+        max_length=10, choices=(
+            (PENDING, 'pending'),
+            (RUNNING, 'running'),
+            (FINISHED, 'finished'),
+            (FAILED, 'failed'),
+        ),
+        default=PENDING,
+        db_index=True,
+    )
+    errors = models.TextField(blank=True, help_text='List of errors as JSON.')
+    time_created = models.DateTimeField(auto_now_add=True)
+    time_started = models.DateTimeField(blank=True, null=True)
+    time_finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+    def get_errors(self):
+        return json.loads(self.errors or '[]')
+
+    def __str__(self):
+        return self.job_id
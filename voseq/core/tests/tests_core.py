@@ -1,10 +1,11 @@
+import numpy
 from django.test import TestCase
 from django.core.management import call_command
 
-from Bio.Seq import Seq
-from Bio.Alphabet import generic_dna
-
 from core import utils
+from core.translation import SYMBOLS
+from core.translation import get_codon_index
+from core.translation import get_translator
 from public_interface.models import Genes
 from public_interface.models import Sequences
 
@@ -93,92 +94,38 @@ class TestCore(TestCase):
         results = utils.flatten_taxon_names_dict(dictionary)
         self.assertEqual(expected, results)
 
-    def test_gapped_translation(self):
-        sequence = 'ATG---GCCATTGTAATGGGCCGG'
-        expected = 'M?AIVMGR'
-        genetic_code = 1
-        result = utils.gapped_translation(sequence, genetic_code)
-        self.assertEqual(expected, result)
-
-    def test_getting_gap_indexes1(self):
-        sequence = 'ATG---GCCATTGTAATGGGCCGG'
-        expected = [1]
-        indexes, sequence = utils.get_gap_indexes(sequence)
-        self.assertEqual(expected, indexes)
-
-    def test_getting_gap_indexes2(self):
-        sequence = 'ATG---GCCATT---GTAATGGGCCGG'
-        expected = [1, 4]
-        indexes, sequence = utils.get_gap_indexes(sequence)
-        self.assertEqual(expected, indexes)
-
-    def test_getting_gap_indexes3(self):
-        sequence = 'ATG---GCC-TTGTAATGGGCCGG'
-        expected = 'ATG---GCC?TTGTAATGGGCCGG'
-        indexes, sequence = utils.get_gap_indexes(sequence)
-        self.assertEqual(expected, sequence)
-
-    def test_add_gaps_to_seq1(self):
-        gap_indexes = [1]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'M?AIVMGR'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq2(self):
-        gap_indexes = [1, 4]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'M?AI?VMGR'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq3(self):
-        gap_indexes = [1, 5]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'M?AIV?MGR'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq4(self):
-        gap_indexes = [2, 5]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'MA?IV?MGR'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq5(self):
-        gap_indexes = [2, 5, 7]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'MA?IV?M?GR'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq6(self):
-        gap_indexes = [2, 5, 7, 9, 10]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'MA?IV?M?G??R'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq7(self):
-        gap_indexes = [0, 5, 7, 9, 10]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = '?MAIV?M?G??R'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
-
-    def test_add_gaps_to_seq8(self):
-        """When the gap is at the end of sequence"""
-        gap_indexes = [2, 8]
-        sequence = 'ATGGCCATTGTAATGGGCCGG'
-        seq = Seq(sequence, generic_dna).translate()
-        expected = 'MA?IVMGR?'
-        result = utils.add_gaps_to_seq(seq, gap_indexes)
-        self.assertEqual(expected, str(result))
+    def test_translate_sequences_to_protein(self):
+        gene_model = {'gene_code': 'COI', 'genetic_code': 1, 'reading_frame': 1}
+        sequences = ['ATG---GCCATTGTAATGGGCCGG', 'ATG---GCC-TTGTAATGG', 'ATGGCC-TTGTA', 'atgTAAnnn?', '']
+        expected = [('M?AIVMGR', ''), ('M?AXVM', ''), ('', ''),
+                    ('M*X', 'Gene COI, sequence id4 contains stop codons "*"'), ('', '')]
+        results = utils.translate_sequences_to_protein(gene_model, sequences,
+                                                       ['id1', 'id2', 'id3', 'id4', 'id5'])
+        self.assertEqual(expected, results)
+
+    def test_translate_sequences_to_protein_same_as_one_by_one(self):
+        gene_model = Genes.objects.filter(gene_code='COI').values()[0]
+        sequences = [i.sequences for i in Sequences.objects.filter(gene_code='COI')]
+        expected = [utils.translate_to_protein(gene_model, i, '', 'id', 'FASTA') for i in sequences]
+        results = utils.translate_sequences_to_protein(gene_model, sequences,
+                                                       ['id'] * len(sequences), 'FASTA')
+        self.assertEqual(expected, results)
+
+    def test_codon_table(self):
+        translator = get_translator(2)
+        for codon, aa in [('ATG', 'M'), ('AGA', '*'), ('TGA', 'W'), ('NNN', 'X'), ('YTR', 'L')]:
+            index = get_codon_index(numpy.array([SYMBOLS.index(i) for i in codon]))
+            self.assertEqual(aa, chr(translator.table[index]))
+
+    def test_degen_table(self):
+        translator = get_translator(1)
+        expected = {
+            'NORMAL': ['YTN', 'MGN', 'TCN', 'AGY', 'ATH', 'TRR', 'YTN', '---', 'A?G'],
+            'S': ['YTN', 'MGN', 'WSN', 'AGY', 'ATH', 'TRR', 'YTN', '---', 'A?G'],
+            'Z': ['YTN', 'MGN', 'TCN', 'WSN', 'ATH', 'TRR', 'YTN', '---', 'A?G'],
+            'SZ': ['YTN', 'MGN', 'NNN', 'NNN', 'ATH', 'TRR', 'YTN', '---', 'A?G'],
+        }
+        matrix = numpy.frombuffer(b'TTAAGGTCAAGCATATAGttn---A?G', dtype=numpy.uint8).reshape(1, -1)
+        for degen_translations, codons in expected.items():
+            result = translator.degenerate_matrix(matrix, degen_translations)
+            self.assertEqual(''.join(codons), result.tobytes().decode('ascii'))
@@ -1,10 +1,16 @@
+import os
+import tempfile
+from unittest import mock
+
 from django.test import TestCase
 from django.core.management import call_command
 
 from core import exceptions
+from core.utils import chunks
 from core.utils import get_gene_codes
 from core.utils import get_voucher_codes
 from core.utils import get_start_translation_index
+from core.utils import lock_file
 from core.utils import strip_question_marks
 from public_interface.models import TaxonSets
 from public_interface.models import GeneSets
@@ -47,6 +53,11 @@ class TestCoreUtils(TestCase):
         result = get_voucher_codes(self.cleaned_data)
         self.assertEqual(expected, result)
 
+    def test_chunks(self):
+        expected = [('a', 'b'), ('c', 'd'), ('e',)]
+        result = list(chunks(['a', 'b', 'c', 'd', 'e'], 2))
+        self.assertEqual(expected, result)
+
     def test_get_voucher_codes_dropped(self):
         self.cleaned_data['voucher_codes'] = 'CP100-10\r\n--CP100-11\r\nCP100-12'
         expected = 2
@@ -105,3 +116,15 @@ class TestCoreUtils(TestCase):
         result = strip_question_marks(seq)
         expected = ('ATC', 6)
         self.assertEqual(expected, result)
+
+    def test_lock_file_without_fcntl(self):
+        handle, filename = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+        msvcrt = mock.Mock(LK_LOCK=1, LK_UNLCK=0)
+        msvcrt.locking.side_effect = [OSError, None, None]
+        with mock.patch('core.utils.fcntl', None), \
+                mock.patch('core.utils.msvcrt', msvcrt, create=True):
+            with lock_file(filename):
+                self.assertEqual(2, msvcrt.locking.call_count)
+        self.assertEqual(0, msvcrt.locking.call_args[0][1])
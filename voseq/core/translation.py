@@ -0,0 +1,295 @@
+"""
+Codon tables used to translate nucleotide sequences into aminoacids.
+
+A table is precomputed once for each NCBI genetic code. It holds the
+aminoacid for every codon made of IUPAC nucleotides and gaps, as BioPython
+translates them, so whole gene blocks can be translated with array lookups.
+Codons with other characters, and invalid codons, go through BioPython one
+at a time to get exactly the same result or error.
+
+The same codons are used to build the tables of degenerated codons, which
+recode nucleotide sequences as in "degen_v1_4.pl" by A. Zwick & A. Hussey.
+"""
+import collections
+import itertools
+import warnings
+
+import numpy as np
+
+from Bio.Seq import Seq
+from Bio.Alphabet import generic_dna
+from Bio.Data.CodonTable import TranslationError
+from Bio.Data.IUPACData import ambiguous_dna_values
+
+
+# Nucleotides, IUPAC ambiguity codes and gap.
+SYMBOLS = 'ACGTURYSWKMBDHVN-'
+
+UNKNOWN = len(SYMBOLS)
+NUMBER_OF_SYMBOLS = len(SYMBOLS) + 1
+
+# Maps bytes to their position in SYMBOLS. BioPython translates lower case
+# nucleotides as upper case ones.
+SYMBOL_INDEXES = np.full(256, UNKNOWN, dtype=np.int16)
+for index, symbol in enumerate(SYMBOLS):
+    SYMBOL_INDEXES[ord(symbol)] = index
+    SYMBOL_INDEXES[ord(symbol.lower())] = index
+
+GAP = ord('-')
+
+# Value in the codon tables for codons that need to go through BioPython.
+NOT_IN_TABLE = 0
+
+# Nucleotides and IUPAC ambiguity codes as bit masks of A, C, G and T.
+NUCLEOTIDE_MASKS = {'A': 1, 'C': 2, 'G': 4, 'T': 8}
+SYMBOL_MASKS = dict()
+for symbol in SYMBOLS[:-1]:
+    nucleotides = ambiguous_dna_values.get(symbol, 'T')  # U is read as T
+    SYMBOL_MASKS[symbol] = sum(NUCLEOTIDE_MASKS[i] for i in nucleotides)
+MASK_SYMBOLS = dict((mask, symbol) for symbol, mask in SYMBOL_MASKS.items() if symbol != 'U')
+
+# Ways of recoding serine codons in degenerated datasets. Serine 1 codons
+# are TCN and serine 2 codons are AGY in the standard genetic code.
+#   NORMAL: serine 1 and serine 2 are degenerated separately.
+#   S: serine 1 is degenerated to include serine 2.
+#   Z: serine 2 is degenerated to include serine 1.
+#   SZ: serine 1 and serine 2 are recoded as NNN.
+DEGEN_TRANSLATIONS = ('NORMAL', 'S', 'Z', 'SZ')
+
+_translators = {}
+
+
+def get_translator(genetic_code):
+    """
+    :param genetic_code: NCBI genetic code id.
+    :return: Translator, created only once for each genetic code.
+    """
+    if genetic_code not in _translators:
+        _translators[genetic_code] = Translator(genetic_code)
+    return _translators[genetic_code]
+
+
+def get_codon_index(codons):
+    """
+    :param codons: array of symbol indexes with codon positions in its last axis.
+    :return: array of indexes to codon tables.
+    """
+    return (codons[..., 0] * NUMBER_OF_SYMBOLS + codons[..., 1]) * NUMBER_OF_SYMBOLS + codons[..., 2]
+
+
+class Translator(object):
+    """
+    Translates nucleotide sequences using one genetic code.
+
+    Sequences are translated codon by codon and a trailing incomplete codon
+    is ignored. For gapped sequences ``---`` codons are translated as ``?``
+    and other gaps are read as ``N``. A TranslationError is raised for
+    sequences with invalid codons.
+    """
+    def __init__(self, genetic_code):
+        self.genetic_code = genetic_code
+        self.codons = dict()
+        self.table = self.make_codon_table()
+        self.degen_tables = dict()
+
+    def translate_codon(self, codon):
+        if codon not in self.codons:
+            try:
+                self.codons[codon] = str(Seq(codon, generic_dna).translate(table=self.genetic_code))
+            except TranslationError as e:
+                self.codons[codon] = e
+
+        aa = self.codons[codon]
+        if isinstance(aa, TranslationError):
+            raise aa
+        return aa
+
+    def make_codon_table(self):
+        """
+        :return: uint8 array with the aminoacid for each codon, indexed by
+                 ``get_codon_index``.
+        """
+        table = np.full(NUMBER_OF_SYMBOLS ** 3, NOT_IN_TABLE, dtype=np.uint8)
+        with warnings.catch_warnings():
+            # Some genetic codes warn about codons that can be both stop
+            # codons and aminoacids every time they are used.
+            warnings.simplefilter('ignore')
+
+            # Codons without gaps are valid, so we translate them at once.
+            nucleotide_codons = [''.join(codon) for codon in itertools.product(SYMBOLS[:-1], repeat=3)]
+            try:
+                aminoacids = str(Seq(''.join(nucleotide_codons), generic_dna).translate(table=self.genetic_code))
+            except TranslationError:
+                pass
+            else:
+                self.codons.update(zip(nucleotide_codons, aminoacids))
+
+            for codon in itertools.product(range(len(SYMBOLS)), repeat=3):
+                try:
+                    aa = self.translate_codon(''.join(SYMBOLS[i] for i in codon))
+                except TranslationError:
+                    continue
+                table[get_codon_index(np.array(codon))] = ord(aa)
+        return table
+
+    def translate(self, sequence, gapped=False):
+        """Translates one sequence codon by codon.
+
+        :raises: TranslationError if a codon is invalid.
+        """
+        aminoacids = []
+        for i in range(0, len(sequence) - len(sequence) % 3, 3):
+            codon = sequence[i:i + 3]
+            if gapped:
+                if codon == '---':
+                    aminoacids.append('?')
+                    continue
+                codon = codon.replace('-', 'N')
+            aminoacids.append(self.translate_codon(codon))
+        return ''.join(aminoacids)
+
+    def translate_many(self, sequences):
+        """Translates a batch of sequences with array lookups.
+
+        :param sequences: list of tuples (sequence, gapped).
+        :return: list with the aminoacid sequence for each item, or the
+                 TranslationError raised while translating it.
+        """
+        results = [None] * len(sequences)
+        rows = []
+        for index, (sequence, gapped) in enumerate(sequences):
+            try:
+                rows.append((index, sequence.encode('ascii'), gapped))
+            except UnicodeEncodeError:
+                results[index] = self.translate_or_error(sequence, gapped)
+
+        if rows:
+            number_of_codons = max(len(row[1]) for row in rows) // 3
+            matrix = np.zeros((len(rows), number_of_codons * 3), dtype=np.uint8)
+            for i, (index, sequence, gapped) in enumerate(rows):
+                sequence = sequence[:number_of_codons * 3]
+                matrix[i, :len(sequence)] = np.frombuffer(sequence, dtype=np.uint8)
+
+            aminoacids = self.translate_matrix(matrix, np.array([row[2] for row in rows], dtype=bool))
+
+            for i, (index, sequence, gapped) in enumerate(rows):
+                translated = aminoacids[i, :len(sequence) // 3]
+                if (translated == NOT_IN_TABLE).any():
+                    results[index] = self.translate_or_error(sequence.decode('ascii'), gapped)
+                else:
+                    results[index] = translated.tobytes().decode('ascii')
+        return results
+
+    def translate_matrix(self, matrix, gapped):
+        """
+        :param matrix: uint8 array of sequences x sites, with a number of
+                       sites multiple of three.
+        :param gapped: boolean array, True for sequences to be translated as
+                       gapped sequences.
+        :return: uint8 array of sequences x codons.
+        """
+        codons = matrix.reshape(matrix.shape[0], -1, 3)
+        symbols = SYMBOL_INDEXES[codons]
+        aminoacids = self.table[get_codon_index(symbols)]
+
+        if gapped.any():
+            gapped_symbols = symbols[gapped]
+            gapped_symbols[gapped_symbols == SYMBOLS.index('-')] = SYMBOLS.index('N')
+            gapped_aminoacids = self.table[get_codon_index(gapped_symbols)]
+            gapped_aminoacids[(codons[gapped] == GAP).all(axis=2)] = ord('?')
+            aminoacids[gapped] = gapped_aminoacids
+        return aminoacids
+
+    def translate_or_error(self, sequence, gapped):
+        try:
+            return self.translate(sequence, gapped)
+        except TranslationError as e:
+            return e
+
+    def get_degen_table(self, degen_translations='NORMAL'):
+        if degen_translations not in self.degen_tables:
+            self.degen_tables[degen_translations] = self.make_degen_table(degen_translations)
+        return self.degen_tables[degen_translations]
+
+    def get_degenerated_masks(self, degen_translations):
+        """Degenerates each codon to all the codons of its aminoacid.
+
+        :return: dict of codon: tuple of the nucleotide masks of the
+                 degenerated codon, for codons of A, C, G and T.
+        """
+        if degen_translations not in DEGEN_TRANSLATIONS:
+            raise ValueError("Unknown degen translation %r" % degen_translations)
+
+        synonymous_codons = collections.OrderedDict()
+        for codon in itertools.product('ACGT', repeat=3):
+            codon = ''.join(codon)
+            aa = self.translate_codon(codon)
+            if aa == 'S':
+                aa = 'S1' if codon.startswith('TC') else 'S2'
+            synonymous_codons.setdefault(aa, []).append(codon)
+
+        def union(codons):
+            return tuple(
+                sum(set(NUCLEOTIDE_MASKS[codon[i]] for codon in codons)) for i in range(3)
+            )
+
+        degenerated = dict((aa, union(codons)) for aa, codons in synonymous_codons.items())
+        serine_codons = synonymous_codons.get('S1', []) + synonymous_codons.get('S2', [])
+        if degen_translations == 'S' and 'S1' in degenerated:
+            degenerated['S1'] = union(serine_codons)
+        elif degen_translations == 'Z' and 'S2' in degenerated:
+            degenerated['S2'] = union(serine_codons)
+        elif degen_translations == 'SZ':
+            for aa in ('S1', 'S2'):
+                if aa in degenerated:
+                    degenerated[aa] = (15, 15, 15)
+
+        masks = dict()
+        for aa, codons in synonymous_codons.items():
+            for codon in codons:
+                masks[codon] = degenerated[aa]
+        return masks
+
+    def make_degen_table(self, degen_translations):
+        """
+        Codons with ambiguity codes are degenerated to include the degenerated
+        codons of all the codons they can stand for. Codons with gaps or other
+        characters are not in the table.
+
+        :return: uint8 array of degenerated codons with shape (codons, 3),
+                 indexed by ``get_codon_index``.
+        """
+        masks = self.get_degenerated_masks(degen_translations)
+
+        table = np.full((NUMBER_OF_SYMBOLS ** 3, 3), NOT_IN_TABLE, dtype=np.uint8)
+        for codon in itertools.product(range(len(SYMBOLS) - 1), repeat=3):
+            nucleotides = [
+                [i for i in 'ACGT' if SYMBOL_MASKS[SYMBOLS[symbol]] & NUCLEOTIDE_MASKS[i]]
+                for symbol in codon
+            ]
+            degenerated = [0, 0, 0]
+            for expanded in itertools.product(*nucleotides):
+                for i, mask in enumerate(masks[''.join(expanded)]):
+                    degenerated[i] |= mask
+            table[get_codon_index(np.array(codon))] = [ord(MASK_SYMBOLS[i]) for i in degenerated]
+        return table
+
+    def degenerate_matrix(self, matrix, degen_translations='NORMAL'):
+        """Recodes the codons of whole gene blocks with array lookups.
+
+        :param matrix: uint8 array of sequences x sites, in frame. A trailing
+                       incomplete codon is kept as it is.
+        :return: new uint8 array with the degenerated codons. Codons with
+                 gaps or characters other than nucleotides and IUPAC
+                 ambiguity codes are kept as they are.
+        """
+        table = self.get_degen_table(degen_translations)
+        number_of_sites = matrix.shape[1] - matrix.shape[1] % 3
+
+        codons = matrix[:, :number_of_sites].reshape(matrix.shape[0], -1, 3)
+        degenerated = table.take(get_codon_index(SYMBOL_INDEXES[codons]), axis=0)
+        degenerated = np.where(degenerated[..., :1] == NOT_IN_TABLE, codons, degenerated)
+
+        recoded = matrix.copy()
+        recoded[:, :number_of_sites] = degenerated.reshape(matrix.shape[0], number_of_sites)
+        return recoded
@@ -1,15 +1,24 @@
+import contextlib
 import itertools
 import json
+import os
 import re
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 from django.conf import settings
 
 from Bio.Seq import Seq
-from Bio.Alphabet import generic_dna
 from Bio.Data.CodonTable import TranslationError
 
 from stats.models import Stats
 from . import exceptions
+from .translation import get_translator
 
 
 def get_voucher_codes(cleaned_data):
@@ -32,29 +41,20 @@ def get_voucher_codes(cleaned_data):
     if cleaned_data['voucher_codes'] != '':
         voucher_codes += tuple(cleaned_data['voucher_codes'].splitlines())
 
-    voucher_codes_clean = tuple()
+    vouchers_to_drop = set()
     for i in voucher_codes:
         if re.search('^--', i):
-            i_clean = re.sub('^--', '', i)
-            voucher_codes_clean += (i_clean,)
-        else:
-            voucher_codes_clean += (i,)
-
-    voucher_codes_set = tuple()
-    for i in voucher_codes_clean:
-        if i not in voucher_codes_set and i.strip() != '':
-            voucher_codes_set += (i,)
+            vouchers_to_drop.add(re.sub('^--', '', i))
 
-    vouchers_to_drop = []
+    voucher_codes_filtered = []
+    seen = set()
     for i in voucher_codes:
-        if re.search('^--', i):
-            vouchers_to_drop.append(re.sub('^--', '', i))
-
-    voucher_codes_filtered = tuple()
-    for i in voucher_codes_set:
-        if i not in vouchers_to_drop:
-            voucher_codes_filtered += (i,)
-    return voucher_codes_filtered
+        i = re.sub('^--', '', i)
+        if i in seen or i in vouchers_to_drop or i.strip() == '':
+            continue
+        seen.add(i)
+        voucher_codes_filtered.append(i)
+    return tuple(voucher_codes_filtered)
 
 
 def get_gene_codes(cleaned_data):
@@ -69,20 +69,33 @@ def get_gene_codes(cleaned_data):
     Returns:
         set of gene codes, no dupes.
     """
-    gene_codes = []
+    gene_codes = set()
     if cleaned_data['geneset'] is not None:
         geneset_list = json.loads(cleaned_data['geneset'].geneset_list)
-        for i in geneset_list:
-            if i not in gene_codes:
-                gene_codes.append(i)
+        gene_codes.update(geneset_list)
 
     if len(cleaned_data['gene_codes']) > 0:
-        for i in cleaned_data['gene_codes']:
-            if i.gene_code not in gene_codes:
-                gene_codes.append(i.gene_code)
+        gene_codes.update(i.gene_code for i in cleaned_data['gene_codes'])
+
+    return tuple(sorted(gene_codes))
+
+
+def chunks(items, size):
+    """Splits a sequence of items in tuples of at most `size` elements.
+
+    Used to keep the number of parameters of ``__in`` lookups under the
+    limits of database backends (SQLite accepts 999 parameters per query).
+
+    Args:
+        * `items`: list or tuple.
+        * `size`: maximum number of elements in each chunk.
 
-    gene_codes.sort()
-    return tuple(gene_codes)
+    Returns:
+        generator of tuples.
+    """
+    items = tuple(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 def get_version_stats():
@@ -219,95 +232,56 @@ def get_start_translation_index(gene_model, removed):
 
 
 def translate_to_protein(gene_model, sequence, seq_description, seq_id, file_format=None):
-    removed = 0
-    if file_format == 'FASTA' or file_format == 'GenbankFASTA':
-        sequence, removed = strip_question_marks(sequence)
-    seq_seq = sequence.replace('?', 'N')
-
-    start_translation = get_start_translation_index(gene_model, removed)
-
-    seq_obj = Seq(seq_seq[start_translation:], generic_dna)
-
-    if '---' in seq_seq:  # we have gaps
-        try:
-            prot_sequence = gapped_translation(seq_obj, gene_model['genetic_code'])
-        except TranslationError as e:
-            print("Error %s" % e)
-            return "", ""
-    else:
-        try:
-            prot_sequence = seq_obj.translate(table=gene_model['genetic_code'])
-        except TranslationError as e:
-            print("Error %s" % e)
-            return "", ""
-
-    if '*' in prot_sequence:
-        warning = 'Gene %s, sequence %s contains stop codons "*"' % (gene_model['gene_code'], seq_id)
-    else:
-        warning = ''
+    return translate_sequences_to_protein(gene_model, [sequence], [seq_id], file_format)[0]
 
-    # 'J' is used in the extended IUPAC codes and means either Leucine or Isoleucine
-    # too bad that RaXML does not accept it as valid aminoacid. So we replace it with 'X'
-    prot_sequence = str(prot_sequence)
-    if 'J' in prot_sequence:
-        prot_sequence = prot_sequence.replace('J', 'X')
 
-    if file_format == 'PHY' or file_format == 'GenbankFASTA':
-        return prot_sequence, warning
+def translate_sequences_to_protein(gene_model, sequences, seq_ids, file_format=None):
+    """Translates all the sequences of a gene in one batch.
 
-    return prot_sequence, warning
-
-
-def gapped_translation(seq_obj, genetic_code):
-    gap_indexes, sequence = get_gap_indexes(seq_obj)
-    seq = Seq(sequence, generic_dna)
-
-    ungapped_seq = seq.ungap('-')
-    ungapped_seq = str(ungapped_seq).replace('?', 'N')
-    ungapped_seq = Seq(ungapped_seq, generic_dna)
-
-    translated_seq = ungapped_seq.translate(table=genetic_code)
-    translated_seq_with_gaps = add_gaps_to_seq(translated_seq, gap_indexes)
-    return str(translated_seq_with_gaps)
+    Uses the codon table of the gene's genetic code, see ``core.translation``.
 
+    Args:
+        * `gene_model`: dict with gene_code, reading_frame and genetic_code.
+        * `sequences`: list of nucleotide sequences as strings.
+        * `seq_ids`: list of sequence ids, used in warnings.
+        * `file_format`: FASTA and GenbankFASTA sequences get their leading
+          and trailing question marks stripped before translation.
 
-def add_gaps_to_seq(aa_sequence, gap_indexes):
-    aa_seq_as_list = list(aa_sequence)
+    Returns:
+        list of tuples (aminoacid sequence, warning). Both are empty strings
+        for sequences that could not be translated.
+    """
+    to_translate = []
+    for sequence in sequences:
+        removed = 0
+        if file_format == 'FASTA' or file_format == 'GenbankFASTA':
+            sequence, removed = strip_question_marks(sequence)
+        seq_seq = sequence.replace('?', 'N')
 
-    number_of_question_marks_appended = 0
-    for index in gap_indexes:
-        new_index = index - number_of_question_marks_appended
-        try:
-            this_aa = aa_seq_as_list[new_index]
-        except IndexError:
-            this_aa = ''
+        start_translation = get_start_translation_index(gene_model, removed)
+        to_translate.append((seq_seq[start_translation:], '---' in seq_seq))
 
-        try:
-            aa_seq_as_list[new_index] = '?' + this_aa
-        except IndexError:
-            aa_seq_as_list.append('?')
-        number_of_question_marks_appended += 1
-    return ''.join(aa_seq_as_list)
+    translator = get_translator(gene_model['genetic_code'])
+    translated = translator.translate_many(to_translate)
 
+    out = []
+    for seq_id, prot_sequence in zip(seq_ids, translated):
+        if isinstance(prot_sequence, TranslationError):
+            print("Error %s" % prot_sequence)
+            out.append(("", ""))
+            continue
+
+        if '*' in prot_sequence:
+            warning = 'Gene %s, sequence %s contains stop codons "*"' % (gene_model['gene_code'], seq_id)
+        else:
+            warning = ''
 
-def get_gap_indexes(seq_obj):
-    """If - is found not forming gap codons, it will be replaced by ? and
-    the new sequence will be returned with this replacemen.
-    """
-    indexes_for_gaps_in_translated_sequence = []
-    new_sequence = ''
-
-    i = 0
-    for index in range((len(seq_obj) // 3) + 1):
-        j = i + 3
-        tmp = str(seq_obj[i:j])
-        if tmp.find('---') == 0:
-            indexes_for_gaps_in_translated_sequence.append(index)
-        elif '-' in tmp:
-            tmp = tmp.replace('-', '?')
-        new_sequence += tmp
-        i += 3
-    return indexes_for_gaps_in_translated_sequence, new_sequence
+        # 'J' is used in the extended IUPAC codes and means either Leucine or Isoleucine
+        # too bad that RaXML does not accept it as valid aminoacid. So we replace it with 'X'
+        if 'J' in prot_sequence:
+            prot_sequence = prot_sequence.replace('J', 'X')
+        out.append((prot_sequence, warning))
+    return out
 
 
 def strip_question_marks(seq):
@@ -327,3 +301,46 @@ def strip_question_marks(seq):
     seq = re.sub('\?+$', '', seq)
     seq = re.sub('N+$', '', seq)
     return seq, removed
+
+
+@contextlib.contextmanager
+def lock_file(filename):
+    """Holds an exclusive lock on a file, waiting for other processes
+    holding it.
+    """
+    with open(filename, 'a+') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            _lock_first_byte(handle)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _lock_first_byte(handle):
+    """Locks the first byte of a file where ``fcntl`` is missing, as
+    ``msvcrt.locking`` gives up after trying for 10 seconds.
+    """
+    while True:
+        handle.seek(0)
+        try:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def write_file_atomically(filename, content):
+    """Writes to a temporary file and moves it in place, so readers find
+    either the old or the new content.
+    """
+    temp_file = filename + '.' + uuid.uuid4().hex + '.tmp'
+    with open(temp_file, 'w') as handle:
+        handle.write(content)
+    os.replace(temp_file, filename)
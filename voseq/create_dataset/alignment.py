@@ -0,0 +1,196 @@
+"""
+In-memory alignment model used to create datasets.
+
+The sequences of each gene, or of some codon positions of each gene, are kept
+in a ``GeneBlock`` as a 2-D array of bytes with one row per taxon. An
+``Alignment`` groups the blocks in partitions. Dataset writers render these
+objects directly, so formatted lines never need to be parsed back.
+"""
+import collections
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+
+# Shorter sequences of a gene block are padded with this byte. It is
+# stripped when sequences are rendered.
+PAD = 0
+
+MISSING = ord('?')
+
+Row = namedtuple('Row', ['taxon', 'voucher_code', 'seq'])
+
+
+def to_matrix(seqs):
+    """Converts sequences to a 2-D uint8 array of taxa x sites.
+
+    Characters that do not fit in one byte are replaced by ``?``.
+    """
+    encoded = [seq.encode('latin-1', 'replace') for seq in seqs]
+    lengths = set(len(seq) for seq in encoded)
+    width = max(lengths or [0])
+
+    if len(lengths) == 1:
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8).reshape(len(encoded), width)
+
+    matrix = np.full((len(encoded), width), PAD, dtype=np.uint8)
+    for index, seq in enumerate(encoded):
+        matrix[index, :len(seq)] = np.frombuffer(seq, dtype=np.uint8)
+    return matrix
+
+
+def row_to_str(row):
+    return row.tobytes().rstrip(b'\x00').decode('latin-1')
+
+
+def get_codon_positions(matrix, reading_frame, positions):
+    """Extracts codon positions from all the sequences of a gene at once.
+
+    :param matrix: 2-D uint8 array of taxa x sites.
+    :param reading_frame: number of sites to skip to put sequences in frame.
+    :param positions: list of codon positions: 0 for 1st, 1 for 2nd, 2 for 3rd.
+    :return: 2-D array. A single position is returned as a strided view of
+             ``matrix``. For several positions sites are kept in the order
+             they appear, so 1st and 2nd positions come out interleaved.
+    """
+    in_frame = matrix[:, reading_frame:]
+    if len(positions) == 1:
+        return in_frame[:, positions[0]::3]
+    kept = np.zeros(3, dtype=bool)
+    kept[positions] = True
+    return in_frame[:, kept[np.arange(in_frame.shape[1]) % 3]]
+
+
+def parse_introns(intron):
+    """
+    :param intron: intron positions as stored in ``Genes.intron``: 1-based
+                   inclusive ranges separated by semicolons, such as
+                   ``101-103;125-127``.
+    :return: list of tuples (start, end) to slice sequences.
+    :raises: ValueError if the positions cannot be read.
+    """
+    ranges = []
+    for item in intron.split(';'):
+        item = item.strip()
+        if item == '':
+            continue
+        start, sep, end = item.partition('-')
+        start = int(start)
+        end = int(end) if sep else start
+        if start < 1 or end < start:
+            raise ValueError("Invalid intron range %r" % item)
+        ranges.append((start - 1, end))
+    return ranges
+
+
+@functools.lru_cache(maxsize=256)
+def get_exon_mask(intron, number_of_sites):
+    """Site mask of a gene, computed once for each intron string and
+    alignment length among the last ones used, so long running workers do
+    not keep every mask.
+
+    :return: read-only boolean array, False for sites in introns.
+    :raises: ValueError if the intron positions cannot be read.
+    """
+    mask = np.ones(number_of_sites, dtype=bool)
+    for start, end in parse_introns(intron):
+        mask[start:end] = False
+    mask.flags.writeable = False
+    return mask
+
+
+class GeneBlock(object):
+    """
+    Sequences of one gene for all taxa in the dataset.
+
+    Attributes:
+        ``gene_code``: gene code of the sequences.
+        ``taxa``: list of taxon names, one for each row of ``matrix``, kept
+                  in the order the vouchers were requested.
+        ``voucher_codes``: list of voucher codes, one for each row.
+        ``matrix``: 2-D uint8 array of taxa x sites.
+        ``label``: suffix naming the codon positions in this block, such as
+                   ``_1st_codon``. None if the block is not split by codon
+                   positions.
+
+    """
+    def __init__(self, gene_code, taxa, voucher_codes, matrix, label=None):
+        self.gene_code = gene_code
+        self.taxa = taxa
+        self.voucher_codes = voucher_codes
+        self.matrix = matrix
+        self.label = label
+
+    @classmethod
+    def from_sequences(cls, gene_code, taxa, voucher_codes, seqs, label=None):
+        return cls(gene_code, taxa, voucher_codes, to_matrix(seqs), label)
+
+    def __iter__(self):
+        """Yields ``Row(taxon, voucher_code, seq)`` with sequences as strings."""
+        for taxon, voucher_code, row in zip(self.taxa, self.voucher_codes, self.matrix):
+            yield Row(taxon, voucher_code, row_to_str(row))
+
+    def __len__(self):
+        return len(self.taxa)
+
+    @property
+    def number_chars(self):
+        if len(self) > 0:
+            return len(self.matrix[0].tobytes().rstrip(b'\x00'))
+        return 0
+
+    def has_data(self):
+        """
+        :return: boolean array, True for rows with sequence data other than ``?``.
+        """
+        return ((self.matrix != MISSING) & (self.matrix != PAD)).any(axis=1)
+
+
+class Alignment(object):
+    """
+    Dataset matrix as a tuple of partitions, each one a list of GeneBlocks.
+
+    Datasets split by codon positions have one partition for each group of
+    positions, so every gene has one block in each partition.
+    """
+    def __init__(self, number_of_partitions=1):
+        self.partitions = tuple([] for i in range(number_of_partitions))
+
+    def __iter__(self):
+        return iter(self.partitions)
+
+    def __getitem__(self, index):
+        return self.partitions[index]
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def add_block(self, partition_index, block):
+        self.partitions[partition_index].append(block)
+        return block
+
+    def get_gene_lengths(self):
+        """
+        :return: OrderedDict of gene_code: number of characters, taken from
+                 the blocks of the first partition.
+        """
+        gene_lengths = collections.OrderedDict()
+        for block in self.partitions[0]:
+            if len(block) > 0:
+                gene_lengths[block.gene_code] = block.number_chars
+        return gene_lengths
+
+    def count_genes_per_taxon(self):
+        """
+        :return: dict of taxon: number of genes with sequence data other than
+                 ``?``, counted in the blocks of the first partition.
+        """
+        number_of_genes_for_taxa = dict()
+        for block in self.partitions[0]:
+            for taxon, has_data in zip(block.taxa, block.has_data()):
+                if taxon not in number_of_genes_for_taxa:
+                    number_of_genes_for_taxa[taxon] = 0
+                if has_data:
+                    number_of_genes_for_taxa[taxon] += 1
+        return number_of_genes_for_taxa
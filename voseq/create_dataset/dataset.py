@@ -1,11 +1,93 @@
 import collections
-from collections import namedtuple
 import os
+from collections import namedtuple
+import tempfile
 import uuid
-import re
 
 from core import utils
+from core.translation import get_translator
 from public_interface.models import Genes
+from .alignment import Alignment
+from .alignment import GeneBlock
+from .alignment import get_codon_positions
+from .alignment import get_exon_mask
+
+
+# Size of the pieces read back from spooled dataset bodies.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Dataset bodies smaller than this are spooled in memory, bigger ones on disk.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+CODON_POSITIONS = {
+    '1st': 0,
+    '2nd': 1,
+    '3rd': 2,
+}
+
+CODON_DESCRIPTIONS = {
+    '1st': '_1st_codon',
+    '2nd': '_2nd_codon',
+    '3rd': '_3rd_codon',
+}
+
+# Group of codon positions written as one partition of the dataset.
+# ``positions`` is a tuple of indexes into codons, or None for whole
+# sequences used as they are. ``label`` is the suffix of the gene code in the
+# gene blocks of the partition.
+Partition = namedtuple('Partition', ['positions', 'label'])
+
+
+def plan_partitions(codon_positions, partition_by_positions):
+    """Works out the partitions of a dataset from the codon positions and the
+    partitioning chosen by users.
+
+    :param codon_positions: list with ``ALL``, ``1st``, ``2nd`` or ``3rd``.
+                            ``ALL`` overrides other positions.
+    :param partition_by_positions: ``ONE``, ``EACH`` or ``1st2nd_3rd``.
+    :return: list of Partition, empty if no codon positions were chosen.
+    """
+    if 'ALL' in codon_positions:
+        positions = ['1st', '2nd', '3rd']
+    else:
+        positions = [i for i in ['1st', '2nd', '3rd'] if i in codon_positions]
+
+    if partition_by_positions == '1st2nd_3rd' and '1st' in positions and '2nd' in positions:
+        plan = [Partition((0, 1), '_1st_2nd_codons')]
+        if '3rd' in positions:
+            plan.append(Partition((2,), CODON_DESCRIPTIONS['3rd']))
+        return plan
+
+    if partition_by_positions == 'ONE' and len(positions) == 3:
+        return [Partition(None, None)]
+    if partition_by_positions == 'ONE' and len(positions) == 2:
+        return [Partition(tuple(CODON_POSITIONS[i] for i in positions), None)]
+
+    # A single codon position is always named after it.
+    return [Partition((CODON_POSITIONS[i],), CODON_DESCRIPTIONS[i]) for i in positions]
+
+
+def strip_chunks(chunks):
+    """Yields the chunks as ``''.join(chunks).strip()`` would produce them,
+    without joining them.
+
+    Whitespace at the end of a chunk is held back until we know there is more
+    content after it.
+    """
+    started = False
+    pending = ''
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip()
+            if chunk == '':
+                continue
+            started = True
+        stripped = chunk.rstrip()
+        if stripped == '':
+            pending += chunk
+            continue
+        yield pending + stripped
+        pending = chunk[len(stripped):]
 
 
 class Dataset(object):
@@ -14,12 +96,22 @@ class Dataset(object):
     """
     def __init__(self, codon_positions, partition_by_positions, seq_objs, gene_codes,
                  voucher_codes, file_format, outgroup=None, voucher_codes_metadata=None,
-                 minimum_number_of_genes=None, aminoacids=None):
+                 minimum_number_of_genes=None, aminoacids=None, streaming=False,
+                 degen_translations=None, remove_introns=False, progress_callback=None):
         self.minimum_number_of_genes = minimum_number_of_genes
         self.outgroup = outgroup
         self.file_format = file_format
         self.codon_positions = codon_positions
         self.aminoacids = aminoacids
+
+        # Aminoacids override degenerated translations, which in turn
+        # override the choice of codon positions.
+        if self.aminoacids is True:
+            degen_translations = None
+        self.degen_translations = degen_translations
+        if self.degen_translations is not None:
+            self.codon_positions = ['ALL']
+
         self.partition_by_positions = partition_by_positions
         # need to sort our seq_objs dictionary by gene_code
         self.seq_objs = collections.OrderedDict(sorted(seq_objs.items(), key=lambda t: t[0]))
@@ -29,9 +121,18 @@ class Dataset(object):
         self.vouchers_to_drop = None
         self.number_taxa = len(self.voucher_codes)
         self.reading_frames = self.get_reading_frames()
+        self.genetic_codes = self.get_genetic_codes()
+        self.remove_introns = remove_introns
+        self.introns = self.get_introns()
         self.voucher_codes_metadata = voucher_codes_metadata
         self.warnings = []
-        self.partition_list = None
+        self.alignment = None
+        self.streaming = streaming
+
+        # Called with the number of genes done and the total number of genes
+        # every time the sequences of a gene are read.
+        self.progress_callback = progress_callback
+        self.genes_done = 0
 
         self.cwd = os.path.dirname(__file__)
         self.guid = self.make_guid()
@@ -44,9 +145,24 @@ class Dataset(object):
                                             self.file_format + '_aa_' + self.guid + '.txt',
                                             )
 
-    def save_dataset_to_file(self, dataset_str):
+    def save_dataset_to_file(self, dataset):
+        """
+        :param dataset: dataset as string or as iterable of strings.
+        """
         with open(self.dataset_file, 'w') as handle:
-            handle.write(dataset_str)
+            if isinstance(dataset, str):
+                handle.write(dataset)
+            else:
+                for chunk in dataset:
+                    handle.write(chunk)
+
+    def remove_dataset_files(self):
+        """Removes what was written of the dataset files if creating the
+        dataset failed.
+        """
+        for filename in [self.dataset_file, self.aa_dataset_file]:
+            if os.path.isfile(filename):
+                os.remove(filename)
 
     def save_aa_dataset_to_file(self, aa_dataset_str):
         with open(self.aa_dataset_file, 'w') as handle:
@@ -55,75 +171,41 @@ class Dataset(object):
     def make_guid(self):
         return uuid.uuid4().hex
 
-    def get_gene_for_current_partition(self, gene_models, out,
-                                       partitions_incorporated, voucher_code):
-        ThisGeneAndPartition = namedtuple('ThisGeneAndPartition', ['this_gene',
-                                                                   'this_gene_model',
-                                                                   'partitions_incorporated',
-                                                                   'out'])
-        gene = voucher_code.replace('[', '').replace(']', '').strip()
-        ThisGeneAndPartition.this_gene = gene
-        ThisGeneAndPartition.this_gene_model = self.get_gene_model_from_gene_id(ThisGeneAndPartition.this_gene, gene_models)
-        ThisGeneAndPartition.partitions_incorporated = partitions_incorporated + 1
-        if self.file_format == 'NEXUS':
-            ThisGeneAndPartition.out = out + ['\n[' + gene + ']']
-        else:
-            ThisGeneAndPartition.out = out + ['\n']
-        return ThisGeneAndPartition
+    def spool(self, chunks):
+        """Writes chunks to a temporary file that stays in memory while it is
+        small and rolls over to disk when it grows.
+
+        Used by formats whose header can only be written once the whole
+        matrix has been processed.
+
+        :return: file object rewound to its start.
+        """
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='w+')
+        for chunk in chunks:
+            # ``writelines`` would only check the size at the end.
+            spooled.write(chunk)
+        spooled.seek(0)
+        return spooled
+
+    def iter_spooled(self, spooled):
+        """Yields the content of a spooled file and closes it."""
+        with spooled:
+            for chunk in iter(lambda: spooled.read(STREAM_CHUNK_SIZE), ''):
+                yield chunk
 
     def get_gene_model_from_gene_id(self, this_gene, gene_models):
         for i in gene_models:
             if i['gene_code'] == this_gene:
                 return i
 
-    def get_number_chars_from_partition_list(self, partitions):
-        chars = 0
-        gene_codes_and_lengths = collections.OrderedDict()
+    def get_number_chars_from_alignment(self, alignment):
+        self.gene_codes_and_lengths = alignment.get_gene_lengths()
+        self.number_chars = sum(self.gene_codes_and_lengths.values())
 
-        i = 0
-        gene_code = ''
-        for item in partitions[0]:
-            if item.startswith('\n'):
-                if self.file_format == 'NEXUS' or self.file_format == 'PHY':
-                    gene_code = item.strip().replace('[', '').replace(']', '')
-                    continue
-                if self.file_format == 'TNT':
-                    gene_code = 'dummy' + str(i)
-                    i += 1
-                    continue
-            if gene_code != '':
-                first_entry = re.sub('\s+', ' ', item)
-                sequence = first_entry.split(' ')[1]
-                chars += len(sequence)
-                gene_codes_and_lengths[gene_code] = len(sequence)
-                gene_code = ''
-        self.gene_codes_and_lengths = gene_codes_and_lengths
-        self.number_chars = chars
-
-    def get_number_of_genes_for_taxa(self, partitions):
-        number_of_genes_for_taxa = dict()
+    def get_number_of_genes_for_taxa(self, alignment):
+        number_of_genes_for_taxa = alignment.count_genes_per_taxon()
         vouchers_to_drop = set()
 
-        gene_code = ''
-        for item in partitions[0]:
-            if item.startswith('\n'):
-                if self.file_format == 'NEXUS' or self.file_format == 'PHY':
-                    gene_code = item.strip().replace('[', '').replace(']', '')
-                    continue
-                if self.file_format == 'TNT':
-                    gene_code = 'dummy'
-                    continue
-            if gene_code != '':
-                entry = re.sub('\s+', ' ', item)
-                voucher, sequence = entry.split(' ')
-
-                if voucher not in number_of_genes_for_taxa:
-                    number_of_genes_for_taxa[voucher] = 0
-
-                sequence = sequence.replace('?', '')
-                if sequence != '':
-                    number_of_genes_for_taxa[voucher] += 1
-
         if self.minimum_number_of_genes is None:
             self.vouchers_to_drop = []
         else:
@@ -145,181 +227,205 @@ class Dataset(object):
         :return: dict of gene_code: reading_frame
         """
         reading_frames = dict()
-        genes = Genes.objects.all().values('gene_code', 'reading_frame')
+        genes = Genes.objects.filter(gene_code__in=self.gene_codes).values('gene_code', 'reading_frame')
         for gene in genes:
-            gene_code = gene['gene_code']
-            if gene_code in self.gene_codes:
-                reading_frames[gene_code] = gene['reading_frame']
+            reading_frames[gene['gene_code']] = gene['reading_frame']
         return reading_frames
 
-    def split_sequence_in_codon_positions(self, gene_code, seq):
-        """Puts the sequence in frame, by deleting base pairs at the beginning
-        of the sequence if the reading frame is not 1.
-
-        Retuns tuple of nucleotides based on codon positions.
-
-        :param gene_code: as lower case
-        :param seq: as BioPython seq object.
-        :return: tuple of seq strings.
-
-        Example:
-            If reading frame is 2: ATGGGG becomes TGGGG. Then the sequence is
-            processed to extract the codon positions requested by the user.
+    def get_genetic_codes(self):
+        """
+        :return: dict of gene_code: genetic_code
+        """
+        genetic_codes = dict()
+        genes = Genes.objects.filter(gene_code__in=self.gene_codes).values('gene_code', 'genetic_code')
+        for gene in genes:
+            genetic_codes[gene['gene_code']] = gene['genetic_code']
+        return genetic_codes
 
+    def get_introns(self):
+        """
+        :return: dict of gene_code: intron positions, for genes with introns.
         """
-        reading_frame = int(self.reading_frames[gene_code]) - 1
-        seq = seq[reading_frame:]
+        introns = dict()
+        genes = Genes.objects.filter(gene_code__in=self.gene_codes).values('gene_code', 'intron')
+        for gene in genes:
+            if gene['intron']:
+                introns[gene['gene_code']] = gene['intron']
+        return introns
 
-        # This is the BioPython way to get codon positions
-        # http://biopython.org/DIST/docs/tutorial/Tutorial.html#htoc19
-        first_position = seq[0::3]
-        second_position = seq[1::3]
-        third_position = seq[2::3]
-        return first_position, second_position, third_position
+    def get_gene_block(self, gene_code):
+        """
+        :return: GeneBlock with the full sequences of the gene for all taxa,
+                 without introns if we want them removed, and degenerated if
+                 we want degenerated translations.
+        """
+        seq_records = self.seq_objs[gene_code]
+        gene_block = GeneBlock.from_sequences(
+            gene_code,
+            [seq_record.id for seq_record in seq_records],
+            [seq_record.description for seq_record in seq_records],
+            [str(seq_record.seq) for seq_record in seq_records],
+        )
+        if self.remove_introns is True and gene_code in self.introns:
+            gene_block = self.drop_introns(gene_block)
+        if self.degen_translations is not None:
+            gene_block = self.degenerate_block(gene_block)
+
+        self.genes_done += 1
+        if self.progress_callback is not None:
+            self.progress_callback(self.genes_done, len(self.seq_objs))
+        return gene_block
+
+    def drop_introns(self, gene_block):
+        """Drops the intron sites of all the sequences of the gene block at
+        once, so codon positions, translations and gene lengths in charset
+        blocks only take exons into account.
+        """
+        gene_code = gene_block.gene_code
+        try:
+            exon_mask = get_exon_mask(self.introns[gene_code], gene_block.matrix.shape[1])
+        except ValueError:
+            self.warnings.append("Could not read intron positions %s of gene %s."
+                                 " Introns have been kept in the dataset." %
+                                 (self.introns[gene_code], gene_code))
+            return gene_block
+        return GeneBlock(gene_code, gene_block.taxa, gene_block.voucher_codes,
+                         gene_block.matrix[:, exon_mask], gene_block.label)
+
+    def degenerate_block(self, gene_block):
+        """Recodes all the sequences of the gene block at once. Genes that are
+        not protein coding are kept as they are.
+        """
+        gene_code = gene_block.gene_code
+        reading_frame = self.reading_frames.get(gene_code)
+        genetic_code = self.genetic_codes.get(gene_code)
+        if reading_frame is None or genetic_code is None:
+            self.warnings.append("Cannot degenerate gene %s sequences."
+                                 " You need to define reading_frame and/or genetic_code." % gene_code)
+            return gene_block
+
+        reading_frame = int(reading_frame) - 1
+        translator = get_translator(int(genetic_code))
+        matrix = gene_block.matrix.copy()
+        matrix[:, reading_frame:] = translator.degenerate_matrix(gene_block.matrix[:, reading_frame:],
+                                                                 self.degen_translations)
+        return GeneBlock(gene_code, gene_block.taxa, gene_block.voucher_codes, matrix,
+                         gene_block.label)
+
+    def convert_alignment_to_dataset(self, alignment):
+        """Writes the dataset to ``self.dataset_file``.
+
+        If ``self.streaming`` is True, the dataset is written to file as it is
+        produced and None is returned. Otherwise the dataset is also returned
+        as string.
+        """
+        if self.streaming:
+            try:
+                self.save_dataset_to_file(self.iter_dataset(alignment))
+            except Exception:
+                self.remove_dataset_files()
+                raise
+            return None
+        dataset_str = ''.join(self.iter_dataset(alignment))
+        self.save_dataset_to_file(dataset_str)
+        return dataset_str
 
-    def convert_lists_to_dataset(self, partitions):
+    def iter_dataset(self, alignment):
         """
         Method to override in order to add headers and footers depending
         on needed dataset.
+
+        :return: generator of strings that joined make up the dataset.
         """
-        out = ''
-        for i in partitions:
-            out += '\n'
-            out += '\n'.join(i)
-        dataset_str = out.strip()
-        self.save_dataset_to_file(dataset_str)
-        return dataset_str
+        return strip_chunks(self.iter_fasta(alignment))
+
+    def iter_fasta(self, alignment):
+        for partition in alignment:
+            if not partition:
+                yield '\n'
+            for block in partition:
+                yield '\n>' + block.gene_code + (block.label or '') + '\n' + '-' * 20
+                for row in block:
+                    yield '\n>' + row.taxon + '\n' + row.seq
+
+    def translate_sequences(self, sequences, this_gene_model, voucher_codes):
+        """Translates the sequences of one gene block in one batch.
+
+        :return: list of aminoacid sequences, ``?`` for sequences that could
+                 not be translated.
+        """
+        if not sequences:
+            return []
 
-    def translate_this_sequence(self, sequence, this_gene_model, voucher_code):
-        aa_sequence = ''
         if this_gene_model['genetic_code'] is None or this_gene_model['reading_frame'] is None:
             self.warnings.append(
                 "Cannot translate gene %s sequences into aminoacids."
                 " You need to define reading_frame and/or genetic_code." %
                 this_gene_model['gene_code'])
-        else:
-            aa_sequence, warning = utils.translate_to_protein(this_gene_model,
-                                                              sequence, '',
-                                                              voucher_code,
-                                                              self.file_format)
+            return ['?'] * len(sequences)
+
+        aa_sequences = []
+        translated = utils.translate_sequences_to_protein(this_gene_model, sequences,
+                                                          voucher_codes, self.file_format)
+        for aa_sequence, warning in translated:
             if warning != '':
                 self.warnings.append(warning)
-        sequence = aa_sequence
-
-        if sequence == '':
-            sequence = '?'
-        return sequence
-
-    def get_codons_in_each_partition(self, codons):
-        partition_list = ()
-        codon_descriptions = []
-        codon_pos = []
-        for i in codons:
-            partition_list += ([],)
-            if i == '1st':
-                codon_descriptions.append('_1st_codon')
-                codon_pos.append(0)
-            if i == '2nd':
-                codon_descriptions.append('_2nd_codon')
-                codon_pos.append(1)
-            if i == '3rd':
-                codon_descriptions.append('_3rd_codon')
-                codon_pos.append(2)
-        for gene_code in self.seq_objs:
-            this_gene = None
+            if aa_sequence == '':
+                aa_sequence = '?'
+            aa_sequences.append(aa_sequence)
+        return aa_sequences
 
-            for seq_record in self.seq_objs[gene_code]:
-                if self.reading_frames[gene_code] is None:
-                    self.warnings.append("Reading frame for gene %s hasn't been specified so "
-                                         "it cannot be included in your dataset." % gene_code)
-                    continue
-
-                if this_gene is None:
-                    this_gene = seq_record.name
-
-                    for i in range(len(codon_descriptions)):
-                        seq_str = self.get_gene_divisor(this_gene, codon_descriptions[i])
-                        partition_list[i].append(seq_str)
-
-                codons = self.split_sequence_in_codon_positions(this_gene,
-                                                                seq_record.seq)
-                for i in range(len(codon_pos)):
-                    seq_str = self.format_record_id_and_seq_for_dataset(seq_record.id, codons[codon_pos[i]])
-                    partition_list[i].append(seq_str)
-        return partition_list
-
-    def get_gene_divisor(self, this_gene, codon_description=None):
-        if self.file_format == 'FASTA':
-            seq_str = '>' + this_gene
-            if codon_description is not None:
-                seq_str += codon_description
-            seq_str += '\n' + '--------------------'
-
-        if self.file_format == 'GenbankFASTA':
-            seq_str = '\n[%s]' % this_gene
-
-        if self.file_format == 'PHY':
-            seq_str = '\n[%s]' % this_gene
-
-        if self.file_format == 'TNT':
-            seq_str = '\n[%s]' % this_gene
-
-        if self.file_format == 'NEXUS':
-            seq_str = '\n[%s]' % this_gene
-        return seq_str
-
-    def format_record_id_and_seq_for_dataset(self, seq_record_id, seq_record_seq):
-        if self.file_format == 'GenbankFASTA':
-            seq_record_id = seq_record_id.split(' ')
-            code = seq_record_id[0]
-            gene = seq_record_id[1]
-            taxon = seq_record_id[2].replace('_', ' ')
-            gene_description = self.gene_code_descriptions[gene]
-
-            seq_str = '>' + code + '_' + gene + ' ' + '[organism=' + taxon + '] [specimen-voucher=' + code + '] ' + taxon
-            seq_str += ' ' + gene_description + '\n' + str(seq_record_seq)
-        if self.file_format == 'FASTA':
-            seq_str = '>' + seq_record_id + '\n' + str(seq_record_seq)
-        if self.file_format == 'NEXUS' or \
-                self.file_format == 'PHY' or \
-                self.file_format == 'TNT':
-            seq_str = str(seq_record_id).ljust(55) + str(seq_record_seq)
-        return seq_str
-
-    def get_codons_in_one_partition(self, codons):
-        partition_list = ([],)
-        codon_pos = []
-        for i in codons:
-            if i == '1st':
-                codon_pos.append(0)
-            if i == '2nd':
-                codon_pos.append(1)
-            if i == '3rd':
-                codon_pos.append(2)
+    def get_block_sequences(self, block, this_gene_model):
+        """
+        :return: tuple of rows of the block that are not dropped and their
+                 sequences, translated if we want aminoacids.
+        """
+        rows = [row for row in block if row.taxon not in self.vouchers_to_drop]
+        sequences = [row.seq for row in rows]
+        if self.aminoacids is True:
+            sequences = self.translate_sequences(sequences, this_gene_model,
+                                                 [row.taxon for row in rows])
+        return rows, sequences
+
+    def has_reading_frame(self, gene_code):
+        if self.reading_frames[gene_code] is None:
+            self.warnings.append("Reading frame for gene %s hasn't been specified so "
+                                 "it cannot be included in your dataset." % gene_code)
+            return False
+        return True
+
+    def get_alignment(self, plan):
+        """Builds an alignment with one partition for each item of the plan,
+        reading the sequences of each gene only once.
+
+        Genes without reading frame are left out, unless sequences are used
+        as they are.
+
+        :param plan: list of Partition from ``plan_partitions``.
+        :return: Alignment.
+        """
+        alignment = Alignment(len(plan))
+        needs_reading_frame = any(partition.positions is not None for partition in plan)
         for gene_code in self.seq_objs:
-            this_gene = None
-
-            for seq_record in self.seq_objs[gene_code]:
-                if self.reading_frames[gene_code] is None:
-                    self.warnings.append("Reading frame for gene %s hasn't been specified so "
-                                         "it cannot be included in your dataset." % gene_code)
+            if needs_reading_frame and not self.has_reading_frame(gene_code):
+                continue
+
+            gene_block = self.get_gene_block(gene_code)
+            if needs_reading_frame:
+                # Puts the sequences in frame, by skipping base pairs at the
+                # beginning of the sequences if the reading frame is not 1.
+                reading_frame = int(self.reading_frames[gene_code]) - 1
+
+            for index, partition in enumerate(plan):
+                if partition.positions is None:
+                    alignment.add_block(index, gene_block)
                     continue
-
-                if this_gene is None:
-                    this_gene = seq_record.name
-
-                    gene_divisor = self.get_gene_divisor(this_gene)
-                    partition_list[0].append(gene_divisor)
-
-                codons = self.split_sequence_in_codon_positions(this_gene,
-                                                                seq_record.seq)
-
-                codon_seqs = str(utils.chain_and_flatten([codons[i] for i in codon_pos]))
-                seq_str = self.format_record_id_and_seq_for_dataset(seq_record.id, codon_seqs)
-
-                partition_list[0].append(seq_str)
-        self.partition_list = partition_list
-        return partition_list
+                matrix = get_codon_positions(gene_block.matrix, reading_frame,
+                                             list(partition.positions))
+                alignment.add_block(index, GeneBlock(gene_code, gene_block.taxa,
+                                                     gene_block.voucher_codes,
+                                                     matrix, partition.label))
+        return alignment
 
     def from_seq_objs_to_dataset(self):
         """Take a list of BioPython's sequence objects and return a FASTA string
@@ -329,232 +435,11 @@ class Dataset(object):
             another FASTA gene sequence.
 
         """
-        if '1st' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'ALL' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'ALL' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['2nd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['2nd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '2nd' in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'ALL' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st', '2nd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '2nd' in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                'ALL' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_one_partition(['1st', '2nd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '3rd' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '3rd' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '3rd' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_one_partition(['1st', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['2nd', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                'ONE' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_one_partition(['2nd', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['2nd', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if ('ALL' in self.codon_positions or
-                ('1st' in self.codon_positions and '2nd' in self.codon_positions and '3rd' in self.codon_positions)) \
-                and 'EACH' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st', '2nd', '3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if ('ALL' in self.codon_positions or
-                ('1st' in self.codon_positions and '2nd' in self.codon_positions and '3rd' in self.codon_positions)) \
-                and 'ONE' in self.partition_by_positions:
-            self.partition_list = ([],)
-            for gene_code in self.seq_objs:
-                this_gene = None
-                for seq_record in self.seq_objs[gene_code]:
-                    if this_gene is None:
-                        this_gene = seq_record.name
-
-                        seq_str = self.get_gene_divisor(this_gene)
-                        self.partition_list[0].append(seq_str)
-
-                    if self.file_format == 'GenbankFASTA':
-                        seq_str = self.format_record_id_and_seq_for_dataset(seq_record.description + ' ' +
-                                                                            this_gene + ' ' +
-                                                                            seq_record.id.replace(seq_record.description + '_', ''), seq_record.seq)
-                    else:
-                        seq_str = self.format_record_id_and_seq_for_dataset(seq_record.id, seq_record.seq)
-                    self.partition_list[0].append(seq_str)
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if 'ALL' in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = ([], [],)
-
-            for gene_code in self.seq_objs:
-                if self.reading_frames[gene_code] is None:
-                    self.warnings.append("Reading frame for gene %s hasn't been specified so "
-                                         "it cannot be included in your dataset." % gene_code)
-                    continue
-
-                this_gene = None
-                for seq_record in self.seq_objs[gene_code]:
-                    if this_gene is None:
-                        this_gene = seq_record.name
-
-                        seq_str = '>' + this_gene + '_1st_2nd_codons\n' + '--------------------'
-                        self.partition_list[0].append(seq_str)
-
-                        seq_str = '>' + this_gene + '_3rd_codon\n' + '--------------------'
-                        self.partition_list[1].append(seq_str)
-
-                    codons = self.split_sequence_in_codon_positions(this_gene, seq_record.seq)
-
-                    seq_str = '>' + seq_record.id + '\n' + str(utils.chain_and_flatten([codons[0], codons[1]]))
-                    self.partition_list[0].append(seq_str)
-
-                    seq_str = '>' + seq_record.id + '\n' + str(codons[2])
-                    self.partition_list[1].append(seq_str)
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['1st'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '2nd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['2nd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '3rd' in self.codon_positions and \
-                '1st' not in self.codon_positions and \
-                '2nd' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = self.get_codons_in_each_partition(['3rd'])
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '2nd' in self.codon_positions and \
-                '3rd' not in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = ([],)
-            for gene_code in self.seq_objs:
-                this_gene = None
-                for seq_record in self.seq_objs[gene_code]:
-                    if self.reading_frames[gene_code] is None:
-                        self.warnings.append("Reading frame for gene %s hasn't been specified so "
-                                             "it cannot be included in your dataset." % gene_code)
-                        continue
-
-                    if this_gene is None:
-                        this_gene = seq_record.name
-
-                        seq_str = '>' + this_gene + '_1st_2nd_codons\n' + '--------------------'
-                        self.partition_list[0].append(seq_str)
-
-                    codons = self.split_sequence_in_codon_positions(this_gene, seq_record.seq)
-
-                    seq_str = '>' + seq_record.id + '\n' + str(utils.chain_and_flatten([codons[0], codons[1]]))
-                    self.partition_list[0].append(seq_str)
-            return self.convert_lists_to_dataset(self.partition_list)
-
-        if '1st' in self.codon_positions and '2nd' in self.codon_positions and \
-                '3rd' in self.codon_positions and \
-                '1st2nd_3rd' in self.partition_by_positions:
-            self.partition_list = ([], [],)
-            for gene_code in self.seq_objs:
-                this_gene = None
-                for seq_record in self.seq_objs[gene_code]:
-                    if self.reading_frames[gene_code] is None:
-                        self.warnings.append("Reading frame for gene %s hasn't been specified so "
-                                             "it cannot be included in your dataset." % gene_code)
-                        continue
-
-                    if this_gene is None:
-                        this_gene = seq_record.name
-
-                        seq_str = '>' + this_gene + '_1st_2nd_codons\n' + '--------------------'
-                        self.partition_list[0].append(seq_str)
-
-                        seq_str = '>' + this_gene + '_3rd_codon\n' + '--------------------'
-                        self.partition_list[1].append(seq_str)
-
-                    codons = self.split_sequence_in_codon_positions(this_gene, seq_record.seq)
-
-                    seq_str = '>' + seq_record.id + '\n' + str(utils.chain_and_flatten([codons[0], codons[1]]))
-                    self.partition_list[0].append(seq_str)
-
-                    seq_str = '>' + seq_record.id + '\n' + str(codons[2])
-                    self.partition_list[1].append(seq_str)
-            return self.convert_lists_to_dataset(self.partition_list)
+        plan = plan_partitions(self.codon_positions, self.partition_by_positions)
+        if not plan:
+            return None
+        self.alignment = self.get_alignment(plan)
+        return self.convert_alignment_to_dataset(self.alignment)
 
 
 class CreateFasta(Dataset):
@@ -562,54 +447,29 @@ class CreateFasta(Dataset):
 
 
 class CreateGenbankFasta(Dataset):
-    def convert_lists_to_dataset(self, partitions):
+    def convert_alignment_to_dataset(self, alignment):
         """
-        Overriden method from base clase in order to add headers and footers depending
-        on needed dataset.
+        Overriden method from base clase as we write both the nucleotide and
+        aminoacid datasets.
         """
-        self.get_number_of_genes_for_taxa(partitions)
-        self.get_number_chars_from_partition_list(partitions)
+        records = self.iter_dataset(alignment)
+        if self.streaming:
+            try:
+                with open(self.dataset_file, 'w') as handle:
+                    with open(self.aa_dataset_file, 'w') as aa_handle:
+                        for dna, aa in records:
+                            handle.write(dna)
+                            aa_handle.write(aa)
+            except Exception:
+                self.remove_dataset_files()
+                raise
+            return None
 
         out = []
         aa_out = []
-
-        gene_models = Genes.objects.all().values()
-
-        partitions_incorporated = 0
-        for partition in partitions:
-            for i in partition:
-                i = i.strip()
-                if i.startswith('['):
-                    this_gene = i.replace('[', '').replace(']', '').strip()
-                    this_gene_model = self.get_gene_model_from_gene_id(this_gene, gene_models)
-                    partitions_incorporated += 1
-                    out += ['\n']
-                elif i.startswith('>'):
-                    try:
-                        voucher_code = re.search('specimen-voucher=(.+)]', i).groups()[0]
-                    except AttributeError:
-                        continue
-
-                    if voucher_code not in self.vouchers_to_drop:
-                        line = i.split('\n')
-                        if len(line) > 1:
-                            sequence = line[-1]
-
-                            if this_gene_model['genetic_code'] is None or this_gene_model['reading_frame'] is None:
-                                self.warnings.append("Cannot translate gene %s sequences into aminoacids."
-                                                     " You need to define reading_frame and/or genetic_code." % this_gene_model['gene_code'])
-                                continue
-                            else:
-                                aa_sequence, warning = utils.translate_to_protein(this_gene_model, sequence, '', voucher_code, self.file_format)
-                                if warning != '':
-                                    self.warnings.append(warning)
-
-                            if aa_sequence.strip() == '':
-                                self.warnings.append("Sequence for %s %s was empty" % (voucher_code, this_gene))
-
-                            sequence = utils.strip_question_marks(sequence)[0]
-                            out += [line[0] + '\n' + sequence.replace('?', 'N') + '\n']
-                            aa_out += [line[0] + '\n' + aa_sequence + '\n']
+        for dna, aa in records:
+            out.append(dna)
+            aa_out.append(aa)
 
         dataset_str = ''.join(out)
         aa_dataset_str = ''.join(aa_out)
@@ -617,6 +477,50 @@ class CreateGenbankFasta(Dataset):
         self.save_aa_dataset_to_file(aa_dataset_str)
         return dataset_str, aa_dataset_str
 
+    def iter_dataset(self, alignment):
+        """
+        :return: generator of tuples (nucleotide string, aminoacid string).
+        """
+        self.get_number_of_genes_for_taxa(alignment)
+        self.get_number_chars_from_alignment(alignment)
+
+        gene_models = Genes.objects.all().values()
+
+        for partition in alignment:
+            for block in partition:
+                this_gene = block.gene_code
+                this_gene_model = self.get_gene_model_from_gene_id(this_gene, gene_models)
+                gene_description = self.gene_code_descriptions[this_gene]
+                yield '\n', ''
+
+                rows = [row for row in block if row.voucher_code not in self.vouchers_to_drop]
+                if not rows:
+                    continue
+
+                if this_gene_model['genetic_code'] is None or this_gene_model['reading_frame'] is None:
+                    self.warnings.append("Cannot translate gene %s sequences into aminoacids."
+                                         " You need to define reading_frame and/or genetic_code." % this_gene_model['gene_code'])
+                    continue
+
+                translated = utils.translate_sequences_to_protein(this_gene_model,
+                                                                  [row.seq for row in rows],
+                                                                  [row.voucher_code for row in rows],
+                                                                  self.file_format)
+                for row, (aa_sequence, warning) in zip(rows, translated):
+                    voucher_code = row.voucher_code
+                    if warning != '':
+                        self.warnings.append(warning)
+                    if aa_sequence.strip() == '':
+                        self.warnings.append("Sequence for %s %s was empty" % (voucher_code, this_gene))
+
+                    taxon = row.taxon.replace(voucher_code + '_', '').replace('_', ' ')
+                    header = '>' + voucher_code + '_' + this_gene + ' ' + '[organism=' + taxon + '] ' \
+                             '[specimen-voucher=' + voucher_code + '] ' + taxon + ' ' + gene_description
+
+                    sequence = utils.strip_question_marks(row.seq)[0]
+                    yield (header + '\n' + sequence.replace('?', 'N') + '\n',
+                           header + '\n' + aa_sequence + '\n')
+
 
 class CreatePhylip(Dataset):
     def get_charset_block(self, gene_codes_and_lengths):
@@ -633,144 +537,91 @@ class CreatePhylip(Dataset):
             charset_block.append(line)
         self.charset_block = "\n".join(charset_block)
 
-    def convert_lists_to_dataset(self, partitions):
+    def iter_dataset(self, alignment):
         """
         Overriden method from base clase in order to add headers and footers depending
         on needed dataset.
         """
-        self.get_number_of_genes_for_taxa(partitions)
-        self.get_number_chars_from_partition_list(partitions)
-        out = []
-
-        gene_models = Genes.objects.all().values()
+        self.get_number_of_genes_for_taxa(alignment)
+        self.get_number_chars_from_alignment(alignment)
 
         gene_codes_and_lengths = dict()
-
-        partitions_incorporated = 0
-        for partition in partitions:
-            for i in partition:
-                voucher_code = i.split(' ')[0]
-                if voucher_code.startswith('\n'):
-                    ThisGeneAndPartition = self.get_gene_for_current_partition(
-                        gene_models, out, partitions_incorporated, voucher_code
-                    )
-                    partitions_incorporated = ThisGeneAndPartition.partitions_incorporated
-                    out = ThisGeneAndPartition.out
-                elif voucher_code not in self.vouchers_to_drop:
-                    line = i.split(' ')
-                    if len(line) > 1:
-                        sequence = line[-1]
-
-                        if self.aminoacids is True:
-                            sequence = self.translate_this_sequence(
-                                sequence,
-                                ThisGeneAndPartition.this_gene_model,
-                                voucher_code
-                            )
-
-                        gene_codes_and_lengths[ThisGeneAndPartition.this_gene] = len(sequence)
-
-                        if partitions_incorporated == 1:
-                            out += [line[0].ljust(55, ' ') + sequence + '\n']
-                        else:
-                            out += [' ' * 55 + sequence + '\n']
+        # The header needs the number of characters, which we only know
+        # after going through the whole matrix.
+        body = self.spool(self.iter_matrix(alignment, gene_codes_and_lengths))
 
         number_chars = 0
         for k in gene_codes_and_lengths.keys():
             number_chars += gene_codes_and_lengths[k]
 
-        header = [
-            str(self.number_taxa - len(self.vouchers_to_drop)) + ' ' + str(number_chars),
-        ]
+        self.get_charset_block(gene_codes_and_lengths)
+        yield str(self.number_taxa - len(self.vouchers_to_drop)) + ' ' + str(number_chars)
+        yield from self.iter_spooled(body)
 
-        out = header + out
+    def iter_matrix(self, alignment, gene_codes_and_lengths):
+        gene_models = Genes.objects.all().values()
 
-        self.get_charset_block(gene_codes_and_lengths)
-        dataset_str = ''.join(out)
-        self.save_dataset_to_file(dataset_str)
-        return dataset_str
+        partitions_incorporated = 0
+        for partition in alignment:
+            for block in partition:
+                this_gene_model = self.get_gene_model_from_gene_id(block.gene_code, gene_models)
+                partitions_incorporated += 1
+                yield '\n'
+
+                rows, sequences = self.get_block_sequences(block, this_gene_model)
+                for row, sequence in zip(rows, sequences):
+                    gene_codes_and_lengths[block.gene_code] = len(sequence)
+
+                    if partitions_incorporated == 1:
+                        yield row.taxon.ljust(55, ' ') + sequence + '\n'
+                    else:
+                        yield ' ' * 55 + sequence + '\n'
 
 
 class CreateTNT(Dataset):
-    def convert_lists_to_dataset(self, partitions):
+    def iter_dataset(self, alignment):
         """
         Overriden method from base clase in order to add headers and footers depending
         on needed dataset.
         """
-        self.get_number_of_genes_for_taxa(partitions)
-        self.get_number_chars_from_partition_list(partitions)
+        self.get_number_of_genes_for_taxa(alignment)
+        self.get_number_chars_from_alignment(alignment)
 
-        gene_models = Genes.objects.all().values()
         gene_codes_and_lengths = collections.OrderedDict()
-
-        out = []
-
-        outgroup_sequences = []
-        for partition in partitions:
-            for i in partition:
-                voucher = i.split(' ')[0]
-                if voucher not in self.vouchers_to_drop:
-                    if self.outgroup in voucher:
-                        outgroup_sequences.append(i)
-                        continue
-
-        partitions_incorporated = 0
-        partition_count = 0
-        for partition in partitions:
-            for i in partition:
-                voucher_code = i.split(' ')[0]
-                if voucher_code.startswith('\n'):
-                    ThisGeneAndPartition = self.get_gene_for_current_partition(
-                        gene_models, out, partitions_incorporated, voucher_code
-                    )
-                    out += ['\n[&dna]']
-                    if self.outgroup != '':
-                        line = outgroup_sequences[partition_count]
-                        tmp_line = line.split(' ')
-                        sequence = tmp_line[-1]
-
-                        if self.aminoacids is True:
-                            sequence = self.translate_this_sequence(
-                                sequence,
-                                ThisGeneAndPartition.this_gene_model,
-                                voucher_code
-                            )
-                            out += [tmp_line[0].ljust(55, ' ') + sequence]
-                        else:
-                            out += [outgroup_sequences[partition_count]]
-                        partition_count += 1
-                elif voucher_code not in self.vouchers_to_drop:
-                    line = i.split(' ')
-                    if len(line) > 1:
-                        sequence = line[-1]
-
-                        if self.aminoacids is True:
-                            sequence = self.translate_this_sequence(
-                                sequence,
-                                ThisGeneAndPartition.this_gene_model,
-                                voucher_code
-                            )
-
-                    gene_codes_and_lengths[ThisGeneAndPartition.this_gene] = len(sequence)
-
-                    if self.outgroup != '' and self.outgroup not in voucher_code:
-                        out += [line[0].ljust(55, ' ') + sequence]
-                    elif self.outgroup == '':
-                        out += [line[0].ljust(55, ' ') + sequence]
-
-        out += ['\n;\nproc/;']
+        body = self.spool(
+            '\n' + line for line in self.iter_matrix(alignment, gene_codes_and_lengths)
+        )
 
         number_chars = 0
         for k in gene_codes_and_lengths.keys():
             number_chars += gene_codes_and_lengths[k]
 
-        header = ['nstates dna;\nxread']
-        header += [str(number_chars) + ' ' + str(self.number_taxa - len(self.vouchers_to_drop))]
+        yield 'nstates dna;\nxread'
+        yield '\n' + str(number_chars) + ' ' + str(self.number_taxa - len(self.vouchers_to_drop))
+        yield from self.iter_spooled(body)
+        yield '\n' + '\n;\nproc/;'
 
-        out = header + out
-        dataset_str = '\n'.join(out)
-        self.save_dataset_to_file(dataset_str)
-        return dataset_str
+    def iter_matrix(self, alignment, gene_codes_and_lengths):
+        """The outgroup, if any, goes first in each gene block."""
+        gene_models = Genes.objects.all().values()
+
+        for partition in alignment:
+            for block in partition:
+                this_gene_model = self.get_gene_model_from_gene_id(block.gene_code, gene_models)
+                yield '\n[&dna]'
+
+                rows, sequences = self.get_block_sequences(block, this_gene_model)
+                if self.outgroup != '':
+                    for row, sequence in zip(rows, sequences):
+                        if self.outgroup in row.taxon:
+                            yield row.taxon.ljust(55, ' ') + sequence
+                            break
+
+                for row, sequence in zip(rows, sequences):
+                    gene_codes_and_lengths[block.gene_code] = len(sequence)
+
+                    if self.outgroup == '' or self.outgroup not in row.taxon:
+                        yield row.taxon.ljust(55, ' ') + sequence
 
 
 class CreateNEXUS(Dataset):
@@ -810,44 +661,18 @@ END;
 """
         return [block.strip()]
 
-    def convert_lists_to_dataset(self, partitions):
+    def iter_dataset(self, alignment):
         """
         Overriden method from base clase in order to add headers and footers depending
         on needed dataset.
         """
-        self.get_number_of_genes_for_taxa(partitions)
-        self.get_number_chars_from_partition_list(partitions)
+        self.get_number_of_genes_for_taxa(alignment)
+        self.get_number_chars_from_alignment(alignment)
 
-        gene_models = Genes.objects.all().values()
         gene_codes_and_lengths = collections.OrderedDict()
-
-        partitions_incorporated = 0
-
-        out = []
-
-        for partition in partitions:
-            for i in partition:
-                voucher_code = i.split(' ')[0]
-                if voucher_code.startswith('\n'):
-                    ThisGeneAndPartition = self.get_gene_for_current_partition(
-                        gene_models, out, partitions_incorporated, voucher_code
-                    )
-                    out = ThisGeneAndPartition.out
-                elif voucher_code not in self.vouchers_to_drop:
-                    line = i.split(' ')
-                    if len(line) > 1:
-                        sequence = line[-1]
-
-                        if self.aminoacids is True:
-                            sequence = self.translate_this_sequence(
-                                sequence,
-                                ThisGeneAndPartition.this_gene_model,
-                                voucher_code
-                            )
-
-                    gene_codes_and_lengths[ThisGeneAndPartition.this_gene] = len(sequence)
-
-                    out += [line[0].ljust(55, ' ') + sequence]
+        body = self.spool(
+            '\n' + line for line in self.iter_matrix(alignment, gene_codes_and_lengths)
+        )
 
         number_chars = 0
         for k in gene_codes_and_lengths.keys():
@@ -864,13 +689,26 @@ END;
         if self.aminoacids is True:
             self.gene_codes_and_lengths = gene_codes_and_lengths
 
-        out = header + out
+        yield '\n'.join(header)
+        yield from self.iter_spooled(body)
 
-        out += [';\nEND;']
-        out += ['\nbegin mrbayes;']
-        out += self.get_charset_block()
-        out += self.get_partitions_block()
-        out += self.get_final_block()
-        dataset_str = '\n'.join(out)
-        self.save_dataset_to_file(dataset_str)
-        return dataset_str
+        footer = [';\nEND;']
+        footer += ['\nbegin mrbayes;']
+        footer += self.get_charset_block()
+        footer += self.get_partitions_block()
+        footer += self.get_final_block()
+        yield '\n' + '\n'.join(footer)
+
+    def iter_matrix(self, alignment, gene_codes_and_lengths):
+        gene_models = Genes.objects.all().values()
+
+        for partition in alignment:
+            for block in partition:
+                this_gene_model = self.get_gene_model_from_gene_id(block.gene_code, gene_models)
+                yield '\n[' + block.gene_code + ']'
+
+                rows, sequences = self.get_block_sequences(block, this_gene_model)
+                for row, sequence in zip(rows, sequences):
+                    gene_codes_and_lengths[block.gene_code] = len(sequence)
+
+                    yield row.taxon.ljust(55, ' ') + sequence
@@ -0,0 +1,316 @@
+"""
+Queue of dataset jobs, a ``core.jobs.JobQueue``.
+
+Views submit the form data of a dataset as a ``DatasetJob`` and worker
+processes started with ``python manage.py run_dataset_jobs`` create the
+datasets, so big datasets do not tie up web server workers. If
+``settings.DATASET_JOBS_ALWAYS_EAGER`` is True, jobs are run as soon as they
+are submitted, inside the request.
+
+Finished jobs are a cache of datasets. They are found by a hash of the
+dataset options and a stamp of the data in the database, so a dataset is
+only built again after sequences, genes or vouchers change. The cache is
+limited to ``settings.DATASET_CACHE_MAX_SIZE`` bytes of dataset files and the
+least recently used datasets are removed first. Datasets used in the last
+``settings.DATASET_CACHE_GRACE_PERIOD`` seconds are kept, as they may still
+be downloading.
+
+Jobs running for longer than ``settings.DATASET_JOBS_RUNNING_TIMEOUT``
+seconds are taken as abandoned by a worker that was stopped or crashed. They
+are marked as failed, so identical submissions queue a new job.
+"""
+import hashlib
+import json
+import logging
+import os
+import traceback
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models import Q
+from django.utils import timezone
+
+from core.jobs import JobQueue
+from core.jobs import get_date_before
+from core.utils import get_gene_codes
+from core.utils import get_voucher_codes
+from public_interface.models import Genes
+from public_interface.models import GeneSets
+from public_interface.models import Sequences
+from public_interface.models import TaxonSets
+from public_interface.models import Vouchers
+from .models import DatasetJob
+from .utils import CreateDataset
+from .utils import iter_file
+from .utils import iter_file_and_remove
+from .utils import read_file_head
+
+
+log = logging.getLogger(__name__)
+
+# Form fields holding model instances, stored as primary keys.
+MODEL_FIELDS = {
+    'taxonset': TaxonSets,
+    'geneset': GeneSets,
+}
+MULTIPLE_MODEL_FIELDS = {
+    'gene_codes': Genes,
+}
+
+
+def serialize_cleaned_data(cleaned_data):
+    """
+    :return: dict with the form data that can be dumped as JSON.
+    """
+    data = dict()
+    for field, value in cleaned_data.items():
+        if field in MODEL_FIELDS:
+            value = value.pk if value is not None else None
+        elif field in MULTIPLE_MODEL_FIELDS:
+            value = sorted(i.pk for i in value)
+        data[field] = value
+    return data
+
+
+def deserialize_cleaned_data(data):
+    """
+    :return: form data as ``CreateDataset`` takes it.
+    """
+    cleaned_data = dict(data)
+    for field, model in MODEL_FIELDS.items():
+        if cleaned_data.get(field) is not None:
+            cleaned_data[field] = model.objects.get(pk=cleaned_data[field])
+    for field, model in MULTIPLE_MODEL_FIELDS.items():
+        if field in cleaned_data:
+            cleaned_data[field] = list(model.objects.filter(pk__in=cleaned_data[field]).order_by('pk'))
+    return cleaned_data
+
+
+def get_job_key(cleaned_data):
+    """Hash of the dataset options.
+
+    Taxonsets and genesets are replaced by the voucher and gene codes in
+    them, so the key changes if they are edited, and lists whose order does
+    not matter are sorted.
+    """
+    data = serialize_cleaned_data(cleaned_data)
+    for field in ['taxonset', 'geneset', 'gene_codes']:
+        data.pop(field, None)
+    codes = dict(cleaned_data, voucher_codes=cleaned_data.get('voucher_codes') or '')
+    data['voucher_codes'] = get_voucher_codes(codes)
+    data['gene_codes'] = get_gene_codes(codes)
+    for field in ['positions', 'taxon_names']:
+        if isinstance(data.get(field), list):
+            data[field] = sorted(data[field])
+
+    dumped = json.dumps(data, sort_keys=True)
+    return hashlib.sha1(dumped.encode('utf-8')).hexdigest()
+
+
+def get_data_version():
+    """Stamp that changes when sequences, genes or vouchers are added, edited
+    or deleted.
+    """
+    stamp = []
+    for model, field in [(Sequences, 'time_edited'), (Genes, 'time_edited'), (Vouchers, 'timestamp')]:
+        last_edited = model.objects.aggregate(last_edited=Max(field))['last_edited']
+        stamp.append([model.objects.count(), str(last_edited)])
+
+    dumped = json.dumps(stamp)
+    return hashlib.sha1(dumped.encode('utf-8')).hexdigest()
+
+
+def get_grace_date():
+    return get_date_before(settings.DATASET_CACHE_GRACE_PERIOD)
+
+
+def get_job_files(job):
+    return [i for i in [job.dataset_file, job.aa_dataset_file] if i]
+
+
+def is_reusable(job):
+    """Finished jobs can be reused while their dataset files are there, and
+    running ones until they are abandoned.
+    """
+    if job.status == DatasetJob.PENDING:
+        return True
+    if job.status == DatasetJob.RUNNING:
+        return job.time_started is not None and job.time_started >= queue.get_running_timeout_date()
+    if job.status == DatasetJob.FINISHED and job.time_used and job.time_used >= queue.get_expiry_date():
+        return all(os.path.isfile(i) for i in get_job_files(job))
+    return False
+
+
+def mark_used(job):
+    job.time_used = timezone.now()
+    DatasetJob.objects.filter(pk=job.pk).update(time_used=job.time_used)
+
+
+def submit_job(cleaned_data):
+    """Queues a dataset, unless an identical one is queued or ready.
+
+    :param cleaned_data: form data as ``CreateDataset`` takes it.
+    :return: DatasetJob.
+    """
+    data = serialize_cleaned_data(cleaned_data)
+    key = get_job_key(cleaned_data)
+    data_version = get_data_version()
+    queue.fail_abandoned_jobs()
+    remove_stale_jobs(data_version)
+
+    for job in DatasetJob.objects.filter(key=key, data_version=data_version).order_by('-time_created'):
+        if is_reusable(job):
+            if job.status == DatasetJob.FINISHED:
+                mark_used(job)
+            return job
+
+    return queue.create_job(
+        key=key,
+        data_version=data_version,
+        cleaned_data=json.dumps(data),
+        file_format=data['file_format'],
+    )
+
+
+def remove_job(job):
+    """Deletes a finished or failed job with its dataset files."""
+    for filename in get_job_files(job):
+        if os.path.isfile(filename):
+            os.remove(filename)
+    job.delete()
+
+
+def evict_datasets():
+    """Removes the least recently used datasets until the cache fits in
+    ``settings.DATASET_CACHE_MAX_SIZE`` bytes. The most recently used dataset
+    and those used within the grace period are always kept.
+    """
+    total_size = 0
+    grace_date = get_grace_date()
+    finished = DatasetJob.objects.filter(status=DatasetJob.FINISHED).order_by('-time_used', '-pk')
+    for index, job in enumerate(finished):
+        total_size += job.size
+        if index > 0 and total_size > settings.DATASET_CACHE_MAX_SIZE and \
+                (job.time_used is None or job.time_used < grace_date):
+            remove_job(job)
+
+
+def remove_stale_jobs(data_version):
+    """Deletes finished and failed jobs built from data that has changed,
+    once they are not used within the grace period.
+    """
+    stale = DatasetJob.objects.filter(
+        status__in=[DatasetJob.FINISHED, DatasetJob.FAILED],
+    ).exclude(data_version=data_version).exclude(time_used__gte=get_grace_date())
+    for job in stale:
+        remove_job(job)
+
+
+def remove_expired_jobs():
+    """Deletes finished and failed jobs not used in the last
+    ``settings.DATASET_JOBS_EXPIRY`` seconds, with their dataset files.
+    """
+    expired = DatasetJob.objects.filter(
+        status__in=[DatasetJob.FINISHED, DatasetJob.FAILED],
+        time_used__lt=queue.get_expiry_date(),
+    )
+    for job in expired:
+        remove_job(job)
+
+
+def get_job_for_file(file_name):
+    """
+    :return: finished DatasetJob that created the dataset file, or None.
+    """
+    file_name = os.sep + file_name
+    jobs = DatasetJob.objects.filter(status=DatasetJob.FINISHED).filter(
+        Q(dataset_file__endswith=file_name) | Q(aa_dataset_file__endswith=file_name)
+    )
+    for job in jobs:
+        return job
+    return None
+
+
+def iter_dataset_file(filename):
+    """Yields the content of a dataset file to be downloaded. Files of cached
+    datasets are kept, other files are deleted once they have been served.
+    """
+    job = get_job_for_file(os.path.basename(filename))
+    if job is None:
+        return iter_file_and_remove(filename)
+    mark_used(job)
+    return iter_file(filename)
+
+
+def get_job_preview(job, size=1500):
+    """Reads the first characters of the dataset files of a finished job.
+
+    :return: tuple with the nucleotide and aminoacid previews. The aminoacid
+             preview is empty for formats other than GenbankFASTA.
+    """
+    preview = read_file_head(job.dataset_file or None, size)
+    if job.file_format == 'GenbankFASTA':
+        return preview, read_file_head(job.aa_dataset_file or None, size)
+    return preview, ''
+
+
+class DatasetJobQueue(JobQueue):
+    model = DatasetJob
+    name = 'dataset'
+    settings_prefix = 'DATASET_JOBS'
+    error_message = 'Could not create dataset: %s'
+
+    def get_failed_fields(self, error):
+        fields = super(DatasetJobQueue, self).get_failed_fields(error)
+        fields['time_used'] = fields['time_finished']
+        return fields
+
+    def run_job(self, job):
+        """Creates the dataset of a claimed job and saves the results."""
+        def update_progress(genes_done, genes_total):
+            DatasetJob.objects.filter(pk=job.pk).update(genes_done=genes_done,
+                                                        genes_total=genes_total)
+
+        try:
+            cleaned_data = deserialize_cleaned_data(json.loads(job.cleaned_data))
+            dataset_creator = CreateDataset(cleaned_data, streaming=True,
+                                            progress_callback=update_progress)
+        except Exception as e:
+            log.error("Dataset job %s failed:\n%s", job.job_id, traceback.format_exc())
+            job.status = DatasetJob.FAILED
+            job.errors = json.dumps([self.error_message % e])
+        else:
+            job.status = DatasetJob.FINISHED
+            job.dataset_file = dataset_creator.dataset_file or ''
+            job.aa_dataset_file = dataset_creator.aa_dataset_file or ''
+            job.charset_block = dataset_creator.charset_block or ''
+            job.warnings = json.dumps(dataset_creator.warnings)
+            job.errors = json.dumps(dataset_creator.errors)
+
+        job.genes_done, job.genes_total = DatasetJob.objects.values_list(
+            'genes_done', 'genes_total').get(pk=job.pk)
+        job.size = sum(os.path.getsize(i) for i in get_job_files(job) if os.path.isfile(i))
+        job.time_finished = timezone.now()
+        job.time_used = job.time_finished
+        job.save()
+
+        if job.status == DatasetJob.FINISHED:
+            evict_datasets()
+        return job
+
+    def remove_old_jobs(self):
+        remove_stale_jobs(get_data_version())
+        remove_expired_jobs()
+
+    def get_job_status(self, job):
+        status = super(DatasetJobQueue, self).get_job_status(job)
+        status['genes_done'] = job.genes_done
+        status['genes_total'] = job.genes_total
+        if job.status == DatasetJob.FINISHED:
+            status['dataset_file'] = os.path.basename(job.dataset_file)
+            if job.file_format == 'GenbankFASTA':
+                status['aa_dataset_file'] = os.path.basename(job.aa_dataset_file)
+        return status
+
+
+queue = DatasetJobQueue()
@@ -0,0 +1,89 @@
+import random
+import time
+from optparse import make_option
+
+from Bio.Seq import Seq
+from django.core.management.base import BaseCommand
+
+from core.utils import chain_and_flatten
+from create_dataset.alignment import get_codon_positions
+from create_dataset.alignment import row_to_str
+from create_dataset.alignment import to_matrix
+
+
+def split_records(seqs, reading_frame):
+    """Previous way of splitting codon positions: slicing every BioPython
+    Seq and interleaving 1st and 2nd positions one base at a time.
+    """
+    first_second = []
+    third = []
+    for seq in seqs:
+        seq = Seq(seq)[reading_frame:]
+        codons = seq[0::3], seq[1::3], seq[2::3]
+        first_second.append(str(chain_and_flatten([codons[0], codons[1]])))
+        third.append(str(codons[2]))
+    return first_second, third
+
+
+def split_matrix(seqs, reading_frame):
+    matrix = to_matrix(seqs)
+    first_second = get_codon_positions(matrix, reading_frame, [0, 1])
+    third = get_codon_positions(matrix, reading_frame, [2])
+    return [row_to_str(row) for row in first_second], [row_to_str(row) for row in third]
+
+
+class Command(BaseCommand):
+    help = 'Compares the speed of splitting sequences in 1st+2nd and 3rd codon ' \
+           'positions, as done for "1st2nd_3rd" partitions, using BioPython Seq ' \
+           'objects and using arrays. Uses random sequences.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--taxa',
+                    dest='taxa',
+                    type='int',
+                    default=1000,
+                    help='Number of taxa in the dataset.',
+                    ),
+        make_option('--genes',
+                    dest='genes',
+                    type='int',
+                    default=20,
+                    help='Number of genes in the dataset.',
+                    ),
+        make_option('--length',
+                    dest='length',
+                    type='int',
+                    default=1500,
+                    help='Number of base pairs of each gene.',
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        number_taxa = options['taxa']
+        number_genes = options['genes']
+        length = options['length']
+
+        random.seed(1)
+        genes = []
+        for i in range(number_genes):
+            seqs = [''.join(random.choice('ACGT?-') for j in range(length))
+                    for k in range(number_taxa)]
+            genes.append((seqs, i % 3))
+
+        self.stdout.write('Splitting %i genes for %i taxa, %i bp each' %
+                          (number_genes, number_taxa, length))
+
+        timings = []
+        results = []
+        for split in [split_records, split_matrix]:
+            start = time.time()
+            results.append([split(seqs, reading_frame) for seqs, reading_frame in genes])
+            timings.append(time.time() - start)
+
+        if results[0] != results[1]:
+            self.stderr.write('Results differ between both methods.')
+
+        self.stdout.write('BioPython Seq: %.3f s' % timings[0])
+        self.stdout.write('Arrays:        %.3f s' % timings[1])
+        if timings[1] > 0:
+            self.stdout.write('Speedup:       %.1fx' % (timings[0] / timings[1]))
@@ -0,0 +1,7 @@
+from core.jobs import WorkerCommand
+from create_dataset.jobs import queue
+
+
+class Command(WorkerCommand):
+    help = 'Starts worker processes that create the datasets queued by users.'
+    queue = queue
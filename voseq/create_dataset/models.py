@@ -0,0 +1,38 @@
+import json
+
+from django.db import models
+
+from core.models import Job
+
+
+class DatasetJob(Job):
+    """Dataset built by the worker processes of ``run_dataset_jobs`` instead
+    of inside the request.
+
+    Identical submissions have the same ``key``, a hash of the dataset
+    options, so they share one job.
+    Finished jobs are kept as a cache of datasets while the data they were
+    built from, identified by ``data_version``, does not change.
+    """
+    data_version = models.CharField(
+        max_length=40,
+        blank=True,
+        help_text='Stamp of the sequences, genes and vouchers in the database.',
+    )
+    cleaned_data = models.TextField(help_text='Submitted form data as JSON.')
+    file_format = models.CharField(max_length=20)
+    genes_done = models.IntegerField(default=0)
+    genes_total = models.IntegerField(default=0)
+    dataset_file = models.CharField(max_length=255, blank=True)
+    aa_dataset_file = models.CharField(max_length=255, blank=True)
+    charset_block = models.TextField(blank=True)
+    warnings = models.TextField(blank=True, help_text='List of warnings as JSON.')
+    size = models.BigIntegerField(default=0, help_text='Size of the dataset files in bytes.')
+    time_used = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text='Last time the dataset was shown or downloaded.',
+    )
+
+    def get_warnings(self):
+        return json.loads(self.warnings or '[]')
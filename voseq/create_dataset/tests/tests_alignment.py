@@ -0,0 +1,71 @@
+from Bio.Seq import Seq
+from django.test import TestCase
+
+from core.utils import chain_and_flatten
+from create_dataset.alignment import Alignment
+from create_dataset.alignment import GeneBlock
+from create_dataset.alignment import get_codon_positions
+from create_dataset.alignment import get_exon_mask
+from create_dataset.alignment import parse_introns
+from create_dataset.alignment import to_matrix
+
+
+class AlignmentTest(TestCase):
+    def setUp(self):
+        taxa = ['CP100-10_Melitaea', 'CP100-11_Melitaea']
+        voucher_codes = ['CP100-10', 'CP100-11']
+        self.alignment = Alignment(2)
+        self.alignment.add_block(0, GeneBlock.from_sequences('COI', taxa, voucher_codes,
+                                                             ['ACGTAC', '??????'], '_1st_2nd_codons'))
+        self.alignment.add_block(0, GeneBlock.from_sequences('EF1a', taxa, voucher_codes,
+                                                             ['ACG?', 'AC??'], '_1st_2nd_codons'))
+        self.alignment.add_block(1, GeneBlock.from_sequences('COI', taxa[:1], voucher_codes[:1],
+                                                             ['ACG'], '_3rd_codon'))
+        self.seqs = ['ACGTTGCAATGC', 'ACGTTGCAA', 'ACGTTGCAATG', 'A']
+
+    def test_partitions(self):
+        self.assertEqual(2, len(self.alignment))
+        self.assertEqual(['COI', 'EF1a'], [block.gene_code for block in self.alignment[0]])
+        self.assertEqual(['CP100-10', 'CP100-11'], [row.voucher_code for row in self.alignment[0][0]])
+        self.assertEqual(['ACGTAC', '??????'], [row.seq for row in self.alignment[0][0]])
+
+    def test_get_gene_lengths(self):
+        result = self.alignment.get_gene_lengths()
+        self.assertEqual([('COI', 6), ('EF1a', 4)], list(result.items()))
+
+    def test_count_genes_per_taxon(self):
+        expected = {'CP100-10_Melitaea': 2, 'CP100-11_Melitaea': 1}
+        result = self.alignment.count_genes_per_taxon()
+        self.assertEqual(expected, result)
+
+    def test_ragged_sequences_are_kept(self):
+        block = GeneBlock('COI', ['a', 'b', 'c', 'd'], ['a', 'b', 'c', 'd'], to_matrix(self.seqs))
+        self.assertEqual(self.seqs, [row.seq for row in block])
+
+    def test_get_codon_positions(self):
+        matrix = to_matrix(self.seqs)
+        for reading_frame in range(3):
+            for positions in [[0], [1], [2], [0, 1], [0, 2], [1, 2]]:
+                block = GeneBlock('COI', ['a', 'b', 'c', 'd'], ['a', 'b', 'c', 'd'],
+                                  get_codon_positions(matrix, reading_frame, positions))
+                expected = []
+                for seq in self.seqs:
+                    codons = [Seq(seq[reading_frame:])[i::3] for i in positions]
+                    if len(codons) == 1:
+                        expected.append(str(codons[0]))
+                    else:
+                        expected.append(str(chain_and_flatten(codons)))
+                self.assertEqual(expected, [row.seq for row in block])
+
+    def test_parse_introns(self):
+        self.assertEqual([(100, 103), (124, 127), (130, 131)], parse_introns('101-103;125-127; 131'))
+        self.assertEqual([], parse_introns(''))
+        self.assertRaises(ValueError, parse_introns, '103-101')
+        self.assertRaises(ValueError, parse_introns, 'intron 1')
+
+    def test_get_exon_mask(self):
+        matrix = to_matrix(['ACGTTGCAATGC', 'ACGTTGCAA'])
+        exon_mask = get_exon_mask('2-3;7-9', matrix.shape[1])
+        block = GeneBlock('COI', ['a', 'b'], ['a', 'b'], matrix[:, exon_mask])
+        self.assertEqual(['ATTGTGC', 'ATTG'], [row.seq for row in block])
+        self.assertIs(exon_mask, get_exon_mask('2-3;7-9', matrix.shape[1]))
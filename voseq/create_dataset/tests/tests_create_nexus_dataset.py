@@ -253,6 +253,20 @@ DIMENSIONS NTAX=2 NCHAR=899;
         expected = "charset 16S = 1-1"
         self.assertTrue(expected in result)
 
+    def test_charset_block_without_introns(self):
+        cleaned_data = self.cleaned_data
+        cleaned_data['gene_codes'] = [Genes.objects.get(gene_code='COI'),
+                                      Genes.objects.get(gene_code='wingless')]
+        cleaned_data['introns'] = 'NO'
+        result = CreateDataset(cleaned_data).dataset_str
+        self.assertTrue('charset wingless = 1048-1459;' in result)
+
+        # wingless has four introns of 3 bp.
+        cleaned_data['introns'] = 'YES'
+        result = CreateDataset(cleaned_data).dataset_str
+        self.assertTrue('NCHAR=1447;' in result)
+        self.assertTrue('charset wingless = 1048-1447;' in result)
+
     def test_order_of_vouchers_is_kept_along_partitions(self):
         cleaned_data = self.cleaned_data
         cleaned_data['voucher_codes'] = 'CP100-09\r\nCP100-10\r\nCP100-11\r\nCP100-12\r\nCP100-13'
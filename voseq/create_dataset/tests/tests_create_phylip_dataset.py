@@ -83,7 +83,7 @@ class CreatePhylipDatasetTest(TestCase):
                             'geneset': '',
                             'taxonset': '',
                             'translations': False,
-                            'introns': 'YES',
+                            'introns': 'NO',
                             'file_format': 'PHY',
                             'degen_translations': 'NORMAL',
                             'exclude': 'YES',
@@ -97,3 +97,13 @@ class CreatePhylipDatasetTest(TestCase):
                         )
         expected = '1 137'
         self.assertTrue(expected in str(c.content))
+
+    def test_charset_block_without_introns(self):
+        cleaned_data = self.cleaned_data
+        cleaned_data['gene_codes'] = [Genes.objects.get(gene_code='wingless')]
+        cleaned_data['voucher_codes'] = 'CP100-10'
+        cleaned_data['aminoacids'] = False
+        cleaned_data['introns'] = 'YES'
+        dataset_creator = CreateDataset(cleaned_data)
+        self.assertTrue(dataset_creator.dataset_str.startswith('1 400\n'))
+        self.assertEqual('DNA, wingless = 1-400', dataset_creator.charset_block)
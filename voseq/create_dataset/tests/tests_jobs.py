@@ -0,0 +1,212 @@
+import datetime
+import json
+import os
+from unittest import mock
+
+from django.test import TestCase
+from django.test import override_settings
+from django.test.client import Client
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from create_dataset import dataset
+from create_dataset.jobs import deserialize_cleaned_data
+from create_dataset.jobs import get_job_key
+from create_dataset.jobs import queue
+from create_dataset.jobs import serialize_cleaned_data
+from create_dataset.jobs import submit_job
+from create_dataset.models import DatasetJob
+from create_dataset.utils import CreateDataset
+from public_interface.models import Genes
+from public_interface.models import Sequences
+from public_interface.models import TaxonSets
+
+
+@override_settings(DATASET_JOBS_ALWAYS_EAGER=False)
+class DatasetJobsTest(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        g1 = Genes.objects.get(gene_code='COI')
+        g2 = Genes.objects.get(gene_code='EF1a')
+        self.cleaned_data = {
+            'gene_codes': [g1, g2],
+            'taxonset': None,
+            'voucher_codes': 'CP100-10\r\nCP100-11',
+            'geneset': None,
+            'taxon_names': ['CODE', 'GENUS', 'SPECIES'],
+            'positions': ['ALL'],
+            'partition_by_positions': 'ONE',
+            'number_genes': None,
+            'file_format': 'PHY',
+            'aminoacids': False,
+            'outgroup': '',
+        }
+
+        self.c = Client()
+        self.user = User.objects.get(username='admin')
+        self.user.set_password('pass')
+        self.user.save()
+
+    def test_serialize_cleaned_data(self):
+        self.cleaned_data['taxonset'] = TaxonSets.objects.get(pk=1)
+        data = json.loads(json.dumps(serialize_cleaned_data(self.cleaned_data)))
+        result = deserialize_cleaned_data(data)
+        self.assertEqual({'COI', 'EF1a'}, set(i.gene_code for i in result.pop('gene_codes')))
+        self.cleaned_data.pop('gene_codes')
+        self.assertEqual(self.cleaned_data, result)
+
+    def test_identical_submissions_share_job(self):
+        job = submit_job(self.cleaned_data)
+        self.assertEqual(DatasetJob.PENDING, job.status)
+        self.assertEqual(job.job_id, submit_job(dict(self.cleaned_data)).job_id)
+
+        self.cleaned_data['file_format'] = 'NEXUS'
+        self.assertNotEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+
+    def test_run_worker(self):
+        dataset_creator = CreateDataset(self.cleaned_data)
+        job = submit_job(self.cleaned_data)
+
+        queue.run_worker(exit_when_idle=True)
+        job = DatasetJob.objects.get(pk=job.pk)
+        self.assertEqual(DatasetJob.FINISHED, job.status)
+        self.assertEqual((2, 2), (job.genes_done, job.genes_total))
+        self.assertEqual(dataset_creator.charset_block, job.charset_block)
+        with open(job.dataset_file) as handle:
+            self.assertEqual(dataset_creator.dataset_str, handle.read())
+        self.assertIsNone(queue.claim_next_job())
+
+        # The dataset is ready for identical submissions while its file exists.
+        self.assertEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+        os.remove(job.dataset_file)
+        self.assertNotEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+
+    def test_abandoned_running_job(self):
+        job = submit_job(self.cleaned_data)
+        self.assertEqual(job.pk, queue.claim_next_job().pk)
+        self.assertEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+
+        DatasetJob.objects.filter(pk=job.pk).update(
+            time_started=timezone.now() - datetime.timedelta(days=1))
+        new_job = submit_job(self.cleaned_data)
+        self.assertNotEqual(job.job_id, new_job.job_id)
+        job = DatasetJob.objects.get(pk=job.pk)
+        self.assertEqual(DatasetJob.FAILED, job.status)
+        self.assertTrue(job.get_errors()[0].startswith('Could not create dataset'))
+
+        queue.run_worker(exit_when_idle=True)
+        self.assertEqual(DatasetJob.FINISHED, DatasetJob.objects.get(pk=new_job.pk).status)
+
+    def test_job_key(self):
+        key = get_job_key(self.cleaned_data)
+        self.cleaned_data['voucher_codes'] = 'CP100-10\r\nCP100-11\r\nCP100-10'
+        self.cleaned_data['positions'] = ['ALL']
+        self.cleaned_data['taxon_names'] = ['SPECIES', 'CODE', 'GENUS']
+        self.assertEqual(key, get_job_key(self.cleaned_data))
+
+    @override_settings(DATASET_CACHE_GRACE_PERIOD=0)
+    def test_cached_dataset_is_removed_when_data_changes(self):
+        job = submit_job(self.cleaned_data)
+        queue.run_worker(exit_when_idle=True)
+        job = DatasetJob.objects.get(pk=job.pk)
+        self.assertEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+
+        sequence = Sequences.objects.filter(code_id='CP100-10', gene_code='COI').get()
+        sequence.sequences = 'ACGT' + sequence.sequences[4:]
+        sequence.save()
+        self.assertNotEqual(job.job_id, submit_job(self.cleaned_data).job_id)
+        self.assertFalse(DatasetJob.objects.filter(pk=job.pk).exists())
+        self.assertFalse(os.path.isfile(job.dataset_file))
+
+    def test_least_recently_used_datasets_are_evicted(self):
+        first_job = submit_job(self.cleaned_data)
+        queue.run_worker(exit_when_idle=True)
+        first_job = DatasetJob.objects.get(pk=first_job.pk)
+        self.assertTrue(first_job.size > 0)
+
+        with override_settings(DATASET_CACHE_MAX_SIZE=first_job.size, DATASET_CACHE_GRACE_PERIOD=0):
+            self.cleaned_data['file_format'] = 'FASTA'
+            job = submit_job(self.cleaned_data)
+            queue.run_worker(exit_when_idle=True)
+        self.assertEqual([job.pk], [i.pk for i in DatasetJob.objects.all()])
+        self.assertFalse(os.path.isfile(first_job.dataset_file))
+
+    def test_datasets_used_recently_are_not_evicted(self):
+        first_job = submit_job(self.cleaned_data)
+        queue.run_worker(exit_when_idle=True)
+        first_job = DatasetJob.objects.get(pk=first_job.pk)
+
+        with override_settings(DATASET_CACHE_MAX_SIZE=first_job.size):
+            self.cleaned_data['file_format'] = 'FASTA'
+            submit_job(self.cleaned_data)
+            queue.run_worker(exit_when_idle=True)
+        self.assertEqual(2, DatasetJob.objects.count())
+        self.assertTrue(os.path.isfile(first_job.dataset_file))
+
+    def test_failed_job_removes_partial_dataset_file(self):
+        def iter_dataset(*args):
+            yield 'partial dataset'
+            raise ValueError('broken alignment')
+
+        dataset_files = os.path.join(os.path.dirname(dataset.__file__), 'dataset_files')
+        files = set(os.listdir(dataset_files))
+        job = submit_job(self.cleaned_data)
+        with mock.patch('create_dataset.dataset.CreatePhylip.iter_dataset', iter_dataset):
+            queue.run_worker(exit_when_idle=True)
+        self.assertEqual(DatasetJob.FAILED, DatasetJob.objects.get(pk=job.pk).status)
+        self.assertEqual(files, set(os.listdir(dataset_files)))
+
+    def test_failed_job(self):
+        self.cleaned_data['voucher_codes'] = None
+        job = submit_job(self.cleaned_data)
+        queue.run_worker(exit_when_idle=True)
+        job = DatasetJob.objects.get(pk=job.pk)
+        self.assertEqual(DatasetJob.FAILED, job.status)
+        self.assertTrue(job.get_errors()[0].startswith('Could not create dataset'))
+
+    def test_views(self):
+        self.c.post('/accounts/login/', {'username': 'admin', 'password': 'pass'})
+        res = self.c.post('/create_dataset/results/',
+                          {
+                              'voucher_codes': 'CP100-10',
+                              'gene_codes': [],
+                              'geneset': 1,
+                              'taxonset': 1,
+                              'introns': 'YES',
+                              'positions': 'ALL',
+                              'translations': False,
+                              'partition_by_positions': 'ONE',
+                              'file_format': 'FASTA',
+                              'taxon_names': ['CODE', 'GENUS', 'SPECIES'],
+                              'degen_translations': 'NORMAL',
+                              'exclude': 'YES',
+                              'aminoacids': False,
+                              'special': False,
+                              'outgroup': '',
+                          }
+                          )
+        job = DatasetJob.objects.get()
+        self.assertEqual(302, res.status_code)
+        self.assertTrue(res['Location'].endswith('/create_dataset/jobs/' + job.job_id + '/'))
+
+        res = self.c.get('/create_dataset/jobs/' + job.job_id + '/')
+        self.assertTrue('/create_dataset/jobs/' + job.job_id + '/status/' in res.content.decode('utf-8'))
+
+        queue.run_worker(exit_when_idle=True)
+        res = self.c.get('/create_dataset/jobs/' + job.job_id + '/status/')
+        status = json.loads(res.content.decode('utf-8'))
+        self.assertEqual('FINISHED', status['status'])
+        self.assertEqual(status['genes_total'], status['genes_done'])
+
+        file_content = self.c.get(status['download_url'])
+        expected = ">CP100-10_Melitaea_diamina\n????CGTGGTATCACTATTGATATTGCTSTATGG"
+        self.assertTrue(expected in b''.join(file_content.streaming_content).decode('utf-8'))
+
+        # Cached datasets can be downloaded again.
+        file_content = self.c.get(status['download_url'])
+        self.assertTrue(expected in b''.join(file_content.streaming_content).decode('utf-8'))
@@ -2,6 +2,10 @@ from django.test import TestCase
 from django.test.client import Client
 from django.core.management import call_command
 
+from create_dataset import utils
+from create_dataset.dataset import Partition
+from create_dataset.dataset import plan_partitions
+from create_dataset.dataset import strip_chunks
 from create_dataset.utils import CreateDataset
 from public_interface.models import Genes
 from public_interface.models import GeneSets
@@ -915,3 +919,89 @@ GCGTTGCCTGTTTGCATGACGTTTGAAATAACTTCCACTTTTTTTTTCTTTGGTGAGTTCTTTGCCATCTCGTAATGTGT
         cleaned_data['voucher_codes'] = 'CP100-10\r\nCP100-11\r\nCP1000'
         dataset_creator = CreateDataset(cleaned_data)
         self.assertTrue('Could not find sequences for voucher CP1000' in dataset_creator.warnings)
+
+    def test_get_all_sequences_only_requested_pairs(self):
+        result = self.dataset_creator.get_all_sequences()
+        self.assertEqual({'CP100-10', 'CP100-11'}, set(result.keys()))
+        for code in result:
+            self.assertTrue(set(result[code].keys()).issubset({'COI', 'EF1a'}))
+
+    def test_get_all_sequences_in_chunks(self):
+        expected = self.dataset_creator.get_all_sequences()
+
+        chunk_size = utils.VOUCHER_CODES_CHUNK_SIZE
+        utils.VOUCHER_CODES_CHUNK_SIZE = 1
+        try:
+            result = self.dataset_creator.get_all_sequences()
+        finally:
+            utils.VOUCHER_CODES_CHUNK_SIZE = chunk_size
+        self.assertEqual(expected, result)
+
+    def test_streaming_dataset_is_written_to_file(self):
+        for file_format in ['FASTA', 'PHY', 'TNT', 'NEXUS']:
+            self.cleaned_data['file_format'] = file_format
+            expected = CreateDataset(self.cleaned_data).dataset_str
+
+            dataset_creator = CreateDataset(self.cleaned_data, streaming=True)
+            self.assertIsNone(dataset_creator.dataset_str)
+            with open(dataset_creator.dataset_file) as handle:
+                self.assertEqual(expected, handle.read())
+            self.assertEqual(expected[0:1500], dataset_creator.get_dataset_preview())
+
+    def test_streaming_genbank_fasta_dataset(self):
+        self.cleaned_data['file_format'] = 'GenbankFASTA'
+        self.cleaned_data['taxon_names'] = ['CODE', 'GENUS', 'SPECIES']
+        expected = CreateDataset(self.cleaned_data).dataset_str
+
+        dataset_creator = CreateDataset(self.cleaned_data, streaming=True)
+        with open(dataset_creator.dataset_file) as handle:
+            dataset = handle.read()
+        with open(dataset_creator.aa_dataset_file) as handle:
+            aa_dataset = handle.read()
+        self.assertEqual(expected, (dataset, aa_dataset))
+
+    def test_dataset_degen_translations(self):
+        self.cleaned_data['gene_codes'] = [Genes.objects.get(gene_code='COI')]
+        self.cleaned_data['positions'] = ['1st']
+        self.cleaned_data['translations'] = True
+
+        # COI uses the invertebrate mitochondrial code, where AGN codons are serine 2.
+        for degen_translations, expected in [('NORMAL', '??TGAGNCGNTAYAAYTGRTAYATYCCNAARTCNTAY'),
+                                             ('S', '??TGAGNCGNTAYAAYTGRTAYATYCCNAARWSNTAY'),
+                                             ('Z', '??TGWSNCGNTAYAAYTGRTAYATYCCNAARTCNTAY'),
+                                             ('SZ', '??TGNNNCGNTAYAAYTGRTAYATYCCNAARNNNTAY')]:
+            self.cleaned_data['degen_translations'] = degen_translations
+            dataset_creator = CreateDataset(self.cleaned_data)
+            result = dataset_creator.dataset_str.splitlines()[-1]
+            self.assertEqual(expected, result[:len(expected)])
+
+    def test_dataset_degen_translations_gene_with_no_reading_frame(self):
+        self.cleaned_data['gene_codes'] = [Genes.objects.get(gene_code='16S')]
+        expected = CreateDataset(self.cleaned_data).dataset_str
+
+        self.cleaned_data['translations'] = True
+        self.cleaned_data['degen_translations'] = 'NORMAL'
+        dataset_creator = CreateDataset(self.cleaned_data)
+        self.assertEqual(expected, dataset_creator.dataset_str)
+        self.assertTrue(any('Cannot degenerate gene 16S' in i for i in dataset_creator.warnings))
+
+    def test_strip_chunks(self):
+        chunks = ['\n', '\n>COI', '\n', 'ACGT \n', '\n', '\nTTT', '\n', '  ']
+        result = list(strip_chunks(chunks))
+        self.assertEqual(''.join(chunks).strip(), ''.join(result))
+
+    def test_plan_partitions(self):
+        self.assertEqual([Partition(None, None)], plan_partitions(['ALL'], 'ONE'))
+        self.assertEqual([Partition(None, None)], plan_partitions(['1st', '2nd', '3rd'], 'ONE'))
+        self.assertEqual([Partition((0, 2), None)], plan_partitions(['3rd', '1st'], 'ONE'))
+        self.assertEqual([Partition((1,), '_2nd_codon')], plan_partitions(['2nd'], 'ONE'))
+        self.assertEqual([Partition((0,), '_1st_codon'), Partition((1,), '_2nd_codon'),
+                          Partition((2,), '_3rd_codon')],
+                         plan_partitions(['ALL', '1st'], 'EACH'))
+        self.assertEqual([Partition((0, 1), '_1st_2nd_codons'), Partition((2,), '_3rd_codon')],
+                         plan_partitions(['ALL'], '1st2nd_3rd'))
+        self.assertEqual([Partition((0, 1), '_1st_2nd_codons')],
+                         plan_partitions(['1st', '2nd'], '1st2nd_3rd'))
+        self.assertEqual([Partition((1,), '_2nd_codon'), Partition((2,), '_3rd_codon')],
+                         plan_partitions(['2nd', '3rd'], '1st2nd_3rd'))
+        self.assertEqual([], plan_partitions([], 'ONE'))
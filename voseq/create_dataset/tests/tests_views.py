@@ -99,4 +99,4 @@ class CreateDatasetViewsTest(TestCase):
         file_name = re.search('FASTA_\w+\.txt', html_page).group()
         file_content = self.c.get('/create_dataset/results/' + file_name, follow=True)
         expected = ">CP100-10_Melitaea_diamina\n????CGTGGTATCACTATTGATATTGCTSTATGG"
-        self.assertTrue(expected in file_content.content.decode('utf-8'))
+        self.assertTrue(expected in b''.join(file_content.streaming_content).decode('utf-8'))
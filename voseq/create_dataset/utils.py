@@ -1,9 +1,13 @@
+import os
+
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from core.utils import chunks
 from core.utils import get_voucher_codes
 from core.utils import get_gene_codes
 from core.utils import flatten_taxon_names_dict
+from .dataset import STREAM_CHUNK_SIZE
 from .dataset import CreateGenbankFasta
 from .dataset import CreateFasta
 from .dataset import CreatePhylip
@@ -14,6 +18,35 @@ from public_interface.models import Sequences
 from public_interface.models import Vouchers
 
 
+# Maximum number of voucher codes sent to the database in each ``IN`` lookup.
+VOUCHER_CODES_CHUNK_SIZE = 500
+
+
+def read_file_head(filename, size):
+    if filename is None or not os.path.isfile(filename):
+        return ''
+    with open(filename, 'r') as handle:
+        return handle.read(size)
+
+
+def iter_file(filename, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields the content of a dataset file in chunks, so it can be served by a
+    ``StreamingHttpResponse``.
+    """
+    with open(filename, 'r') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), ''):
+            yield chunk
+
+
+def iter_file_and_remove(filename, chunk_size=STREAM_CHUNK_SIZE):
+    """Same as ``iter_file``, but the file is deleted once it has been served.
+    """
+    try:
+        yield from iter_file(filename, chunk_size)
+    finally:
+        os.remove(filename)
+
+
 class CreateDataset(object):
     """
     Accepts form input to create a dataset in several formats, codon positions,
@@ -21,17 +54,29 @@ class CreateDataset(object):
     taxonset.
 
     Attributes:
-        ``dataset_str``: output dataset to pass to users.
+        ``dataset_str``: output dataset to pass to users. It is None if
+                         ``streaming`` is True, as the dataset is then only
+                         written to ``dataset_file``.
+        ``progress_callback``: function called with the number of genes done
+                               and the total number of genes while the
+                               dataset is created.
 
     """
-    def __init__(self, cleaned_data):
+    def __init__(self, cleaned_data, streaming=False, progress_callback=None):
         self.errors = []
+        self.streaming = streaming
+        self.progress_callback = progress_callback
         self.seq_objs = dict()
         self.minimum_number_of_genes = cleaned_data['number_genes']
         self.aminoacids = cleaned_data['aminoacids']
         self.codon_positions = cleaned_data['positions']
         self.file_format = cleaned_data['file_format']
         self.partition_by_positions = cleaned_data['partition_by_positions']
+        self.degen_translations = None
+        if cleaned_data.get('translations') is True:
+            self.degen_translations = cleaned_data.get('degen_translations') or 'NORMAL'
+        # Intron sites are removed if users choose to ignore introns.
+        self.remove_introns = cleaned_data.get('introns') == 'YES'
         self.cleaned_data = cleaned_data
         self.voucher_codes = get_voucher_codes(cleaned_data)
         self.gene_codes = get_gene_codes(cleaned_data)
@@ -53,7 +98,8 @@ class CreateDataset(object):
         if self.file_format == 'GenbankFASTA':
             fasta = CreateGenbankFasta(self.codon_positions, self.partition_by_positions,
                                        self.seq_objs, self.gene_codes, self.voucher_codes,
-                                       self.file_format)
+                                       self.file_format, streaming=self.streaming,
+                                       progress_callback=self.progress_callback)
             fasta_dataset = fasta.from_seq_objs_to_dataset()
             self.warnings += fasta.warnings
             self.dataset_file = fasta.dataset_file
@@ -63,7 +109,10 @@ class CreateDataset(object):
         if self.file_format == 'FASTA':
             fasta = CreateFasta(self.codon_positions, self.partition_by_positions,
                                 self.seq_objs, self.gene_codes, self.voucher_codes,
-                                self.file_format)
+                                self.file_format, streaming=self.streaming,
+                                degen_translations=self.degen_translations,
+                                remove_introns=self.remove_introns,
+                                progress_callback=self.progress_callback)
             fasta_dataset = fasta.from_seq_objs_to_dataset()
             self.warnings += fasta.warnings
             self.dataset_file = fasta.dataset_file
@@ -73,7 +122,11 @@ class CreateDataset(object):
             phy = CreatePhylip(self.codon_positions, self.partition_by_positions,
                                self.seq_objs, self.gene_codes, self.voucher_codes,
                                self.file_format, self.outgroup, self.voucher_codes_metadata,
-                               self.minimum_number_of_genes, self.aminoacids)
+                               self.minimum_number_of_genes, self.aminoacids,
+                               streaming=self.streaming,
+                               degen_translations=self.degen_translations,
+                               remove_introns=self.remove_introns,
+                               progress_callback=self.progress_callback)
             phylip_dataset = phy.from_seq_objs_to_dataset()
             self.warnings += phy.warnings
             self.dataset_file = phy.dataset_file
@@ -84,7 +137,11 @@ class CreateDataset(object):
             tnt = CreateTNT(self.codon_positions, self.partition_by_positions,
                             self.seq_objs, self.gene_codes, self.voucher_codes,
                             self.file_format, self.outgroup, self.voucher_codes_metadata,
-                            self.minimum_number_of_genes, self.aminoacids)
+                            self.minimum_number_of_genes, self.aminoacids,
+                            streaming=self.streaming,
+                            degen_translations=self.degen_translations,
+                            remove_introns=self.remove_introns,
+                            progress_callback=self.progress_callback)
             tnt_dataset = tnt.from_seq_objs_to_dataset()
             self.warnings += tnt.warnings
             self.dataset_file = tnt.dataset_file
@@ -94,7 +151,11 @@ class CreateDataset(object):
             nexus = CreateNEXUS(self.codon_positions, self.partition_by_positions,
                                 self.seq_objs, self.gene_codes, self.voucher_codes,
                                 self.file_format, self.outgroup, self.voucher_codes_metadata,
-                                self.minimum_number_of_genes, self.aminoacids)
+                                self.minimum_number_of_genes, self.aminoacids,
+                                streaming=self.streaming,
+                                degen_translations=self.degen_translations,
+                                remove_introns=self.remove_introns,
+                                progress_callback=self.progress_callback)
             nexus_dataset = nexus.from_seq_objs_to_dataset()
             self.warnings += nexus.warnings
             self.dataset_file = nexus.dataset_file
@@ -122,8 +183,8 @@ class CreateDataset(object):
                 seq_obj = self.build_seq_obj(code, gene_code, our_taxon_names, this_voucher_seqs)
 
                 if gene_code not in self.seq_objs:
-                    self.seq_objs[gene_code] = tuple()
-                self.seq_objs[gene_code] += (seq_obj,)
+                    self.seq_objs[gene_code] = []
+                self.seq_objs[gene_code].append(seq_obj)
                 gene_codes.add(gene_code)
                 vouchers_found.add(code)
 
@@ -133,20 +194,29 @@ class CreateDataset(object):
         self.gene_codes = list(gene_codes)
 
     def get_all_sequences(self):
-        # Return sequences as dict of lists containing sequence and related data
+        """Queries only the sequences for our voucher and gene codes.
+
+        Voucher codes are sent to the database in chunks so that very large
+        taxonsets do not go over the limits of ``IN`` lookups.
+
+        Returns:
+            dict of dicts {'CP100-10': {'COI': {'code_id': .., 'gene_code': .., 'sequences': ..}}}
+
+        """
         seqs_dict = {}
+        gene_codes = set(self.gene_codes)
 
-        all_seqs = Sequences.objects.all().values('code_id',
-                                                  'gene_code',
-                                                  'sequences').order_by('code_id')
-        for seq in all_seqs:
-            code = seq['code_id']
-            gene_code = seq['gene_code']
+        for voucher_codes in chunks(self.voucher_codes, VOUCHER_CODES_CHUNK_SIZE):
+            queryset = Sequences.objects.filter(
+                code_id__in=voucher_codes,
+                gene_code__in=gene_codes,
+            ).values('code_id', 'gene_code', 'sequences')
 
-            if code in self.voucher_codes and gene_code in self.gene_codes:
+            for seq in queryset:
+                code = seq['code_id']
                 if code not in seqs_dict:
-                    seqs_dict[code] = {gene_code: ''}
-                seqs_dict[code][gene_code] = seq
+                    seqs_dict[code] = {}
+                seqs_dict[code][seq['gene_code']] = seq
         return seqs_dict
 
     def build_seq_obj(self, code, gene_code, our_taxon_names, this_voucher_seqs):
@@ -191,22 +261,32 @@ class CreateDataset(object):
         """
         vouchers_with_taxon_names = {}
 
-        all_vouchers = Vouchers.objects.all().order_by('code').values('code', 'orden', 'superfamily',
-                                                                      'family', 'subfamily', 'tribe',
-                                                                      'subtribe', 'genus', 'species',
-                                                                      'subspecies', 'author', 'hostorg',)
-        for voucher in all_vouchers:
-            code = voucher['code']
-            if code in self.voucher_codes:
+        for voucher_codes in chunks(self.voucher_codes, VOUCHER_CODES_CHUNK_SIZE):
+            queryset = Vouchers.objects.filter(code__in=voucher_codes).values(
+                'code', 'orden', 'superfamily', 'family', 'subfamily', 'tribe',
+                'subtribe', 'genus', 'species', 'subspecies', 'author', 'hostorg',
+            )
+            for voucher in queryset:
                 obj = dict()
                 for taxon_name in self.taxon_names:
                     if taxon_name != 'GENECODE':
                         taxon_name = taxon_name.lower()
                         obj[taxon_name] = voucher[taxon_name]
-                vouchers_with_taxon_names[code] = obj
+                vouchers_with_taxon_names[voucher['code']] = obj
 
         return vouchers_with_taxon_names
 
+    def get_dataset_preview(self, size=1500):
+        """Reads the first characters of the dataset file to show to users.
+
+        For GenbankFASTA returns a tuple with the nucleotide and aminoacid
+        previews.
+        """
+        preview = read_file_head(self.dataset_file, size)
+        if self.file_format == 'GenbankFASTA':
+            return preview, read_file_head(self.aa_dataset_file, size)
+        return preview
+
     def get_gene_codes_metadata(self):
         """
         :return: dictionary with genecode and base pair number.
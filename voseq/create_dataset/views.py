@@ -1,14 +1,20 @@
+import json
 import os
-import re
 
 from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render
-from django.http import HttpResponseRedirect
 from django.http import HttpResponse
+from django.http import HttpResponseRedirect
+from django.http import StreamingHttpResponse
 
 from core.utils import get_version_stats
 from .forms import CreateDatasetForm
-from .utils import CreateDataset
+from .jobs import get_job_preview
+from .jobs import iter_dataset_file
+from .jobs import queue
+from .jobs import submit_job
+from .models import DatasetJob
 
 
 @login_required
@@ -31,31 +37,11 @@ def results(request):
         form = CreateDatasetForm(request.POST)
 
         if form.is_valid():
-            print(">>>>", form.cleaned_data)
-            dataset_creator = CreateDataset(form.cleaned_data)
-            dataset = dataset_creator.dataset_str[0:1500] + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
-            errors = dataset_creator.errors
-            warnings = dataset_creator.warnings
-
-            dataset_file_abs = dataset_creator.dataset_file
-            if dataset_file_abs is not None:
-                dataset_file = re.search('([A-Z]+_[a-z0-9]+\.txt)', dataset_file_abs).groups()[0]
-            else:
-                dataset_file = False
-
-            return render(request, 'create_dataset/results.html',
-                          {
-                              'dataset_file': dataset_file,
-                              'charset_block': dataset_creator.charset_block,
-                              'dataset': dataset,
-                              'errors': errors,
-                              'warnings': warnings,
-                              'version': version,
-                              'stats': stats,
-                          },
-                          )
+            job = submit_job(form.cleaned_data)
+            if job.status in (DatasetJob.PENDING, DatasetJob.RUNNING):
+                return HttpResponseRedirect('/create_dataset/jobs/' + job.job_id + '/')
+            return render_job(request, job, version, stats)
         else:
-            print("invalid form")
             return render(request, 'create_dataset/index.html',
                           {
                               'form': form,
@@ -67,6 +53,91 @@ def results(request):
         return HttpResponseRedirect('/create_dataset/')
 
 
+@login_required
+def job(request, job_id):
+    version, stats = get_version_stats()
+    job = get_object_or_404(DatasetJob, job_id=job_id)
+    return render_job(request, job, version, stats)
+
+
+@login_required
+def job_status(request, job_id):
+    job = get_object_or_404(DatasetJob, job_id=job_id)
+    status = queue.get_job_status(job)
+    if job.file_format == 'GenbankFASTA':
+        results_url = '/genbank_fasta/results/'
+    else:
+        results_url = '/create_dataset/results/'
+    if 'dataset_file' in status:
+        status['download_url'] = results_url + status['dataset_file'] + '/'
+    if 'aa_dataset_file' in status:
+        status['aa_download_url'] = results_url + status['aa_dataset_file'] + '/'
+    return HttpResponse(json.dumps(status), content_type='application/json')
+
+
+def render_job(request, job, version, stats):
+    """Shows the dataset of finished jobs, or the progress of the job if it
+    is still waiting for a worker or running. Also used by ``genbank_fasta``.
+    """
+    if job.status in (DatasetJob.PENDING, DatasetJob.RUNNING):
+        return render(request, 'create_dataset/job.html',
+                      {
+                          'job': job,
+                          'status_url': '/create_dataset/jobs/' + job.job_id + '/status/',
+                          'version': version,
+                          'stats': stats,
+                      },
+                      )
+
+    if job.file_format == 'GenbankFASTA':
+        return render_genbank_fasta_job(request, job, version, stats)
+
+    if job.status == DatasetJob.FINISHED:
+        dataset = get_job_preview(job)[0] + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
+        dataset_file = os.path.basename(job.dataset_file)
+    else:
+        dataset = ''
+        dataset_file = False
+
+    return render(request, 'create_dataset/results.html',
+                  {
+                      'dataset_file': dataset_file,
+                      'charset_block': job.charset_block,
+                      'dataset': dataset,
+                      'errors': job.get_errors(),
+                      'warnings': job.get_warnings(),
+                      'version': version,
+                      'stats': stats,
+                  },
+                  )
+
+
+def render_genbank_fasta_job(request, job, version, stats):
+    if job.status == DatasetJob.FINISHED:
+        dataset, aa_dataset = get_job_preview(job)
+        dataset = dataset + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
+        aa_dataset = aa_dataset + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
+        dataset_file = os.path.basename(job.dataset_file)
+        aa_dataset_file = os.path.basename(job.aa_dataset_file)
+    else:
+        dataset = aa_dataset = ''
+        dataset_file = aa_dataset_file = False
+
+    return render(request, 'genbank_fasta/results.html',
+                  {
+                      'items_with_accession': '',
+                      'dataset': dataset,
+                      'fasta_file': dataset_file,
+                      'protein': aa_dataset,
+                      'errors': job.get_errors(),
+                      'protein_file': aa_dataset_file,
+                      'warnings': job.get_warnings(),
+                      'version': version,
+                      'stats': stats,
+                  },
+                  )
+
+
 @login_required
 def serve_file(request, file_name):
     cwd = os.path.dirname(__file__)
@@ -75,9 +146,9 @@ def serve_file(request, file_name):
                                 file_name,
                                 )
     if os.path.isfile(dataset_file):
-        response = HttpResponse(open(dataset_file, 'r').read(), content_type='application/text')
+        response = StreamingHttpResponse(iter_dataset_file(dataset_file),
+                                         content_type='application/text')
         response['Content-Disposition'] = 'attachment; filename=dataset_file.txt'
-        os.remove(dataset_file)
         return response
     else:
         return render(request, 'create_dataset/missing_file.html')
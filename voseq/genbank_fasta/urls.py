@@ -9,4 +9,5 @@ urlpatterns = patterns(
     url(r'^/$', views.index, name='index'),
     url(r'^/results/$', views.results, name='results'),
     url(r'^/results/(?P<file_name>.+\.txt)/$', views.serve_file, name='serve_file'),
+    url(r'^/jobs/(?P<job_id>[a-z0-9]+)/$', views.job, name='job'),
 )
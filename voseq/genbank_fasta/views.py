@@ -1,15 +1,18 @@
 import os
-import re
 
 from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 from django.http import HttpResponseRedirect
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from core.utils import get_version_stats
 from .forms import GenBankFastaForm
-from create_dataset.utils import CreateDataset
+from create_dataset.jobs import iter_dataset_file
+from create_dataset.jobs import submit_job
+from create_dataset.models import DatasetJob
+from create_dataset.views import render_job
 
 
 @login_required
@@ -45,35 +48,10 @@ def results(request):
             cleaned_data['taxon_names'] = ['CODE', 'GENUS', 'SPECIES']
             cleaned_data['outgroup'] = ''
 
-            dataset_creator = CreateDataset(cleaned_data)
-            dataset, aa_dataset = dataset_creator.dataset_str
-            dataset = dataset[0:1500] + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
-            aa_dataset = aa_dataset[0:1500] + '\n...\n\n\n' + '#######\nComplete dataset file available for download.\n#######'
-            errors = dataset_creator.errors
-            warnings = dataset_creator.warnings
-
-            dataset_file_abs = dataset_creator.dataset_file
-            aa_dataset_file_abs = dataset_creator.aa_dataset_file
-            if dataset_file_abs is not None:
-                dataset_file = re.search('([a-zA-Z]+_[a-z0-9]+\.txt)', dataset_file_abs).groups()[0]
-                aa_dataset_file = re.search('([a-zA-Z]+_aa_[a-z0-9]+\.txt)', aa_dataset_file_abs).groups()[0]
-            else:
-                dataset_file = False
-                aa_dataset_file = False
-
-            return render(request, 'genbank_fasta/results.html',
-                          {
-                              'items_with_accession': '',
-                              'dataset': dataset,
-                              'fasta_file': dataset_file,
-                              'protein': aa_dataset,
-                              'errors': errors,
-                              'protein_file': aa_dataset_file,
-                              'warnings': warnings,
-                              'version': version,
-                              'stats': stats,
-                          },
-                          )
+            job = submit_job(cleaned_data)
+            if job.status in (DatasetJob.PENDING, DatasetJob.RUNNING):
+                return HttpResponseRedirect('/genbank_fasta/jobs/' + job.job_id + '/')
+            return render_job(request, job, version, stats)
         else:
             return render(request, 'genbank_fasta/index.html',
                           {
@@ -86,6 +64,13 @@ def results(request):
     return HttpResponseRedirect('/genbank_fasta/')
 
 
+@login_required
+def job(request, job_id):
+    version, stats = get_version_stats()
+    job = get_object_or_404(DatasetJob, job_id=job_id, file_format='GenbankFASTA')
+    return render_job(request, job, version, stats)
+
+
 @login_required
 def serve_file(request, file_name):
     cwd = os.path.dirname(__file__)
@@ -95,9 +80,10 @@ def serve_file(request, file_name):
                               'dataset_files',
                               file_name,
                               )
-    response = HttpResponse(open(fasta_file, 'r').read(), content_type='application/text')
-    response['Content-Disposition'] = 'attachment; filename=voseq_genbank.fasta'
+    if not os.path.isfile(fasta_file):
+        return render(request, 'create_dataset/missing_file.html')
 
-    if os.path.isfile(fasta_file):
-        os.remove(fasta_file)
+    response = StreamingHttpResponse(iter_dataset_file(fasta_file),
+                                     content_type='application/text')
+    response['Content-Disposition'] = 'attachment; filename=voseq_genbank.fasta'
     return response
@@ -0,0 +1,113 @@
+"""
+Suggestions for the autocomplete boxes of the advanced search, found in the
+web worker instead of querying the ``autocomplete`` index on each keystroke.
+
+For each field of ``AutoCompleteIndex``, the distinct values of the vouchers
+are saved in ``autocomplete.json`` of ``settings.SEARCH_INDEX_DIR`` with the
+sorted list of their lowercase words, so the words starting with a term are
+found with ``bisect``. Web workers load the file once and again only when it
+is replaced.
+
+The file is written by ``build_suggestions`` when the search indexes are
+built or vouchers are indexed, and by the first request if it is missing.
+"""
+import bisect
+import json
+import os
+
+from django.conf import settings
+
+from core.utils import lock_file
+from core.utils import write_file_atomically
+from .search_backend import get_words
+from .search_indexes import AutoCompleteIndex
+
+
+# Loaded suggestions, by file name, with the size and modification time of
+# the file.
+_loaded_suggestions = dict()
+
+
+def get_suggestions_file():
+    return os.path.join(settings.SEARCH_INDEX_DIR, 'autocomplete.json')
+
+
+def get_autocomplete_fields():
+    """
+    :return: list of the voucher fields with autocomplete.
+    """
+    return sorted(i.model_attr for i in AutoCompleteIndex.fields.values() if i.model_attr)
+
+
+def get_field_suggestions(queryset, field):
+    """
+    :return: dict with the distinct values of a field, and its words sorted,
+             each with the position of its value as in ``positions``.
+    """
+    values = queryset.order_by(field).values_list(field, flat=True).distinct()
+    values = [i for i in values if i]
+    words = sorted((word, position) for position, value in enumerate(values)
+                   for word in set(get_words(value)))
+    return {
+        'values': values,
+        'words': [i[0] for i in words],
+        'positions': [i[1] for i in words],
+    }
+
+
+def build_suggestions():
+    """Saves the values of the vouchers for all autocomplete fields."""
+    filename = get_suggestions_file()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    queryset = AutoCompleteIndex().index_queryset()
+    with lock_file(filename + '.lock'):
+        fields = dict((field, get_field_suggestions(queryset, field))
+                      for field in get_autocomplete_fields())
+        write_file_atomically(filename, json.dumps({'fields': fields}, separators=(',', ':')))
+
+
+def load_suggestions():
+    """
+    :return: dict with the suggestions of each field, as saved by
+             ``build_suggestions``.
+    """
+    filename = get_suggestions_file()
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        build_suggestions()
+        stat = os.stat(filename)
+    version = (stat.st_size, stat.st_mtime_ns)
+
+    loaded = _loaded_suggestions.get(filename)
+    if loaded is None or loaded[0] != version:
+        with open(filename) as handle:
+            loaded = (version, json.load(handle)['fields'])
+        _loaded_suggestions[filename] = loaded
+    return loaded[1]
+
+
+def get_suggestions(field, term, limit=5):
+    """Values of a field with words starting with all words of the term, as
+    the ``autocomplete`` index finds them.
+
+    :return: list of up to ``limit`` values.
+    """
+    suggestions = load_suggestions().get(field)
+    # The longest word of the term has the fewest values to look at.
+    query = sorted(get_words(term), key=len, reverse=True)
+    if suggestions is None or not query:
+        return []
+
+    words = suggestions['words']
+    found = []
+    i = bisect.bisect_left(words, query[0])
+    while i < len(words) and words[i].startswith(query[0]) and len(found) < limit:
+        value = suggestions['values'][suggestions['positions'][i]]
+        i += 1
+        if value in found:
+            continue
+        value_words = get_words(value)
+        if all(any(j.startswith(k) for j in value_words) for k in query[1:]):
+            found.append(value)
+    return found
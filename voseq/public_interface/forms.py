@@ -6,6 +6,10 @@ from haystack.forms import ModelSearchForm
 from haystack.query import SearchQuerySet
 
 from public_interface.models import Genes
+from public_interface.search_indexes import EXACT_SEQUENCE_FIELDS
+from public_interface.search_indexes import TEXT_SEQUENCE_FIELDS
+from public_interface.search_indexes import get_sequence_tag
+from public_interface.search_indexes import tag_words
 
 
 DateInput = partial(forms.DateInput, {'class': 'datepicker form-control',
@@ -123,22 +127,27 @@ class AdvancedSearchForm(ModelSearchForm):
         return sqs
 
     def search(self):
-        keywords, sequence_keywords = self.clean_search_keywords()
-        sqs = ''
-        if bool(sequence_keywords) is True:
-            sqs = SearchQuerySet().using('advanced_search').filter(**sequence_keywords).facet('code')
-            sqs = filter_results_from_sequence_table(sqs)
-        if bool(keywords) is True:
-            if sqs != '':
-                sqs = sqs.filter(**keywords)
-            else:
-                sqs = SearchQuerySet().using('vouchers').filter(**keywords)
-                print(sqs)
+        """Vouchers are indexed with the fields of their sequences, so a
+        single query to the `vouchers` index finds them. Searches by gene code
+        or GenBank status together with other fields of sequences only find
+        vouchers with one sequence having all of them.
 
-        if len(sqs) > 0:
-            return sqs
-        else:
-            self.no_query_found()
+        :return: SearchQuerySet, or None if no field was filled in.
+        """
+        keywords, sequence_keywords = self.clean_search_keywords()
+        exact = dict((k, v) for k, v in sequence_keywords.items() if k in EXACT_SEQUENCE_FIELDS)
+        if exact:
+            tag = get_sequence_tag(exact)
+            if len(exact) > 1:
+                keywords['sequence_tags'] = tag
+            for field in TEXT_SEQUENCE_FIELDS:
+                words = tag_words(tag, sequence_keywords.get(field, ''))
+                if words:
+                    keywords['tagged_' + field] = ' '.join(words)
+        keywords.update(sequence_keywords)
+        if bool(keywords) is False:
+            return None
+        return SearchQuerySet().using('vouchers').filter(**keywords)
 
     def clean_search_keywords(self):
         keywords = {}
@@ -174,19 +183,6 @@ class AdvancedSearchForm(ModelSearchForm):
         return keywords, sequence_keywords
 
 
-def filter_results_from_sequence_table(sqs):
-    """Need to avoid returning duplicated voucher results.
-    """
-    facet_counts = sqs.facet_counts()
-    voucher_codes_count = facet_counts['fields']['code']
-    if len(voucher_codes_count) > 0:
-        voucher_codes = [item[0] for item in voucher_codes_count]
-        filtered_sqs = SearchQuerySet().using('vouchers').filter(code__in=voucher_codes)
-        return filtered_sqs
-    else:
-        return sqs
-
-
 # The following form is for the admin site bacth_changes action
 # It would be nice not to repeat the lines from the previous
 # model, but...
@@ -0,0 +1,269 @@
+"""
+Updates of the search indexes as vouchers and sequences change.
+
+``signals.QueuedSignalProcessor`` keeps a ``SearchIndexChange`` for each
+voucher or sequence saved or deleted, and the process started with
+``python manage.py update_search_indexes`` sends them to the Haystack
+indexes in batches of ``settings.SEARCH_INDEX_BATCH_SIZE``, so changes are
+searchable within seconds without rebuilding the indexes.
+
+``update_indexes_since`` updates the indexes with the vouchers and sequences
+edited since a date, for changes made without signals, as imports do, and
+``rebuild_connection`` builds the indexes of a Haystack connection from
+scratch, which ``rebuild_search_indexes`` does for all connections at once.
+
+If no process sends the queued changes, only the last
+``settings.SEARCH_INDEX_MAX_QUEUED_CHANGES`` of them are kept, and
+``prune_changes`` removes those covered by ``update_indexes_since``.
+
+The autocomplete suggestions are saved again whenever vouchers are indexed.
+"""
+import logging
+import time
+
+from django.conf import settings
+from haystack import connections as haystack_connections
+from haystack.exceptions import NotHandled
+
+from .autocomplete import build_suggestions
+from .models import SearchIndexChange
+from .models import Sequences
+from .models import Vouchers
+
+
+log = logging.getLogger(__name__)
+
+INDEXED_MODELS = [Vouchers, Sequences]
+
+# The size of the queue is checked every time this number of changes is
+# queued.
+QUEUE_CHECK_INTERVAL = 1000
+
+
+def queue_change(instance, deleted=False):
+    changes = [SearchIndexChange.objects.create(
+        model_name=instance._meta.model_name,
+        object_pk=str(instance.pk),
+        deleted=deleted,
+    )]
+    if isinstance(instance, Sequences):
+        # Vouchers are indexed with the fields of their sequences.
+        changes.append(SearchIndexChange.objects.create(
+            model_name=Vouchers._meta.model_name,
+            object_pk=str(instance.code_id),
+            deleted=False,
+        ))
+    if any(i.pk % QUEUE_CHECK_INTERVAL == 0 for i in changes):
+        trim_queue()
+
+
+def trim_queue():
+    """Drops the oldest queued changes beyond
+    ``settings.SEARCH_INDEX_MAX_QUEUED_CHANGES``, which are left when no
+    process sends them to the indexes.
+
+    :return: number of changes dropped.
+    """
+    max_changes = settings.SEARCH_INDEX_MAX_QUEUED_CHANGES
+    excess = SearchIndexChange.objects.count() - max_changes
+    if excess <= 0:
+        return 0
+
+    oldest_kept = SearchIndexChange.objects.order_by('-pk').values_list('pk', flat=True)[max_changes - 1]
+    SearchIndexChange.objects.filter(pk__lt=oldest_kept).delete()
+    log.warning("Dropped %i changes queued for the search indexes. Keep "
+                "update_search_indexes running, or run it with --since to "
+                "index them.", excess)
+    return excess
+
+
+def get_connection_indexes(using):
+    """
+    :return: tuple with the backend of a Haystack connection and the list of
+             its indexes of our models.
+    """
+    unified_index = haystack_connections[using].get_unified_index()
+    indexes = []
+    for model in INDEXED_MODELS:
+        try:
+            indexes.append(unified_index.get_index(model))
+        except NotHandled:
+            continue
+    return haystack_connections[using].get_backend(), indexes
+
+
+def get_indexes(model):
+    """
+    :return: list of tuples (backend, index) of the Haystack connections
+             indexing the model.
+    """
+    indexes = []
+    for using in haystack_connections.connections_info.keys():
+        try:
+            index = haystack_connections[using].get_unified_index().get_index(model)
+        except NotHandled:
+            continue
+        indexes.append((using, haystack_connections[using].get_backend(), index))
+    return indexes
+
+
+def update_objects(model, saved_pks, deleted_pks):
+    """Sends saved objects to the indexes of the model and removes deleted
+    ones, and saved ones that are not found any more.
+    """
+    for using, backend, index in get_indexes(model):
+        objects = list(index.index_queryset(using=using).filter(pk__in=saved_pks))
+        if objects:
+            backend.update(index, objects)
+
+        found = set(str(i.pk) for i in objects)
+        for pk in deleted_pks + [i for i in saved_pks if i not in found]:
+            backend.remove(model(pk=model._meta.pk.to_python(pk)))
+
+
+def process_changes(batch_size=None):
+    """Sends the oldest queued changes to the indexes. Only the last change
+    of each object is used.
+
+    :return: number of changes processed.
+    """
+    if batch_size is None:
+        batch_size = settings.SEARCH_INDEX_BATCH_SIZE
+    changes = list(SearchIndexChange.objects.order_by('pk')[:batch_size])
+    if not changes:
+        return 0
+
+    deleted = dict()
+    for change in changes:
+        deleted[(change.model_name, change.object_pk)] = change.deleted
+
+    for model in INDEXED_MODELS:
+        model_name = model._meta.model_name
+        saved_pks = sorted(pk for (name, pk), is_deleted in deleted.items()
+                           if name == model_name and not is_deleted)
+        deleted_pks = sorted(pk for (name, pk), is_deleted in deleted.items()
+                             if name == model_name and is_deleted)
+        if saved_pks or deleted_pks:
+            update_objects(model, saved_pks, deleted_pks)
+            if model is Vouchers:
+                build_suggestions()
+
+    # Changes queued meanwhile are kept for the next batch.
+    SearchIndexChange.objects.filter(pk__in=[i.pk for i in changes]).delete()
+    return len(changes)
+
+
+def update_indexes_since(since, batch_size=None):
+    """Sends the vouchers and sequences edited since a date to the indexes.
+
+    :param since: datetime.
+    :return: number of objects sent to each index, by model name.
+    """
+    if batch_size is None:
+        batch_size = settings.SEARCH_INDEX_BATCH_SIZE
+
+    counts = dict()
+    for model in INDEXED_MODELS:
+        for using, backend, index in get_indexes(model):
+            queryset = index.build_queryset(using=using, start_date=since)
+            total = queryset.count()
+            for start in range(0, total, batch_size):
+                backend.update(index, queryset[start:start + batch_size])
+            counts[model._meta.model_name] = total
+    if counts.get(Vouchers._meta.model_name):
+        build_suggestions()
+    return counts
+
+
+def prune_changes(since, until):
+    """Removes the changes queued between two dates, once the vouchers and
+    sequences edited since the first one have been sent to the indexes by
+    ``update_indexes_since``. Objects deleted meanwhile are removed from the
+    indexes first.
+
+    :return: number of changes removed.
+    """
+    changes = SearchIndexChange.objects.filter(time_created__gte=since, time_created__lt=until)
+    for model in INDEXED_MODELS:
+        deleted_pks = set(changes.filter(model_name=model._meta.model_name, deleted=True)
+                          .values_list('object_pk', flat=True))
+        # Objects saved again after they were deleted have been indexed.
+        existing = model.objects.filter(pk__in=deleted_pks).values_list('pk', flat=True)
+        deleted_pks -= set(str(i) for i in existing)
+        if deleted_pks:
+            update_objects(model, [], sorted(deleted_pks))
+
+    count = changes.count()
+    changes.delete()
+    return count
+
+
+def iter_chunks(queryset, chunk_size):
+    """Reads a queryset in chunks ordered by primary key, so memory use does
+    not grow with the number of objects and each chunk is one bulk request.
+
+    :return: iterator of lists of objects.
+    """
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        # Not .iterator(), which would skip prefetch_related.
+        objects = list(chunk[:chunk_size])
+        if objects:
+            yield objects
+        if len(objects) < chunk_size:
+            return
+        last_pk = objects[-1].pk
+
+
+def rebuild_connection(using, batch_size=None):
+    """Clears the indexes of a Haystack connection and indexes all vouchers
+    and sequences again.
+
+    :return: number of documents indexed.
+    """
+    if batch_size is None:
+        batch_size = settings.SEARCH_INDEX_BATCH_SIZE
+
+    backend, indexes = get_connection_indexes(using)
+    # The whole index is removed, so it is created again with the current
+    # fields.
+    backend.clear()
+
+    count = 0
+    for index in indexes:
+        queryset = index.index_queryset(using=using)
+        if index.get_model() is Sequences:
+            # The voucher code of each sequence is indexed.
+            queryset = queryset.select_related('code')
+        for objects in iter_chunks(queryset, batch_size):
+            backend.update(index, objects)
+            count += len(objects)
+    return count
+
+
+def run_indexer(poll_interval=1.0, exit_when_idle=False):
+    """Processes queued changes as they come.
+
+    :param poll_interval: seconds to wait for changes when the queue is empty
+                          or the search engine could not be reached.
+    :param exit_when_idle: return when the queue is empty instead of waiting.
+    """
+    while True:
+        try:
+            processed = process_changes()
+        except Exception:
+            # The changes are kept, to try again once the search engine is
+            # back.
+            log.exception("Could not update the search indexes")
+            processed = 0
+            if exit_when_idle:
+                raise
+
+        if processed > 0:
+            continue
+        if exit_when_idle:
+            return
+        time.sleep(poll_interval)
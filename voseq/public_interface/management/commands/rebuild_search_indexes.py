@@ -0,0 +1,87 @@
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from haystack import connections as haystack_connections
+
+from public_interface.autocomplete import build_suggestions
+from public_interface.indexing import rebuild_connection
+
+
+def rebuild(args):
+    """Runs in the worker processes of the pool.
+
+    :return: tuple with the name of the connection, the number of documents
+             indexed, the seconds it took and the error message if it could
+             not be rebuilt.
+    """
+    using, batch_size = args
+    start = time.time()
+    try:
+        count = rebuild_connection(using, batch_size)
+    except Exception as e:
+        return using, 0, time.time() - start, str(e)
+    return using, count, time.time() - start, None
+
+
+class Command(BaseCommand):
+    help = 'Clears the search indexes and indexes all vouchers and sequences ' \
+           'again, building the index of each Haystack connection at the same time, ' \
+           'and saves the autocomplete suggestions.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=None,
+                    help='Number of indexes built at the same time. Defaults '
+                         'to the number of Haystack connections.',
+                    ),
+        make_option('--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=None,
+                    help='Number of documents sent in each bulk request. Defaults '
+                         'to SEARCH_INDEX_BATCH_SIZE.',
+                    ),
+        make_option('--using',
+                    action='append',
+                    dest='using',
+                    default=[],
+                    help='Rebuild only the named connection (can be used multiple times).',
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        using = options['using'] or sorted(haystack_connections.connections_info.keys())
+        batch_size = options['batch_size'] or settings.SEARCH_INDEX_BATCH_SIZE
+        processes = options['processes'] or len(using)
+        tasks = [(i, batch_size) for i in using]
+
+        start = time.time()
+        if processes == 1:
+            self.report(map(rebuild, tasks))
+        else:
+            # Each worker process needs to open its own database connection.
+            for connection in connections.all():
+                connection.close()
+
+            pool = multiprocessing.Pool(processes)
+            try:
+                self.report(pool.imap_unordered(rebuild, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        build_suggestions()
+        self.stdout.write('Rebuilt %i search indexes in %.2f s' % (len(tasks), time.time() - start))
+
+    def report(self, results):
+        for using, count, seconds, error in results:
+            if error is not None:
+                self.stderr.write('Could not rebuild %s: %s' % (using, error))
+            else:
+                self.stdout.write('Indexed %i documents in %s in %.2f s (%.0f docs/s)' %
+                                  (count, using, seconds, count / max(seconds, 0.001)))
@@ -0,0 +1,60 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from public_interface.indexing import prune_changes
+from public_interface.indexing import run_indexer
+from public_interface.indexing import update_indexes_since
+
+
+class Command(BaseCommand):
+    help = 'Sends the vouchers and sequences saved or deleted by users to the ' \
+           'search indexes as they change. Use --since to index those edited ' \
+           'since a date, for example after importing data, and remove the ' \
+           'changes queued since then.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--since',
+                    dest='since',
+                    default=None,
+                    help='Index vouchers and sequences edited since this date, '
+                         'as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, and exit.',
+                    ),
+        make_option('--poll-interval',
+                    dest='poll_interval',
+                    type='float',
+                    default=1.0,
+                    help='Seconds to wait before looking for changes when there are none.',
+                    ),
+        make_option('--exit-when-idle',
+                    action='store_true',
+                    dest='exit_when_idle',
+                    default=False,
+                    help='Stop once all changes are indexed.',
+                    ),
+    )
+
+    def handle(self, *args, **options):
+        if options['since'] is None:
+            run_indexer(options['poll_interval'], options['exit_when_idle'])
+            return
+
+        try:
+            since = parse_datetime(options['since'])
+            if since is None:
+                since = datetime.datetime.combine(parse_date(options['since']), datetime.time())
+        except (TypeError, ValueError):
+            raise CommandError('Invalid date: %s' % options['since'])
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.get_default_timezone())
+
+        until = timezone.now()
+        counts = update_indexes_since(since)
+        for model_name in sorted(counts):
+            self.stdout.write('Indexed %i %s' % (counts[model_name], model_name))
+        self.stdout.write('Removed %i queued changes' % prune_changes(since, until))
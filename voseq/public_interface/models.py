@@ -33,6 +33,7 @@ class Genes(models.Model):
     )
     gene_type = models.CharField(max_length=255, blank=True)
     time_created = models.DateTimeField(auto_now_add=True)
+    time_edited = models.DateTimeField(auto_now=True, null=True, blank=True)
 
     def __str__(self):
         return self.gene_code
@@ -212,3 +213,16 @@ class FlickrImages(models.Model):
     voucherImage = models.URLField(help_text="URLs of the Flickr page.")
     thumbnail = models.URLField(help_text="URLs for the small sized image from Flickr.")
     flickr_id = models.CharField(max_length=100, help_text="ID numbers from Flickr for our photo.")
+
+
+class SearchIndexChange(models.Model):
+    """Voucher or sequence saved or deleted since the search indexes were
+    last updated by ``update_search_indexes``.
+    """
+    model_name = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=100)
+    deleted = models.BooleanField(default=False)
+    time_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.model_name + ' ' + self.object_pk
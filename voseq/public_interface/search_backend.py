@@ -0,0 +1,535 @@
+"""
+Embedded Haystack backend, so the simple and advanced searches work without
+Elasticsearch.
+
+Connections using ``public_interface.search_backend.LocalSearchEngine`` keep
+their index in a directory of ``settings.SEARCH_INDEX_DIR`` named after their
+``INDEX_NAME``, or in the directory given as ``PATH``.
+
+Text is split in lowercase words, and all words of a query must be found, as
+with ``HAYSTACK_DEFAULT_OPERATOR = 'AND'``. Words of ``EdgeNgramField`` fields
+are also indexed by their first ``MAX_GRAM`` characters and all shorter
+prefixes, so partial words find them, which autocomplete relies on.
+
+Each build of an index is saved as the ``core.builds.Postings`` of the
+hashes of the field names and words of its documents, which web workers read
+memory-mapped.
+
+Documents saved or removed after a build are appended to a delta file, which
+is merged with the build when searching, until it is a quarter of the size of
+the build and the index is built again.
+"""
+import datetime
+import functools
+import hashlib
+import json
+import operator
+import os
+import re
+
+import numpy as np
+from django.conf import settings
+from haystack import connections
+from haystack.backends import BaseEngine
+from haystack.backends import BaseSearchBackend
+from haystack.backends import BaseSearchQuery
+from haystack.backends import SearchNode
+from haystack.backends import log_query
+from haystack.constants import DJANGO_CT
+from haystack.constants import DJANGO_ID
+from haystack.constants import ID
+from haystack.exceptions import SearchBackendError
+from haystack.exceptions import SkipDocument
+from haystack.inputs import AutoQuery
+from haystack.inputs import BaseInput
+from haystack.inputs import Exact
+from haystack.inputs import Not
+from haystack.models import SearchResult
+from haystack.utils import get_identifier
+from haystack.utils import get_model_ct
+from haystack.utils.app_loading import haystack_get_model
+
+from core.builds import BuildStore
+from core.builds import Postings
+from core.builds import make_arrays
+from core.utils import write_file_atomically
+
+
+# Longest prefix of the words of EdgeNgramField fields that is indexed.
+MAX_GRAM = 15
+
+# Documents saved since the last build above which the index is built again,
+# if the build is small.
+MAX_DELTA_SIZE = 1000
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+NGRAM_FIELD_TYPES = ['ngram', 'edge_ngram']
+
+COMPARISONS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+
+def from_python(value):
+    """Converts the prepared value of a field to JSON. Dates are written as
+    Haystack fields convert them back.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat() + ' 00:00:00'
+    if isinstance(value, (list, tuple, set)):
+        return [from_python(i) for i in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def get_words(value):
+    """
+    :return: list of the lowercase words in a field value.
+    """
+    if value is None:
+        return []
+    if isinstance(value, bool):
+        return ['true' if value else 'false']
+    if isinstance(value, list):
+        return [word for item in value for word in get_words(item)]
+    return WORD.findall(str(value).lower())
+
+
+def get_key(field, word):
+    """
+    :return: 64 bit hash of a word in a field.
+    """
+    digest = hashlib.md5((field + ':' + word).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def get_document_keys(document, ngram_fields):
+    """
+    :param ngram_fields: fields whose words are also indexed by their prefixes.
+    :return: set with the keys of the words in a document.
+    """
+    keys = set()
+    for field, value in document.items():
+        if field in (ID, DJANGO_CT, DJANGO_ID):
+            continue
+        for word in get_words(value):
+            if field in ngram_fields:
+                keys.update(get_key(field, word[:size])
+                            for size in range(1, min(len(word), MAX_GRAM) + 1))
+            else:
+                keys.add(get_key(field, word))
+    return keys
+
+
+def get_query_keys(field, word):
+    """Long words are only indexed by their prefix in EdgeNgramField fields,
+    so the prefix is looked up too.
+    """
+    return {get_key(field, word), get_key(field, word[:MAX_GRAM])}
+
+
+def get_document_order(document):
+    django_id = document[DJANGO_ID]
+    return document[DJANGO_CT], int(django_id) if django_id.isdigit() else 0, django_id
+
+
+def contains_phrase(words, phrase):
+    size = len(phrase)
+    return any(words[i:i + size] == phrase for i in range(len(words) - size + 1))
+
+
+def compare(value, other, comparison):
+    """Values of different types, or missing ones, do not match."""
+    if value is None:
+        return False
+    if isinstance(value, list):
+        return any(compare(i, other, comparison) for i in value)
+    try:
+        return comparison(value, other)
+    except TypeError:
+        return False
+
+
+class Segment(Postings):
+    """
+    Documents of a build or of a delta, with the postings of their words.
+    """
+    def __init__(self, documents, keys, offsets, postings):
+        super(Segment, self).__init__(keys, offsets, postings)
+        self.documents = documents
+
+    @classmethod
+    def from_documents(cls, documents, ngram_fields):
+        """Indexes documents in memory.
+
+        :param ngram_fields: dict with the EdgeNgramField fields of each model,
+                             by ``django_ct``.
+        """
+        key_sets = [get_document_keys(i, ngram_fields.get(i[DJANGO_CT], ()))
+                    for i in documents]
+        arrays = make_arrays([np.fromiter(i, dtype=np.uint64, count=len(i)) for i in key_sets],
+                             np.uint64)
+        return cls(documents, **arrays)
+
+    def get_all(self):
+        return np.arange(len(self.documents), dtype=np.uint32)
+
+    def match(self, query):
+        """
+        :param query: query built by ``LocalSearchQuery``, or None to match
+                      all documents.
+        :return: sorted positions of the documents matching the query.
+        """
+        if query is None:
+            return self.get_all()
+        if query[0] == 'filter':
+            return self.match_filter(*query[1:])
+
+        connector, negated, children = query
+        matches = [self.match(child) for child in children]
+        if not matches:
+            found = self.get_all()
+        elif connector == SearchNode.OR:
+            found = functools.reduce(np.union1d, matches)
+        else:
+            found = functools.reduce(np.intersect1d, matches)
+        if negated:
+            found = np.setdiff1d(self.get_all(), found, assume_unique=True)
+        return found
+
+    def match_filter(self, field, filter_type, value):
+        if filter_type in ('content', 'contains', 'fuzzy'):
+            return self.match_words(field, get_words(value))
+        if filter_type == 'exact':
+            return self.match_phrase(field, value)
+        if filter_type == 'in':
+            found = np.zeros(0, dtype=np.uint32)
+            for item in value:
+                found = np.union1d(found, self.match_phrase(field, item))
+            return found
+        if filter_type == 'startswith':
+            prefix = ' '.join(get_words(value))
+            return self.scan(field, lambda i: ' '.join(get_words(i)).startswith(prefix))
+        if filter_type == 'range':
+            start, end = value
+            return self.scan(field, lambda i: compare(i, start, operator.ge) and
+                             compare(i, end, operator.le))
+        if filter_type in COMPARISONS:
+            return self.scan(field, lambda i: compare(i, value, COMPARISONS[filter_type]))
+        raise SearchBackendError("Unknown filter '%s' for field '%s'." % (filter_type, field))
+
+    def match_words(self, field, words):
+        found = self.get_all()
+        for word in words:
+            postings = [self.get_postings(key) for key in get_query_keys(field, word)]
+            found = np.intersect1d(found, functools.reduce(np.union1d, postings),
+                                   assume_unique=True)
+        return found
+
+    def match_phrase(self, field, value):
+        phrase = get_words(value)
+        return np.array([i for i in self.match_words(field, phrase)
+                         if contains_phrase(get_words(self.documents[i].get(field)), phrase)],
+                        dtype=np.uint32)
+
+    def scan(self, field, test):
+        """Filters that cannot use the postings read the documents."""
+        return np.array([i for i, document in enumerate(self.documents)
+                         if test(document.get(field))], dtype=np.uint32)
+
+
+class LocalSearchBackend(BaseSearchBackend, BuildStore):
+    """
+    Index of a Haystack connection kept on disk, with its builds in a
+    ``core.builds.BuildStore``.
+    """
+    def __init__(self, connection_alias, **connection_options):
+        super(LocalSearchBackend, self).__init__(connection_alias, **connection_options)
+        self.path = connection_options.get('PATH') or os.path.join(
+            settings.SEARCH_INDEX_DIR,
+            connection_options.get('INDEX_NAME', connection_alias),
+        )
+        BuildStore.__init__(self, os.path.join(self.path, ''))
+        self.delta_file = self.prefix + 'delta.jsonl'
+
+    def get_unified_index(self):
+        return connections[self.connection_alias].get_unified_index()
+
+    def get_ngram_fields(self):
+        """
+        :return: dict with the EdgeNgramField fields of the indexed models, by
+                 ``django_ct``.
+        """
+        unified_index = self.get_unified_index()
+        ngram_fields = dict()
+        for model in unified_index.get_indexed_models():
+            fields = unified_index.get_index(model).fields.values()
+            ngram_fields[get_model_ct(model)] = set(
+                i.index_fieldname for i in fields if i.field_type in NGRAM_FIELD_TYPES)
+        return ngram_fields
+
+    def read_delta(self, build):
+        """The first line of the delta file has the build it belongs to, and
+        every other line a document id with the document, or None if it was
+        removed. A last line without end is still being written.
+
+        :return: dict with the documents saved since the build, by id.
+        """
+        try:
+            with open(self.delta_file) as handle:
+                lines = handle.read().split('\n')[:-1]
+        except IOError:
+            return dict()
+        if not lines or json.loads(lines[0]).get('build') != build:
+            return dict()
+        return dict(json.loads(line) for line in lines[1:])
+
+    def get_delta_size(self, build):
+        """
+        :return: number of changes in the delta of the build, or None if the
+                 delta belongs to another build.
+        """
+        try:
+            with open(self.delta_file) as handle:
+                first_line = handle.readline()
+                if json.loads(first_line).get('build') != build:
+                    return None
+                return sum(1 for _ in handle)
+        except (IOError, ValueError):
+            return None
+
+    def load_build(self, build):
+        """
+        :return: Segment with the documents of a build and its arrays,
+                 memory-mapped.
+        """
+        def load():
+            with open(self.get_build_file(build, 'documents.json')) as handle:
+                documents = json.load(handle)
+            return Segment(documents, *self.load_postings(build))
+
+        return self.get_loaded('build', build, load)
+
+    def load_delta(self, build):
+        """
+        :return: tuple with the ids of the documents changed since the build
+                 and a Segment with the saved ones.
+        """
+        def load():
+            delta = self.read_delta(build)
+            documents = sorted((i for i in delta.values() if i is not None),
+                               key=get_document_order)
+            return set(delta), Segment.from_documents(documents, self.get_ngram_fields())
+
+        return self.get_loaded('delta', (build,) + self.get_file_version(self.delta_file), load)
+
+    def read_documents(self):
+        """
+        :return: list of all documents in the index, with the changes in the
+                 delta.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return []
+        build = manifest['build']
+        delta = self.read_delta(build)
+        documents = [i for i in self.load_build(build).documents if i[ID] not in delta]
+        return documents + [i for i in delta.values() if i is not None]
+
+    def build(self, documents):
+        """Indexes documents and makes it the current build. Should be called
+        holding the lock.
+        """
+        build = self.new_build()
+        documents = sorted(documents, key=get_document_order)
+        self.save_postings(build, Segment.from_documents(documents, self.get_ngram_fields()))
+        with open(self.get_build_file(build, 'documents.json'), 'w') as handle:
+            json.dump(documents, handle)
+
+        self.publish_build(build, {'documents': len(documents)})
+        write_file_atomically(self.delta_file, json.dumps({'build': build}) + '\n')
+
+    def save_documents(self, changes):
+        """Appends saved and removed documents to the delta of the current
+        build, or builds the index again if the delta is too big.
+
+        :param changes: dict with the documents, or None if they were removed,
+                        by id.
+        """
+        with self.lock():
+            manifest = self.read_manifest()
+            delta_size = None
+            if manifest is not None:
+                delta_size = self.get_delta_size(manifest['build'])
+
+            max_size = MAX_DELTA_SIZE
+            if manifest is not None:
+                max_size = max(MAX_DELTA_SIZE, manifest['documents'] // 4)
+
+            if delta_size is None or delta_size + len(changes) > max_size:
+                documents = [i for i in self.read_documents() if i[ID] not in changes]
+                self.build(documents + [i for i in changes.values() if i is not None])
+                return
+
+            with open(self.delta_file, 'a') as handle:
+                handle.write(''.join(json.dumps([doc_id, document]) + '\n'
+                                     for doc_id, document in changes.items()))
+
+    def update(self, index, iterable, commit=True):
+        changes = dict()
+        for obj in iterable:
+            try:
+                prepared = index.full_prepare(obj)
+            except SkipDocument:
+                continue
+            document = dict((key, from_python(value)) for key, value in prepared.items())
+            changes[document[ID]] = document
+        if changes:
+            self.save_documents(changes)
+
+    def remove(self, obj_or_string, commit=True):
+        self.save_documents({get_identifier(obj_or_string): None})
+
+    def clear(self, models=None, commit=True):
+        with self.lock():
+            if not models:
+                self.build([])
+                return
+            model_cts = set(get_model_ct(i) for i in models)
+            self.build([i for i in self.read_documents() if i[DJANGO_CT] not in model_cts])
+
+    @log_query
+    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
+               fields='', facets=None, models=None, result_class=None, **kwargs):
+        """
+        :param query_string: query built by ``LocalSearchQuery``.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return {'results': [], 'hits': 0}
+
+        build = manifest['build']
+        segment = self.load_build(build)
+        changed, delta_segment = self.load_delta(build)
+        documents = [segment.documents[i] for i in segment.match(query_string)
+                     if segment.documents[i][ID] not in changed]
+        documents += [delta_segment.documents[i] for i in delta_segment.match(query_string)]
+
+        unified_index = self.get_unified_index()
+        model_cts = set(get_model_ct(i) for i in models or unified_index.get_indexed_models())
+        documents = [i for i in documents if i[DJANGO_CT] in model_cts]
+
+        documents.sort(key=get_document_order)
+        for field in reversed(sort_by or []):
+            name = field.lstrip('-')
+            documents.sort(key=lambda i: (i.get(name) is None, i.get(name) or ''),
+                           reverse=field.startswith('-'))
+
+        results = dict()
+        if facets:
+            results['facets'] = {
+                'fields': dict((i, self.count_facet(documents, i)) for i in facets),
+                'dates': {},
+                'queries': {},
+            }
+        results['results'] = [self.make_result(i, result_class or SearchResult, fields)
+                              for i in documents[start_offset:end_offset]]
+        results['hits'] = len(documents)
+        results['spelling_suggestion'] = None
+        return results
+
+    def count_facet(self, documents, field):
+        """
+        :return: list of tuples with the values of a field and the number of
+                 documents with them, the most frequent first.
+        """
+        counts = dict()
+        for document in documents:
+            values = document.get(field)
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                if value is not None:
+                    counts[value] = counts.get(value, 0) + 1
+        return sorted(counts.items(), key=lambda i: (-i[1], str(i[0])))
+
+    def make_result(self, document, result_class, fields):
+        app_label, model_name = document[DJANGO_CT].split('.')
+        index = self.get_unified_index().get_index(haystack_get_model(app_label, model_name))
+
+        additional_fields = dict()
+        for key, value in document.items():
+            if key in (DJANGO_CT, DJANGO_ID) or (fields and key not in fields):
+                continue
+            if key in index.fields and hasattr(index.fields[key], 'convert'):
+                value = index.fields[key].convert(value)
+            additional_fields[key] = value
+        return result_class(app_label, model_name, document[DJANGO_ID], 1.0, **additional_fields)
+
+
+class LocalSearchQuery(BaseSearchQuery):
+    """Builds queries as nested tuples instead of query strings:
+    ``(connector, negated, children)`` for groups of filters and
+    ``('filter', field, filter_type, value)`` for filters.
+    """
+    def build_query(self):
+        if not self.query_filter:
+            return None
+        return self.build_node(self.query_filter)
+
+    def build_node(self, search_node):
+        children = []
+        for child in search_node.children:
+            if isinstance(child, SearchNode):
+                children.append(self.build_node(child))
+            else:
+                expression, value = child
+                field, filter_type = search_node.split_expression(expression)
+                children.append(self.build_filter(field, filter_type, value))
+        return search_node.connector, search_node.negated, children
+
+    def build_filter(self, field, filter_type, value):
+        if field == 'content':
+            field = connections[self._using].get_unified_index().document_field
+
+        if isinstance(value, AutoQuery):
+            return self.build_auto_query(field, value.query_string)
+        if isinstance(value, Exact):
+            return 'filter', field, 'exact', value.query_string
+        if isinstance(value, Not):
+            return SearchNode.AND, True, [('filter', field, filter_type, value.query_string)]
+        if isinstance(value, BaseInput):
+            value = value.query_string
+        return 'filter', field, filter_type, from_python(value)
+
+    def build_auto_query(self, field, query_string):
+        """Words in double quotes are matched as a phrase, and words starting
+        with '-' must not be found, as ``haystack.inputs.AutoQuery`` does.
+        """
+        phrases = AutoQuery.exact_match_re.findall(query_string)
+        children = []
+        for bit in AutoQuery.exact_match_re.split(query_string):
+            if bit in phrases:
+                children.append(('filter', field, 'exact', bit))
+                continue
+            for word in bit.split():
+                if word.startswith('-') and len(word) > 1:
+                    children.append((SearchNode.AND, True, [('filter', field, 'contains', word[1:])]))
+                else:
+                    children.append(('filter', field, 'contains', word))
+        return SearchNode.AND, False, children
+
+    def build_query_fragment(self, field, filter_type, value):
+        return str(self.build_filter(field, filter_type, value))
+
+
+class LocalSearchEngine(BaseEngine):
+    backend = LocalSearchBackend
+    query = LocalSearchQuery
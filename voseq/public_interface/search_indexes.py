@@ -1,4 +1,8 @@
 import datetime
+import hashlib
+import itertools
+import json
+import re
 
 from haystack import indexes
 
@@ -6,6 +10,52 @@ from .models import Vouchers
 from .models import Sequences
 
 
+# Fields of sequences matched as a whole, and by the prefixes of their words.
+EXACT_SEQUENCE_FIELDS = ['gene_code', 'genbank']
+TEXT_SEQUENCE_FIELDS = ['accession', 'labPerson']
+WORD = re.compile(r'\w+')
+
+# Characters of the tags, short so tagged words keep most of their prefixes
+# within the longest edge n-grams.
+TAG_SIZE = 6
+
+
+def get_sequence_tag(values):
+    """Short word standing for the gene code, the GenBank status or both of
+    a sequence.
+
+    :param values: dict with values of ``EXACT_SEQUENCE_FIELDS``, genbank as
+                   'true' or 'false'.
+    :return: string.
+    """
+    dumped = json.dumps(sorted((field, str(value).lower()) for field, value in values.items()))
+    return hashlib.sha1(dumped.encode('utf-8')).hexdigest()[:TAG_SIZE]
+
+
+def get_sequence_tags(sequence):
+    """
+    :return: list with the tags of the gene code, the GenBank status and both
+             of a sequence.
+    """
+    values = {
+        'gene_code': sequence.gene_code,
+        'genbank': 'true' if sequence.genbank else 'false',
+    }
+    return [get_sequence_tag(dict((i, values[i]) for i in fields))
+            for size in range(1, len(EXACT_SEQUENCE_FIELDS) + 1)
+            for fields in itertools.combinations(EXACT_SEQUENCE_FIELDS, size)]
+
+
+def tag_words(tag, value):
+    """Words of a lab person or accession prefixed with the tag of their
+    sequence, so searches combining them with gene code or GenBank status
+    only match words of the same sequence, and still match partial words.
+
+    :return: list of strings.
+    """
+    return [tag + i for i in WORD.findall(value.lower())]
+
+
 class SimpleSearchIndex(indexes.SearchIndex, indexes.Indexable):
     """We have only taxonomical fields for this search.
     """
@@ -25,6 +75,9 @@ class SimpleSearchIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Vouchers
 
+    def get_updated_field(self):
+        return 'timestamp'
+
     # TODO change to time_edited, time_created with auto in tables and migrate_db script
     def index_queryset(self, using='default'):
         # Used when the entire index for model is updated.
@@ -100,12 +153,58 @@ class VouchersIndex(indexes.SearchIndex, indexes.Indexable):
     hostorg = indexes.CharField(model_attr='hostorg', null=True)
     typeSpecies = indexes.CharField(model_attr='typeSpecies', null=True)
 
+    # Fields of the sequences of the voucher, so advanced searches by them
+    # need a single query. Searches combining them use the tagged fields.
+    gene_code = indexes.MultiValueField(null=True)
+    genbank = indexes.MultiValueField(null=True)
+    accession = indexes.EdgeNgramField(null=True)
+    labPerson = indexes.EdgeNgramField(null=True)
+    sequence_tags = indexes.MultiValueField(null=True)
+    tagged_accession = indexes.EdgeNgramField(null=True)
+    tagged_labPerson = indexes.EdgeNgramField(null=True)
+
     def get_model(self):
         return Vouchers
 
+    def get_updated_field(self):
+        return 'timestamp'
+
     def index_queryset(self, using='vouchers'):
         # Used when the entire index for model is updated.
-        return self.get_model().objects.filter(timestamp__lte=datetime.datetime.now())
+        return self.get_model().objects.filter(
+            timestamp__lte=datetime.datetime.now(),
+        ).prefetch_related('sequences_set')
+
+    def build_queryset(self, using=None, start_date=None, end_date=None):
+        """Vouchers whose sequences were edited in the period are indexed
+        again too.
+        """
+        queryset = super(VouchersIndex, self).build_queryset(using, start_date, end_date)
+        if start_date is None and end_date is None:
+            return queryset
+
+        edited = Sequences.objects.all()
+        if start_date is not None:
+            edited = edited.filter(time_edited__gte=start_date)
+        if end_date is not None:
+            edited = edited.filter(time_edited__lte=end_date)
+        return queryset | self.index_queryset(using=using).filter(pk__in=edited.values('code_id'))
+
+    def prepare(self, obj):
+        data = super(VouchersIndex, self).prepare(obj)
+        sequences = obj.sequences_set.all()
+        if sequences:
+            data['gene_code'] = sorted(set(i.gene_code for i in sequences))
+            data['genbank'] = sorted(set('true' if i.genbank else 'false' for i in sequences))
+            data['accession'] = '\n'.join(sorted(set(i.accession for i in sequences if i.accession)))
+            data['labPerson'] = '\n'.join(sorted(set(i.labPerson for i in sequences if i.labPerson)))
+            # Tags of both gene code and GenBank status.
+            data['sequence_tags'] = sorted(set(get_sequence_tags(i)[-1] for i in sequences))
+            for field in TEXT_SEQUENCE_FIELDS:
+                data['tagged_' + field] = '\n'.join(sorted(set(
+                    word for i in sequences for tag in get_sequence_tags(i)
+                    for word in tag_words(tag, getattr(i, field)))))
+        return data
 
 
 class AdvancedSearchIndex(indexes.SearchIndex, indexes.Indexable):
@@ -122,6 +221,9 @@ class AdvancedSearchIndex(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Sequences
 
+    def get_updated_field(self):
+        return 'time_edited'
+
     def index_queryset(self, using='advanced_search'):
         # Used when the entire index for model is updated.
         return self.get_model().objects.filter(time_created__lte=datetime.datetime.now())
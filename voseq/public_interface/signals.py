@@ -0,0 +1,37 @@
+from django.db import models
+from haystack.signals import BaseSignalProcessor
+
+
+# Models with search indexes, by model name.
+INDEXED_MODELS = ['vouchers', 'sequences']
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """Queues the vouchers and sequences that are saved or deleted, so
+    ``update_search_indexes`` sends them to the search indexes in batches
+    instead of making the request wait for them.
+
+    Loaded by Haystack before models are ready, so it connects to the
+    signals of all models and picks the indexed ones.
+    """
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def is_indexed(self, sender):
+        return sender._meta.app_label == 'public_interface' and \
+            sender._meta.model_name in INDEXED_MODELS
+
+    def handle_save(self, sender, instance, **kwargs):
+        if self.is_indexed(sender):
+            from .indexing import queue_change
+            queue_change(instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if self.is_indexed(sender):
+            from .indexing import queue_change
+            queue_change(instance, deleted=True)
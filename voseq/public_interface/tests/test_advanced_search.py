@@ -1,15 +1,19 @@
+from unittest import mock
+
 from django.core.management import call_command
 from django.test import Client
 from django.test import TestCase
 from django.test.utils import override_settings
 import haystack
 
+from public_interface.models import Genes
+from public_interface.models import Sequences
+
 
 # Need to use a clean index for our tests
 TEST_INDEX = {
     'default': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'haystack',
         'INCLUDE_SPELLING': True,
         'EXCLUDED_INDEXES': [
@@ -19,8 +23,7 @@ TEST_INDEX = {
         ],
     },
     'autocomplete': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'autocomplete',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -29,8 +32,7 @@ TEST_INDEX = {
         ],
     },
     'vouchers': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'vouchers',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -40,8 +42,7 @@ TEST_INDEX = {
         ],
     },
     'advanced_search': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'advanced_search',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -146,6 +147,43 @@ class TestAdvancedSearch(TestCase):
         content = response.content.decode('utf-8')
         self.assertTrue('CP100-10' in content)
 
+    def test_advanced_search_by_fields_of_different_sequences(self):
+        """CP100-10 has a COI sequence not in GenBank and an EF1a sequence
+        in GenBank.
+        """
+        coi = Genes.objects.get(gene_code='COI').pk
+        response = self.client.get('/search/advanced/?gene_code=%i&genbank=y' % coi)
+        content = response.content.decode('utf-8')
+        self.assertTrue('No results found' in content)
+
+        response = self.client.get('/search/advanced/?gene_code=%i&genbank=n&labPerson=Wahlberg' % coi)
+        content = response.content.decode('utf-8')
+        self.assertTrue('/p/CP100-10' in content)
+        self.assertTrue('/p/CP100-15' in content)
+
+    def test_advanced_search_by_partial_lab_person_and_gene_code(self):
+        coi = Genes.objects.get(gene_code='COI').pk
+        response = self.client.get('/search/advanced/?gene_code=%i&labPerson=Wahl' % coi)
+        content = response.content.decode('utf-8')
+        self.assertTrue('/p/CP100-10' in content)
+        self.assertTrue('/p/CP100-15' in content)
+
+    def test_advanced_search_by_lab_person_of_other_sequence(self):
+        """Only the EF1a sequence of CP100-10 is left by Niklas Wahlberg."""
+        Sequences.objects.filter(code__code='CP100-10').exclude(gene_code='EF1a').update(
+            labPerson='Carlos Pena')
+        call_command('rebuild_index', interactive=False, verbosity=0)
+        coi = Genes.objects.get(gene_code='COI').pk
+        response = self.client.get('/search/advanced/?gene_code=%i&labPerson=Wahl' % coi)
+        content = response.content.decode('utf-8')
+        self.assertFalse('/p/CP100-10' in content)
+        self.assertTrue('/p/CP100-15' in content)
+
+        response = self.client.get('/search/advanced/?gene_code=%i&labPerson=Pen' % coi)
+        content = response.content.decode('utf-8')
+        self.assertTrue('/p/CP100-10' in content)
+        self.assertFalse('/p/CP100-15' in content)
+
     def test_advanced_search_by_type_species_negative(self):
         response = self.client.get('/search/advanced/?typeSpecies=y&code=CP100-09')
         content = response.content.decode('utf-8')
@@ -195,3 +233,11 @@ class TestAdvancedSearch(TestCase):
         response = self.client.get('/search/advanced/?code_bold=BCIBT193-09')
         content = response.content.decode('utf-8')
         self.assertTrue('CP100-18' in content)
+
+    def test_advanced_search_by_sequence_and_voucher_fields_is_one_query(self):
+        backend = type(haystack.connections['vouchers'].get_backend())
+        with mock.patch.object(backend, 'search', autospec=True,
+                               side_effect=backend.search) as search:
+            response = self.client.get('/search/advanced/?orden=Lepidoptera&labPerson=Niklas+Wahlberg')
+        self.assertEqual(1, search.call_count)
+        self.assertTrue('CP100-11' in response.content.decode('utf-8'))
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from public_interface.autocomplete import build_suggestions
+from public_interface.autocomplete import get_suggestions
+from public_interface.autocomplete import get_suggestions_file
+from public_interface.models import Vouchers
+
+
+class TestAutocomplete(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        search_index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, search_index_dir)
+        settings_override = override_settings(SEARCH_INDEX_DIR=search_index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_suggestions_are_built_when_missing(self):
+        self.assertFalse(os.path.exists(get_suggestions_file()))
+        self.assertEqual(['Melitaea', 'Melitaea?'], get_suggestions('genus', 'melit'))
+        self.assertTrue(os.path.exists(get_suggestions_file()))
+
+    def test_all_words_of_the_term(self):
+        self.assertEqual(['Niklas Wahlberg'], get_suggestions('collector', 'wahl nik'))
+        self.assertEqual([], get_suggestions('collector', 'wahl smith'))
+        self.assertEqual([], get_suggestions('collector', ' '))
+
+    def test_limit(self):
+        self.assertEqual(1, len(get_suggestions('genus', 'm', limit=1)))
+
+    def test_unknown_field(self):
+        self.assertEqual([], get_suggestions('password', 'a'))
+
+    def test_suggestions_are_loaded_again_when_built(self):
+        self.assertEqual([], get_suggestions('genus', 'euptych'))
+        voucher = Vouchers.objects.get(code='CP100-10')
+        voucher.genus = 'Euptychia'
+        voucher.save()
+        self.assertEqual([], get_suggestions('genus', 'euptych'))
+
+        build_suggestions()
+        self.assertEqual(['Euptychia'], get_suggestions('genus', 'euptych'))
@@ -0,0 +1,147 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from public_interface.indexing import iter_chunks
+from public_interface.indexing import process_changes
+from public_interface.indexing import prune_changes
+from public_interface.indexing import update_indexes_since
+from public_interface.models import SearchIndexChange
+from public_interface.models import Sequences
+from public_interface.models import Vouchers
+from public_interface.search_indexes import AdvancedSearchIndex
+from public_interface.search_indexes import VouchersIndex
+
+
+class FakeBackend(object):
+    """Keeps what would be sent to the search engine."""
+    def __init__(self):
+        self.updated = []
+        self.removed = []
+        self.cleared = False
+
+    def clear(self):
+        self.cleared = True
+
+    def update(self, index, iterable):
+        self.updated += [i.pk for i in iterable]
+
+    def remove(self, obj):
+        self.removed.append(obj.pk)
+
+
+class TestIndexing(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        self.backend = FakeBackend()
+        indexes = {Vouchers: VouchersIndex(), Sequences: AdvancedSearchIndex()}
+        for name, fake in [
+            ('get_indexes', lambda model: [('default', self.backend, indexes[model])]),
+            ('get_connection_indexes', lambda using: (self.backend, list(indexes.values()))),
+        ]:
+            patcher = mock.patch('public_interface.indexing.' + name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_changes_are_queued(self):
+        voucher = Vouchers.objects.get(code='CP100-10')
+        voucher.save()
+        sequence = Sequences.objects.filter(code_id='CP100-10')[0]
+        sequence_pk = sequence.pk
+        sequence.delete()
+
+        changes = [(i.model_name, i.object_pk, i.deleted)
+                   for i in SearchIndexChange.objects.order_by('pk')]
+        self.assertEqual([('vouchers', 'CP100-10', False),
+                          ('sequences', str(sequence_pk), True),
+                          ('vouchers', 'CP100-10', False)], changes)
+
+    def test_process_changes(self):
+        voucher = Vouchers.objects.get(code='CP100-10')
+        voucher.save()
+        voucher.save()
+        sequence = Sequences.objects.filter(code_id='CP100-11')[0]
+        sequence_pk = sequence.pk
+        sequence.save()
+        sequence.delete()
+
+        self.assertEqual(6, process_changes())
+        self.assertEqual(['CP100-10', 'CP100-11'], sorted(self.backend.updated))
+        self.assertEqual([sequence_pk], self.backend.removed)
+        self.assertEqual(0, SearchIndexChange.objects.count())
+        self.assertEqual(0, process_changes())
+
+    @override_settings(SEARCH_INDEX_MAX_QUEUED_CHANGES=2)
+    def test_queue_is_trimmed(self):
+        voucher = Vouchers.objects.get(code='CP100-10')
+        with mock.patch('public_interface.indexing.QUEUE_CHECK_INTERVAL', 1):
+            for i in range(3):
+                voucher.save()
+        self.assertEqual(2, SearchIndexChange.objects.count())
+
+    def test_prune_changes(self):
+        since = timezone.now()
+        Vouchers.objects.get(code='CP100-10').save()
+        sequence = Sequences.objects.filter(code_id='CP100-11')[0]
+        sequence_pk = sequence.pk
+        sequence.delete()
+        until = timezone.now()
+        Vouchers.objects.get(code='CP100-13').save()
+
+        update_indexes_since(since)
+        self.assertEqual(3, prune_changes(since, until))
+        self.assertEqual([sequence_pk], self.backend.removed)
+        self.assertEqual([('vouchers', 'CP100-13')],
+                         list(SearchIndexChange.objects.values_list('model_name', 'object_pk')))
+
+    def test_update_indexes_since(self):
+        counts = update_indexes_since(timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(Vouchers.objects.count(), counts['vouchers'])
+        self.assertEqual(Sequences.objects.count(), counts['sequences'])
+
+        since = timezone.now()
+        Vouchers.objects.get(code='CP100-10').save()
+        self.backend.updated = []
+        counts = update_indexes_since(since)
+        self.assertEqual({'vouchers': 1, 'sequences': 0}, counts)
+        self.assertEqual(['CP100-10'], self.backend.updated)
+
+    def test_vouchers_of_edited_sequences_are_updated(self):
+        since = timezone.now()
+        sequence = Sequences.objects.filter(code_id='CP100-11')[0]
+        sequence.save()
+        counts = update_indexes_since(since)
+        self.assertEqual({'vouchers': 1, 'sequences': 1}, counts)
+        self.assertEqual(['CP100-11', sequence.pk], self.backend.updated)
+
+    def test_vouchers_are_indexed_with_their_sequences(self):
+        voucher = VouchersIndex().index_queryset().get(code='CP100-10')
+        data = VouchersIndex().full_prepare(voucher)
+        sequences = Sequences.objects.filter(code_id='CP100-10')
+        self.assertEqual(sorted(set(i.gene_code for i in sequences)), data['gene_code'])
+        self.assertTrue('Niklas Wahlberg' in data['labPerson'])
+
+    def test_iter_chunks(self):
+        chunks = list(iter_chunks(Vouchers.objects.all(), 2))
+        self.assertTrue(all(len(i) == 2 for i in chunks[:-1]))
+        self.assertEqual(sorted(Vouchers.objects.values_list('pk', flat=True)),
+                         [i.pk for chunk in chunks for i in chunk])
+
+    def test_rebuild_search_indexes(self):
+        out = StringIO()
+        call_command('rebuild_search_indexes', using=['default'], processes=1,
+                     batch_size=2, stdout=out)
+        self.assertTrue(self.backend.cleared)
+        self.assertEqual(Vouchers.objects.count() + Sequences.objects.count(),
+                         len(self.backend.updated))
+        self.assertIn('Indexed %i documents in default' % len(self.backend.updated),
+                      out.getvalue())
@@ -0,0 +1,81 @@
+from unittest import mock
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.test import TestCase
+from haystack import connections
+from haystack.query import SearchQuerySet
+from haystack.query import ValuesSearchQuerySet
+
+from public_interface.indexing import rebuild_connection
+from public_interface.models import Vouchers
+from public_interface.search_backend import LocalSearchBackend
+
+
+# With settings using Elasticsearch, as voseq.settings.testing_elasticsearch,
+# only the tests of what every backend does are run.
+LOCAL_SEARCH = isinstance(connections['vouchers'].get_backend(), LocalSearchBackend)
+
+
+class TestLocalSearchBackend(TestCase):
+    def setUp(self):
+        args = []
+        opts = {'dumpfile': 'test_db_dump.xml', 'verbosity': 0}
+        cmd = 'migrate_db'
+        call_command(cmd, *args, **opts)
+
+        for using in ['vouchers', 'autocomplete', 'advanced_search']:
+            rebuild_connection(using)
+        self.backend = connections['vouchers'].get_backend()
+        self.index = connections['vouchers'].get_unified_index().get_index(Vouchers)
+
+    def codes(self, sqs):
+        return sorted(i.code for i in sqs)
+
+    @skipUnless(LOCAL_SEARCH, 'Tests the embedded search backend.')
+    def test_backend(self):
+        self.assertTrue(isinstance(self.backend, LocalSearchBackend))
+
+    def test_filters(self):
+        sqs = SearchQuerySet().using('vouchers')
+        self.assertEqual(['CP100-11', 'CP100-13'], self.codes(sqs.filter(orden='lepidoptera')))
+        self.assertEqual(['CP100-10', 'CP100-11'],
+                         self.codes(sqs.filter(code__in=['CP100-10', 'CP100-11'])))
+        self.assertEqual(['CP100-11'],
+                         self.codes(sqs.filter(orden='Lepidoptera').exclude(code='CP100-13')))
+        self.assertEqual([], self.codes(sqs.filter(orden='Lepido')))
+
+    def test_partial_words_of_edge_ngram_fields(self):
+        sqs = ValuesSearchQuerySet().using('autocomplete').autocomplete(genus='melit').values('genus')
+        self.assertTrue(len(sqs) > 0)
+        self.assertEqual({'Melitaea'}, set(i['genus'].strip('?') for i in sqs))
+
+    def test_facets(self):
+        sqs = SearchQuerySet().using('advanced_search').filter(labPerson='Niklas Wahlberg').facet('code')
+        codes = [i[0] for i in sqs.facet_counts()['fields']['code']]
+        self.assertTrue('CP100-10' in codes)
+        self.assertEqual(len(codes), len(set(codes)))
+
+    def test_saved_and_removed_documents(self):
+        voucher = Vouchers.objects.get(code='CP100-10')
+        voucher.orden = 'Coleoptera'
+        self.backend.update(self.index, [voucher])
+        sqs = SearchQuerySet().using('vouchers')
+        self.assertEqual(['CP100-10'], self.codes(sqs.filter(orden='Coleoptera')))
+
+        self.backend.remove(voucher)
+        self.assertEqual([], self.codes(sqs.filter(orden='Coleoptera')))
+        self.assertEqual([], self.codes(sqs.filter(code='CP100-10')))
+
+    @skipUnless(LOCAL_SEARCH, 'Tests the embedded search backend.')
+    def test_index_is_built_again_when_delta_is_big(self):
+        build = self.backend.read_manifest()['build']
+        vouchers = list(Vouchers.objects.all())
+        self.backend.update(self.index, vouchers[:1])
+        self.assertEqual(build, self.backend.read_manifest()['build'])
+
+        with mock.patch('public_interface.search_backend.MAX_DELTA_SIZE', 2):
+            self.backend.update(self.index, vouchers[1:3])
+        self.assertNotEqual(build, self.backend.read_manifest()['build'])
+        self.assertEqual(0, self.backend.get_delta_size(self.backend.read_manifest()['build']))
+        self.assertEqual(len(vouchers), SearchQuerySet().using('vouchers').count())
@@ -12,8 +12,7 @@ from public_interface.views import VoSeqSearchView
 # Need to use a clean index for our tests
 TEST_INDEX = {
     'default': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'test_haystack',
         'INCLUDE_SPELLING': True,
         'EXCLUDED_INDEXES': [
@@ -23,8 +22,7 @@ TEST_INDEX = {
         ],
     },
     'autocomplete': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'test_autocomplete',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -33,8 +31,7 @@ TEST_INDEX = {
         ],
     },
     'vouchers': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'test_vouchers',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -44,8 +41,7 @@ TEST_INDEX = {
         ],
     },
     'advanced_search': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://127.0.0.1:9200/',
+        'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
         'INDEX_NAME': 'test_advanced_search',
         'INCLUDE_SPELLING': False,
         'EXCLUDED_INDEXES': [
@@ -12,9 +12,9 @@ from django.conf import settings
 
 from haystack.forms import SearchForm
 from haystack.views import SearchView
-from haystack.query import ValuesSearchQuerySet
 
 from core.utils import get_version_stats
+from .autocomplete import get_suggestions
 from .models import Vouchers
 from .models import FlickrImages
 from .models import Sequences
@@ -108,7 +108,8 @@ class VoSeqSearchView(SearchView):
         return {
             'simple_query': self.simple_query,
             'url_encoded_query': self.url_encoded_query,
-            'result_count': len(self.searchqueryset),
+            # Known once the page of results is fetched.
+            'result_count': len(self.results),
             'version': version,
             'stats': stats,
         }
@@ -116,7 +117,8 @@ class VoSeqSearchView(SearchView):
 
 def autocomplete(request):
     """Used for JSON queries from javascript to fill autocomplete values in
-    input boxes of advanced searches.
+    input boxes of advanced searches. The values are found in the web worker
+    with ``public_interface.autocomplete``, without querying the search engine.
 
     :param request:
     :return:
@@ -131,20 +133,14 @@ def autocomplete(request):
     except KeyError:
         raise Http404("Value for <b>term</b> query is missing.")
 
-    field_term = {field: term}
-    sqs = ValuesSearchQuerySet().using('autocomplete').autocomplete(**field_term).values(field)[:5]
-
-    suggestions = set()
-    for result in sqs:
-        suggestions.add(result[field])
-    suggestions = list(suggestions)
+    suggestions = get_suggestions(field, term)
 
     the_data = json.dumps(suggestions)
     return HttpResponse(the_data, content_type='application/json')
 
 
 def search_advanced(request):
-    """Uses the haystack index `advanced_search` to find values based on a
+    """Uses the haystack index `vouchers` to find values based on a
     combination of queries for one or more fields.
     Works in a similar way to **genus:Mopho AND species:helenor**
 
@@ -158,17 +154,16 @@ def search_advanced(request):
 
         if form.is_valid():
             sqs = form.search()
-            search_view = VoSeqSearchView(
-                url_encoded_query=request.GET.urlencode(),
-                template='public_interface/search_results.html',
-                searchqueryset=sqs,
-                form_class=AdvancedSearchForm
-            )
 
             if sqs is not None:
-                search_view.__call__(request)
-                search_view.query = sqs.query
-                return search_view.create_response()
+                # The page of results is the only query sent to the index.
+                search_view = VoSeqSearchView(
+                    url_encoded_query=request.GET.urlencode(),
+                    template='public_interface/search_results.html',
+                    searchqueryset=sqs,
+                    form_class=AdvancedSearchForm
+                )
+                return search_view(request)
             else:
                 return render(request, 'public_interface/search_results.html',
                               {
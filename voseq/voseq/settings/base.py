@@ -123,6 +123,36 @@ HAYSTACK_CONNECTIONS = {
 }
 HAYSTACK_DEFAULT_OPERATOR = 'AND'
 
+# Indexes of the embedded search backend, used instead of Elasticsearch by
+# installs that set HAYSTACK_CONNECTIONS = get_local_search_connections().
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, '..', 'search_index')
+
+
+def get_local_search_connections(haystack_connections=HAYSTACK_CONNECTIONS):
+    """
+    :return: the Haystack connections using the embedded search backend of
+             ``public_interface.search_backend`` instead of Elasticsearch.
+    """
+    local_connections = {}
+    for name, options in haystack_connections.items():
+        local_connections[name] = {
+            'ENGINE': 'public_interface.search_backend.LocalSearchEngine',
+            'INDEX_NAME': options['INDEX_NAME'],
+            'EXCLUDED_INDEXES': options['EXCLUDED_INDEXES'],
+        }
+    return local_connections
+
+# Saved vouchers and sequences are queued and sent to the search indexes by
+# ``python manage.py update_search_indexes``.
+HAYSTACK_SIGNAL_PROCESSOR = 'public_interface.signals.QueuedSignalProcessor'
+
+# Vouchers and sequences sent to the search indexes at a time.
+SEARCH_INDEX_BATCH_SIZE = 100
+
+# Changes queued for the search indexes kept when no process sends them.
+# The oldest ones are dropped beyond this number.
+SEARCH_INDEX_MAX_QUEUED_CHANGES = 100000
+
 
 # Database
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
@@ -163,6 +193,58 @@ VERSION = '2.0.0'
 
 TESTING = False
 
+# Datasets are created by worker processes started with
+# ``python manage.py run_dataset_jobs``. Set to True to create them inside
+# the request instead.
+DATASET_JOBS_ALWAYS_EAGER = False
+
+# Seconds that datasets created by workers are kept after they were last used.
+DATASET_JOBS_EXPIRY = 24 * 60 * 60
+
+# Seconds after which a running dataset job is taken as abandoned by a
+# worker that was stopped or crashed, and marked as failed.
+DATASET_JOBS_RUNNING_TIMEOUT = 2 * 60 * 60
+
+# Bytes of dataset files kept to serve identical requests. The least recently
+# used datasets are deleted when the limit is reached.
+DATASET_CACHE_MAX_SIZE = 500 * 1024 * 1024
+
+# Seconds after a dataset was last shown or downloaded during which it is not
+# deleted from the cache, so downloads in progress are not cut off.
+DATASET_CACHE_GRACE_PERIOD = 30 * 60
+
+# BLAST searches are run by worker processes started with
+# ``python manage.py run_blast_jobs``. Set to True to run them inside the
+# request instead.
+BLAST_JOBS_ALWAYS_EAGER = False
+
+# Seconds that the hits of BLAST jobs are kept once they are done.
+BLAST_JOBS_EXPIRY = 60 * 60
+
+# Seconds after which a running BLAST job is taken as abandoned by a worker
+# that was stopped or crashed, and marked as failed.
+BLAST_JOBS_RUNNING_TIMEOUT = 60 * 60
+
+# BLAST searches against all our sequences, batches and NCBI searches that
+# can run at the same time, so quick searches always find a free worker.
+BLAST_JOBS_MAX_HEAVY = 1
+
+# Threads used by each ``blastn`` run. BLAST workers can use up to this
+# number of threads each.
+BLAST_NUM_THREADS = 2
+
+# Hits shown for BLAST searches against all our sequences.
+BLAST_FULL_MAX_HITS = 100
+
+# Number of BLAST searches whose hits are kept to answer them again.
+BLAST_CACHE_MAX_RESULTS = 1000
+
+# K-mer indexes used to look for similar sequences without BLAST.
+KMER_INDEX_DIR = os.path.join(BASE_DIR, '..', 'blast_local', 'db', 'kmers')
+
+# Sequences shown when looking for similar sequences with the k-mer index.
+SIMILAR_SEQUENCES_MAX_HITS = 20
+
 # Django registration redux
 ACCOUNT_ACTIVATION_DAYS = 7  # One-week activation window; you may, of course, use a different value.
 REGISTRATION_AUTO_LOGIN = True  # Automatically log the user in.
@@ -43,3 +43,8 @@ DATABASES = {
 }
 
 INSTALLED_APPS += ('debug_toolbar',)
+
+# Installs without Elasticsearch can set "SEARCH_ENGINE": "local" in
+# config.json to use the embedded search backend.
+if secrets.get('SEARCH_ENGINE') == 'local':
+    HAYSTACK_CONNECTIONS = get_local_search_connections()
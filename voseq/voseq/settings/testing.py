@@ -7,6 +7,14 @@ print('Testing')
 
 TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
 
+DATASET_JOBS_ALWAYS_EAGER = True
+BLAST_JOBS_ALWAYS_EAGER = True
+
+# Tests search with the embedded backend, so Elasticsearch is not needed.
+HAYSTACK_CONNECTIONS = get_local_search_connections()
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, '..', 'search_index', 'testing')
+KMER_INDEX_DIR = os.path.join(BASE_DIR, '..', 'blast_local', 'db', 'kmers', 'testing')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -0,0 +1,19 @@
+"""
+Runs the tests with Elasticsearch instead of the embedded search backend, so
+the search indexes and their mappings are tested with the engine used in
+production. Elasticsearch should be running at ``ELASTICSEARCH_URL``, by
+default http://127.0.0.1:9200/, and indexes named ``test_<index>`` are
+created there.
+"""
+import copy
+
+from . import base
+from .testing import *
+
+
+print('with Elasticsearch')
+
+HAYSTACK_CONNECTIONS = copy.deepcopy(base.HAYSTACK_CONNECTIONS)
+for options in HAYSTACK_CONNECTIONS.values():
+    options['URL'] = os.environ.get('ELASTICSEARCH_URL', options['URL'])
+    options['INDEX_NAME'] = 'test_' + options['INDEX_NAME']